@@ -10,117 +10,114 @@ import numpy as np
 import openpyxl
 import random
 from selenium.common.exceptions import NoSuchElementException, ElementClickInterceptedException
+from scholar_fetch import BlockedError, HttpFirstFetcher, with_query_params
+from page_cache import PageCache
+from scholar_parser import cited_by_count, parse_html
+from checkpoint_store import CheckpointStore
+from browser_pool import run_browser_pool
+from article_table import expand_articles
+from author_resolver import resolve_authors
+from instrumentation import timed
+from scholar_ids import article_id, cluster_id, researcher_id
 
 
 '''Load data'''
 file_path = '13_researcher_sample_input.xlsx'
+sheet_name = 'Data'  # Sheet of file_path with the names, and optionally profile_column
 output_filename = 'researcher_profiles_13_typical_v1.csv'
 
-# Read the specific sheet
-sheet_name = 'Data'
-#input_df_5 = pd.read_excel(file_path, sheet_name=sheet_name, nrows = 5)
-# Read the specific sheet and select the last 5 rows
-input_df_5 = pd.read_excel(file_path, sheet_name=sheet_name)
+output_columns = [
+    'name', 'researcher_url', 'Researcher ID', 'position', 'institution_href', 'institution',
+    'personal_website', 'research_areas', 'Total Citations', 'h-index', 'i10-index', 'Annual Citation',
+    'total access articles','Articles'
+]
 
-processed_titles = set()
+# Browser pool settings
+workers = 4  # Worker processes, each with its own fetcher and (if needed) headless Chrome
+headless = True
+requests_per_second = 0.5  # Shared by all workers
+cache_directory = 'page_cache'  # Raw pages are read from here before touching the network
+output_format = 'csv'  # 'csv', 'parquet' or 'both'
+profile_column = 'Researcher ID'  # Optional input column with a profile URL or user id for the name
 
-# Check if the output file exists and read its content
-try:
-    existing_data = pd.read_csv(output_filename)
-    processed_titles.update(existing_data['name'].unique())
-    #last_processed_title = existing_data['Original Paper Title'].iloc[-1] if not existing_data.empty else None
-except FileNotFoundError:
-    # If the file does not exist, initialize it with headers
-    pd.DataFrame(columns=[
-        'name', 'researcher_url', 'position', 'institution_href', 'institution',
-        'personal_website', 'research_areas', 'Total Citations', 'h-index', 'i10-index', 'Annual Citation',
-        'total access articles','Articles'
-    ]).to_csv(output_filename, index=False)
-    last_processed_title = None
 
-
-#last_title_rows = input_df[input_df['Original Title'] == last_processed_title]
-
-## Exclude existing data
-input_df_5 = input_df_5[~input_df_5['name'].isin(processed_titles)]
+# Function to read the input names; pipeline.py starts from the same sheet
+def read_input(path=file_path):
+    return pd.read_excel(path, sheet_name=sheet_name)
 
 
 '''Extract Author's profile page by name'''
-def get_first_result_url_from_df(df, column_name):
-    # Initialize the WebDriver (use your browser's WebDriver)
-    driver = webdriver.Chrome()  # Replace with your WebDriver (e.g., webdriver.Firefox())
-    # Base URL for Google Scholar
-    base_url = "https://scholar.google.com/citations?view_op=search_authors&hl=en&oi=ao&mauthors="
-
-    # List to store results
-    results = []
-
-    try:
-        for index, row in df.iterrows():
-            # Get the search query from the DataFrame's specified column
-            search_query = row[column_name]
-            print(f"Searching for: {search_query}")
+# Function to read the optional profile URL or user id of each input row, or None without profile_column
+def given_profiles(df):
+    return df[profile_column] if profile_column in df.columns else None
 
-            # Generate the search URL
-            search_url = base_url + search_query.replace(" ", "+").replace(",", "%2C")
 
-            # Open the generated URL
-            driver.get(search_url)
-            time.sleep(2)  # Allow the page to load
-
-            try:
-                # Find the first result container
-                first_result = driver.find_element(By.CSS_SELECTOR, '.gs_ai_t h3.gs_ai_name a')
+def get_first_result_url_from_df(df, column_name):
+    # Names come from the author cache or from concurrent HTTP searches; rows with a profile URL or
+    # user id in profile_column skip the search
+    urls = resolve_authors(list(df[column_name]), given_profiles(df))
+    return pd.DataFrame({'name': list(df[column_name]), 'researcher_url': urls})
 
-                # Get the href attribute of the first result
-                first_result_url = first_result.get_attribute('href')
-                print(f"Found URL: {first_result_url}")
-            except Exception as e:
-                print(f"No results found for {search_query}: {e}")
-                first_result_url = None
 
-            # Append the result to the list
-            results.append({
-                'name': search_query,
-                'researcher_url': first_result_url
-            })
-    finally:
-        # Close the WebDriver
-        driver.quit()
+# Function to drop the names whose profile an earlier name already leads to; they count as done,
+# since the profile is scraped under the earlier name
+def drop_repeated_profiles(result_df, checkpoint=None):
+    result_df = result_df.assign(**{'Researcher ID': result_df['researcher_url'].map(researcher_id)})
+    repeated = result_df['Researcher ID'].notnull() & result_df.duplicated('Researcher ID')
+    names = list(result_df.loc[repeated, 'name'])
+    for name in names:
+        print(f"{name} has the same profile as an earlier name; skipping it.")
+    if checkpoint is not None and names:
+        checkpoint.mark_done(names)
+    return result_df[~repeated]
 
-    # Return the results as a DataFrame
-    return pd.DataFrame(results)
 
+'''Extract articles related information(brief)'''
+# Largest article page the profile endpoint serves in one request
+profile_page_size = 100
 
-# Get URLs for all names in the DataFrame
-result_author_df = get_first_result_url_from_df(input_df_5, 'name')
 
-'''Extract articles related information(brief)'''
-# Function to press "Show more" button and ensure all articles are loaded
-def load_all_articles(driver):
+# Function to request the profile's article table page by page instead of clicking "Show more"
+def iter_profile_pages(fetcher, researcher_url, page_size=profile_page_size):
+    cstart = 0
     while True:
-        try:
-            # Find the "Show more" button
-            show_more_button = driver.find_element(By.ID, "gsc_bpf_more")
+        page_url = with_query_params(researcher_url, cstart=cstart, pagesize=page_size)
+        html = fetcher.get_html(page_url, expected_marker='gsc_a_b')
+        soup = parse_html(html)
+        row_count = len(soup.find_all('tr', class_='gsc_a_tr'))
+        print(f"Loaded {row_count} articles starting at {cstart}.")
+        yield soup
+
+        # The "Show more" button is disabled once the last page is reached
+        show_more_button = soup.find('button', id='gsc_bpf_more')
+        if row_count < page_size or (show_more_button and show_more_button.has_attr('disabled')):
+            break
+        cstart += page_size
 
-            # Check if the button is disabled
-            if show_more_button.get_attribute("disabled") is not None:
-                print("'Show more' button is disabled. All articles are loaded.")
-                break
 
-            # Click the button
-            show_more_button.click()
-            print("Clicked 'Show more' button.")
+# Function to extract the article rows of one profile page
+def extract_articles(soup):
+    articles = []
+    article_elements = soup.find_all('tr', class_='gsc_a_tr')
 
-            # Wait for the next set of articles to load
-            time.sleep(3)
+    for article_element in article_elements:
+        try:
+            article_title = article_element.find('a', class_='gsc_a_at').text
+            article_year = article_element.find('td', class_='gsc_a_y').find('span', class_='gsc_a_h').get_text(
+                strip=True)
+            article_tag = article_element.find('a', class_='gsc_a_at')  # Locate the <a> tag
+            article_url = f"https://scholar.google.com{article_tag.get('href')}" if article_tag else None
+            # The "Cited by" count links to the paper's cluster, which co-authors' profiles share;
+            # it is left empty for papers nobody has cited yet
+            cited_by_tag = article_element.find('a', class_='gsc_a_ac')
+            articles.append({'Title': article_title, 'Year': article_year, 'URL': article_url,
+                             'Article ID': article_id(article_url),
+                             'Cluster ID': cluster_id(cited_by_tag.get('href')) if cited_by_tag else None,
+                             'Citations': (cited_by_count(cited_by_tag) or 0) if cited_by_tag else None})
+        except Exception as e:
+            print(f"Error extracting article: {e}")
 
-        except NoSuchElementException:
-            print("'Show more' button is no longer available.")
-            break
-        except ElementClickInterceptedException:
-            print("'Show more' button click intercepted. Retrying...")
-            time.sleep(2)
+    return articles
 
 
 '''Extract Annual Citation Data'''
@@ -156,185 +153,151 @@ def extract_public_access_articles(soup):
 
     return total_articles
 
-# Main scraping loop for researchers
-def scrape_researcher_data(result_df, output_filename):
-    # Configure Selenium WebDriver
-    options = webdriver.ChromeOptions()
-    options.page_load_strategy = 'normal'
-    driver = webdriver.Chrome(options=options)
-
-    # Initialize data storage
-    data = []
-    batch_size = 1
-
-    # Loop through each researcher URL
-    for index, row in result_df.iterrows():
-        researcher_url = row['researcher_url']
-        name = row['name']
-        print(f"Processing URL: {researcher_url}...")
-        try:
-            # Navigate to the researcher's profile URL
-            driver.get(researcher_url)
-            driver.implicitly_wait(10)
-            time.sleep(random.uniform(5, 8))
-
-            # Load all articles by pressing "Show more"
-            load_all_articles(driver)
-
-            # Extract HTML source
-            html = driver.page_source
-            soup = BeautifulSoup(html, 'html.parser')
-
-            # Extract Position and Institution
-            position_institution_div = soup.find('div', class_='gsc_prf_il')
-            position, institution_href, institution = None, None, None
-            if position_institution_div:
-                # Extract full text and split by commas
-                full_text = position_institution_div.get_text(strip=True)
-                text_parts = [part.strip() for part in full_text.split(",")]
-
-                # Keywords for identifying position and institution
-                position_keywords = ["professor", "prof", "director", "head"]
-                institution_keywords = ["institute", "university", "school", "college", "campus"]
-
-                # Search for position and institution
-                for part in text_parts:
-                    lower_part = part.lower()
-                    if any(keyword in lower_part for keyword in position_keywords):
-                        position = part
-                    elif any(keyword in lower_part for keyword in institution_keywords):
-                        institution = part
-
-                # Extract institution href if available
-                institution_tag = position_institution_div.find('a', class_='gsc_prf_ila')
-                if institution_tag:
-                    institution_href = f"https://scholar.google.com{institution_tag['href']}"
-                    if not institution:
-                        institution = institution_tag.get_text(strip=True)
-
-            # Extract Personal Website
-            personal_website = None
-            personal_website_div = soup.find('div', id='gsc_prf_ivh')
-            if personal_website_div:
-                personal_website_tag = personal_website_div.find('a', rel='nofollow')
-                if personal_website_tag:
-                    personal_website = personal_website_tag['href']
-
-            # Extract Research Areas
-            research_areas_div = soup.find('div', id='gsc_prf_int')
-            research_areas = []
-            if research_areas_div:
-                research_areas_tags = research_areas_div.find_all('a', class_='gsc_prf_inta')
-                research_areas = [area.get_text(strip=True) for area in research_areas_tags]
-
-            # Extract Metrics from Citation Table
-            metrics_table = soup.find('table', id='gsc_rsb_st')
-            total_citations, h_index, i10_index = None, None, None
-            if metrics_table:
-                rows = metrics_table.find('tbody').find_all('tr')
-                for row in rows:
-                    metric_name = row.find('td', class_='gsc_rsb_sc1').get_text(strip=True)
-                    all_value = row.find_all('td', class_='gsc_rsb_std')[0].get_text(strip=True)
-                    if metric_name == "Citations":
-                        total_citations = all_value
-                    elif metric_name == "h-index":
-                        h_index = all_value
-                    elif metric_name == "i10-index":
-                        i10_index = all_value
-
-            # Extract Additional Data
-            annual_citations = extract_annual_citations(soup)
-            public_access_articles = extract_public_access_articles(soup)
-
-            # Extract Articles
-            articles = []
-            article_elements = soup.find_all('tr', class_='gsc_a_tr')
-
-            for article_element in article_elements:
-                try:
-                    article_title = article_element.find('a', class_='gsc_a_at').text
-                    article_year = article_element.find('td', class_='gsc_a_y').find('span', class_='gsc_a_h').get_text(
-                        strip=True)
-                    article_tag = article_element.find('a', class_='gsc_a_at')  # Locate the <a> tag
-                    article_url = f"https://scholar.google.com{article_tag.get('href')}" if article_tag else None
-                    articles.append({'Title': article_title, 'Year': article_year, 'URL': article_url})
-                except Exception as e:
-                    print(f"Error extracting article: {e}")
-
-            # Append data
-            data.append({
-                'name': name,
-                'researcher_url': researcher_url,
-                'position': position,
-                'institution_href': institution_href,
-                'institution': institution,
-                'personal_website': personal_website,
-                'research_areas': ", ".join(research_areas),
-                'Total Citations': total_citations,
-                'h-index': h_index,
-                'i10-index': i10_index,
-                'Annual Citation': annual_citations,
-                'total access articles': public_access_articles,
-                'Articles': articles
-            })
-
-            # Save data in batches
-            if len(data) >= batch_size:
-                print(f"Saving batch of {len(data)} records...")
-                pd.DataFrame(data).to_csv(output_filename, mode='a', header=False, index=False)
-                data = []  # Reset the batch list
-
-        except Exception as e:
-            print(f"Error processing URL {researcher_url}: {e}")
-            continue
-
-    # Save any remaining data
-    if data:
-        print(f"Saving final batch of {len(data)} records...")
-        pd.DataFrame(data).to_csv(output_filename, mode='a', header=False, index=False)
+# Function to extract the profile header, metrics and citation graph
+def extract_profile_details(soup):
+    # Extract Position and Institution
+    position_institution_div = soup.find('div', class_='gsc_prf_il')
+    position, institution_href, institution = None, None, None
+    if position_institution_div:
+        # Extract full text and split by commas
+        full_text = position_institution_div.get_text(strip=True)
+        text_parts = [part.strip() for part in full_text.split(",")]
+
+        # Keywords for identifying position and institution
+        position_keywords = ["professor", "prof", "director", "head"]
+        institution_keywords = ["institute", "university", "school", "college", "campus"]
+
+        # Search for position and institution
+        for part in text_parts:
+            lower_part = part.lower()
+            if any(keyword in lower_part for keyword in position_keywords):
+                position = part
+            elif any(keyword in lower_part for keyword in institution_keywords):
+                institution = part
+
+        # Extract institution href if available
+        institution_tag = position_institution_div.find('a', class_='gsc_prf_ila')
+        if institution_tag:
+            institution_href = f"https://scholar.google.com{institution_tag['href']}"
+            if not institution:
+                institution = institution_tag.get_text(strip=True)
+
+    # Extract Personal Website
+    personal_website = None
+    personal_website_div = soup.find('div', id='gsc_prf_ivh')
+    if personal_website_div:
+        personal_website_tag = personal_website_div.find('a', rel='nofollow')
+        if personal_website_tag:
+            personal_website = personal_website_tag['href']
+
+    # Extract Research Areas
+    research_areas_div = soup.find('div', id='gsc_prf_int')
+    research_areas = []
+    if research_areas_div:
+        research_areas_tags = research_areas_div.find_all('a', class_='gsc_prf_inta')
+        research_areas = [area.get_text(strip=True) for area in research_areas_tags]
+
+    # Extract Metrics from Citation Table
+    metrics_table = soup.find('table', id='gsc_rsb_st')
+    total_citations, h_index, i10_index = None, None, None
+    if metrics_table:
+        rows = metrics_table.find('tbody').find_all('tr')
+        for row in rows:
+            metric_name = row.find('td', class_='gsc_rsb_sc1').get_text(strip=True)
+            all_value = row.find_all('td', class_='gsc_rsb_std')[0].get_text(strip=True)
+            if metric_name == "Citations":
+                total_citations = all_value
+            elif metric_name == "h-index":
+                h_index = all_value
+            elif metric_name == "i10-index":
+                i10_index = all_value
+
+    return {
+        'position': position,
+        'institution_href': institution_href,
+        'institution': institution,
+        'personal_website': personal_website,
+        'research_areas': ", ".join(research_areas),
+        'Total Citations': total_citations,
+        'h-index': h_index,
+        'i10-index': i10_index,
+        'Annual Citation': extract_annual_citations(soup),
+        'total access articles': extract_public_access_articles(soup),
+    }
+
+
+# Function to scrape one researcher's profile; runs inside a browser pool worker
+def scrape_researcher_profile(fetcher, row):
+    researcher_url = row['researcher_url']
+    name = row['name']
+    print(f"Processing URL: {researcher_url}...")
+    try:
+        # Load the profile's first page; it also carries the profile header
+        profile_pages = iter_profile_pages(fetcher, researcher_url)
+        soup = next(profile_pages)
+
+        # Extract profile details from the first page
+        profile = {'name': name, 'researcher_url': researcher_url, 'Researcher ID': researcher_id(researcher_url)}
+        with timed('extract'):
+            profile.update(extract_profile_details(soup))
+
+            # Extract Articles, one page of the article table at a time
+            articles = extract_articles(soup)
+        for page_soup in profile_pages:
+            with timed('extract'):
+                articles.extend(extract_articles(page_soup))
+        profile['Articles'] = articles
+        return [profile]
+
+    except BlockedError:
+        # Not an empty profile: the worker tries it again after the host's pause
+        raise
+    except Exception as e:
+        # The worker counts the researcher as failed, to be tried again on the next run
+        print(f"Error processing URL {researcher_url}: {e}")
+        raise
 
-    # Close the WebDriver
-    driver.quit()
 
-scrape_researcher_data(result_author_df, output_filename)
+# Main scraping loop for researchers
+def scrape_researcher_data(result_df, output_filename, checkpoint=None):
+    # Profiles are fetched in parallel; this process is the single writer of the output file
+    run_browser_pool(scrape_researcher_profile, result_df.to_dict('records'), output_filename, output_columns,
+                     workers=workers, headless=headless, requests_per_second=requests_per_second, batch_size=1,
+                     cache_directory=cache_directory, checkpoint=checkpoint, key_column='name',
+                     output_format=output_format, stage='researcher_profiles')
 
-output_filename_excel = 'researcher_profiles_13_typical_v1.xlsx'
-df = pd.read_csv(output_filename)
-df.to_excel(output_filename_excel)
 
-# Scrape researcher data
-#df_professor_info = scrape_researcher_data(result_author_df)
+if __name__ == '__main__':
+    # Read the specific sheet
+    input_df_5 = read_input(file_path)
 
-# Save the results to a CSV file
-#df_professor_info.to_csv('researcher_profiles.csv', index=False)
+    # Resume from the checkpoint store instead of re-reading the whole output
+    checkpoint = CheckpointStore('researcher_profiles')
+    checkpoint.import_existing(output_filename, 'name')
 
-# Save the results to a CSV file
-#df_professor_info.to_csv('researcher_profiles.csv', index=False)
-# 假设 df_professor_info 是已经存在的数据框
-df_professor_info = pd.read_csv(output_filename) # 如果数据来自CSV文件，可以使用这行代码读取
-df_professor_info['Articles']=df_professor_info['Articles'] .apply(eval)
+    ## Exclude existing data
+    input_df_5 = checkpoint.pending(input_df_5, 'name')
 
-# Step 1: Explode the articles column
-df_professor_info = df_professor_info.explode('Articles')
-df_expanded = df_professor_info['Articles'].apply(pd.Series)
-df_professor_info = pd.concat([df_professor_info, df_expanded], axis=1)
-df_professor_info = df_professor_info.drop(columns=['Articles'])
-print(df_professor_info)
-#
-#
-# # Step 2: Normalize the articles dictionary into separate columns
-# articles_df = pd.json_normalize(df_professor_info['Articles'])
-#
-# # Step 3: Merge back with the Researcher column
-# result_df = df_professor_info.drop(columns=['Articles']).reset_index(drop=True)
-# result_professor_info_df = pd.concat([result_df, articles_df], axis=1)
-#
-# # Save the results to a CSV file
-df_professor_info.to_csv('researcher_profiles_13_typical_v1_expand.csv', index=False)
-df_professor_info.to_excel('researcher_profiles_13_typical_v1_expand.xlsx', index=False)
+    # Get URLs for all names in the DataFrame
+    result_author_df = get_first_result_url_from_df(input_df_5, 'name')
 
+    # Names that lead to the same profile are scraped once
+    result_author_df = drop_repeated_profiles(result_author_df, checkpoint)
 
+    scrape_researcher_data(result_author_df, output_filename, checkpoint)
 
+    output_filename_excel = 'researcher_profiles_13_typical_v1.xlsx'
+    if output_format != 'parquet':
+        df = pd.read_csv(output_filename)
+        df.to_excel(output_filename_excel)
 
+    # Scrape researcher data
+    #df_professor_info = scrape_researcher_data(result_author_df)
 
+    # Save the results to a CSV file
+    #df_professor_info.to_csv('researcher_profiles.csv', index=False)
 
+    # One row per article, built chunk by chunk from the saved profiles (Parquet when it was written)
+    expand_articles(output_filename, 'researcher_profiles_13_typical_v1_expand.csv',
+                    'researcher_profiles_13_typical_v1_expand.xlsx',
+                    source='csv' if output_format == 'csv' else 'parquet')
@@ -10,272 +10,239 @@ import numpy as np
 import openpyxl
 import random
 from selenium.common.exceptions import NoSuchElementException, ElementClickInterceptedException
-import unicodedata
 import re
+from urllib.parse import quote_plus
+from browser_pool import run_browser_pool
+from instrumentation import timed
+from parse_pool import parse
+from scholar_fetch import BlockedError
+from scholar_parser import cited_by_count, parse_html
+from checkpoint_store import CheckpointStore
+from input_stream import iter_input_rows
+from scholar_ids import cluster_id, has_value
+from title_index import extract_abstract, normalize_text, open_title_index, result_entries
 
 """load input data"""
 file_path = 'paper_details.csv'
 output_filename = '1by1_searched_paper_details_v2.csv'
-
-# Read input and output data
-input_df = pd.read_csv(file_path)
-processed_titles = set()
-
-# Check if the output file exists and read its content
-try:
-    existing_data = pd.read_csv(output_filename)
-    processed_titles.update(existing_data['Matched Title'].unique())
-    #last_processed_title = existing_data['Original Paper Title'].iloc[-1] if not existing_data.empty else None
-except FileNotFoundError:
-    # If the file does not exist, initialize it with headers
-    pd.DataFrame(columns=[
-        'Matched Title','URL','Abstract','Cited Articles URL','Authors with URLs','Original Title','Original URL'
-    ]).to_csv(output_filename, index=False)
-    last_processed_title = None
-
-
-#last_title_rows = input_df[input_df['Original Title'] == last_processed_title]
-
-## Exclude existing data
-input_df = input_df[~input_df['title'].isin(processed_titles)]
-
-
-# Function to replace problematic characters with ASCII equivalents and remove surrounding quotes
-def normalize_text(text):
-    # Normalize Unicode (NFKD) and replace special characters with standard ones
-    text = unicodedata.normalize('NFKD', text)
-    text = text.replace("’", "'")  # Replace right single quote with ASCII apostrophe
-    text = text.replace("“", '"').replace("”", '"')  # Replace smart quotes with ASCII quotes
-    text = text.replace("–", "-")  # Replace en dash with hyphen
-    text = ' '.join(text.split())  # Remove extra spaces
-
-    # Remove any enclosing quotes (single or double)
-    if text.startswith('"') and text.endswith('"'):
-        text = text[1:-1]
-    elif text.startswith("'") and text.endswith("'"):
-        text = text[1:-1]
-
-    return text
-
-
-# Function to extract text from HTML while handling inline tags like <b>, <i>, etc.
-def extract_text_with_inline_tags(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    return normalize_text(soup.get_text(separator=""))
-
-def search_google_scholar_details(title_query):
-    try:
-        # Open Google Scholar
-        driver.get('https://scholar.google.com')
-        driver.implicitly_wait(10)
-
-        # Find the search box and enter the title query
-        search_box = driver.find_element(By.NAME, 'q')
-        search_box.clear()
-        search_box.send_keys(title_query)
-        time.sleep(random.uniform(2, 4))
-        search_box.send_keys(Keys.RETURN)
-        time.sleep(random.uniform(5, 7))  # Wait for results to load
-
-        # Parse the page source with BeautifulSoup
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-        results = soup.find_all('div',
-                                class_=['gs_r gs_or gs_scl', 'gs_r gs_or gs_scl gs_fmar'])  # All search result divs
-
-        matched_title = None
-        matched_url = None
-        abstract_text = None
-        cited_articles_url = None
-        authors_with_urls = {}
-
-        if results:
-            for result in results:
-                try:
-                    # Extract title HTML and process inline tags
-                    title_tag = result.find('h3', class_='gs_rt')
-                    if title_tag:
-                        title_html = str(title_tag)  # Get the raw HTML
-                        extracted_title = normalize_text(extract_text_with_inline_tags(title_html))
-                        # Remove unwanted prefixes like [CITATION], [C], etc.
-                        extracted_title = re.sub(r'\[.*?\]', '', extracted_title).strip()
-
-                        extracted_title = ' '.join(extracted_title.split())
-                        title_query = ' '.join(title_query.split())
-
-                    # Compare the extracted title with the query
-                    if normalize_text(extracted_title.lower()) == normalize_text(title_query.lower()):
-                        matched_title = extracted_title
-                        matched_url = title_tag.find('a')['href'] if title_tag.find('a') else None
-                        #Extract Abstract
-
-                        try:
-                            # First attempt to get abstract from `gsh_csp`
-                            gsh_sp_element = result.find('div', class_='gsh_csp')
-                            if gsh_sp_element:
-                                abstract_text = gsh_sp_element.text.strip()
-                            else:
-                                # Try to get abstract from `gs_rs`
-                                abstract_div = result.find('div', class_='gs_rs')
-                                if abstract_div:
-                                    abstract_text = abstract_div.get_text(separator=" ").strip()
-                                else:
-                                    # Handle complex abstract structure in `gs_fma_snp`
-                                    abstract_container = result.find('div', class_='gs_fma_snp')
-                                    if abstract_container:
-                                        abstract_text = ' '.join(
-                                            [div.text.strip() for div in
-                                             abstract_container.find_all('div', class_='gsh_csp') if div.text.strip()]
-                                        )
-                                    else:
-                                        # Handle abstract from `gs_rs gs_fma_s`
-                                        abstract_special = result.find('div', class_='gs_rs gs_fma_s')
-                                        if abstract_special:
-                                            # Extract and handle <br> tags within the text
-                                            abstract_text = abstract_special.get_text(separator=" ").replace('\xa0',
-                                                                                                             ' ').strip()
-                                        else:
-                                            # Handle nested structures with <br> tags explicitly in `gs_fma_snp`
-                                            abstract_nested = result.find('div', class_='gs_fma_snp')
-                                            if abstract_nested:
-                                                abstract_text = ' '.join(
-                                                    [
-                                                        part.strip().replace('\xa0', ' ')
-                                                        for part in
-                                                        abstract_nested.get_text(separator=" ").split('<br>')
-                                                        if part.strip()
-                                                    ]
-                                                )
-                        except Exception:
-                            pass
-
-                        # Extract cited articles URL
-                        cited_by_tag = result.find('a', text= lambda x: x and (x.startswith('Cited by') or x.startswith('被引用次数')))
-                        cited_articles_url = (
-                            f"https://scholar.google.com{cited_by_tag['href']}"
-                            if cited_by_tag
-                            else None
-                        )
-
-                        # Extract authors and their URLs
-                        authors_tag = result.find('div', class_=['gs_a', 'gs_fmaa'])
-                        if authors_tag:
-                            authors_links = authors_tag.find_all('a')
-                            for author_link in authors_links:
-                                author_name = author_link.get_text(strip=True)
-                                author_url = f"https://scholar.google.com{author_link['href']}" if author_link.has_attr('href') else None
-                                authors_with_urls[author_name] = author_url
-
-                        break  # Exit loop if an exact match is found
-
-                except Exception as e:
-                    print(f"Error processing a result: {e}")
-                    continue
-
-            # If no exact match is found but there's only one result, treat it as matched
-            if not matched_title and len(results) == 1:
-                single_result = results[0]
-                try:
-                    title_tag = single_result.find('h3', class_='gs_rt')
-                    if title_tag:
-                        matched_title = title_tag.get_text(strip=True)
-                        matched_url = title_tag.find('a')['href'] if title_tag.find('a') else None
-
-                        # Try to extract the abstract
-                        try:
-                            # First attempt to get abstract from `gsh_csp`
-                            gsh_sp_element = result.find('div', class_='gsh_csp')
-                            if gsh_sp_element:
-                                abstract_text = gsh_sp_element.text.strip()
-                            else:
-                                # Try to get abstract from `gs_rs`
-                                abstract_div = result.find('div', class_='gs_rs')
-                                if abstract_div:
-                                    abstract_text = abstract_div.get_text(separator=" ").strip()
-                                else:
-                                    # Handle complex abstract structure
-                                    abstract_container = result.find('div', class_='gs_fma_snp')
-                                    if abstract_container:
-                                        abstract_text = ' '.join(
-                                            [div.text.strip() for div in abstract_container.find_all('div') if
-                                             div.text.strip()]
-                                        )
-                        except Exception:
-                            pass
+output_columns = [
+    'Matched Title','URL','Abstract','Cited Articles URL','Authors with URLs','Original Title','Original URL',
+    'Article ID','Cluster ID','Cited By Count'
+]
+
+# Browser pool settings
+workers = 4  # Worker processes fetching pages, each with its own fetcher and (if needed) headless Chrome
+headless = True
+requests_per_second = 0.5  # Shared by all workers
+cache_directory = 'page_cache'  # Raw pages are read from here before touching the network
+output_format = 'csv'  # 'csv', 'parquet' (typed nested columns) or 'both'
+title_index_path = 'title_index.sqlite3'  # Titles seen on earlier results pages, answered without a search
+use_title_index = True
+scholar_search_url = 'https://scholar.google.com/scholar?q='  # Results page for a title query
+
+
+# Function to extract text from a tag while handling inline tags like <b>, <i>, etc.
+def extract_text_with_inline_tags(tag):
+    return normalize_text(tag.get_text(separator=""))
+
+# Function to find the result matching title_query on a parsed results page
+def extract_search_details(soup, title_query):
+    results = soup.find_all('div',
+                            class_=['gs_r gs_or gs_scl', 'gs_r gs_or gs_scl gs_fmar'])  # All search result divs
+
+    matched_title = None
+    matched_url = None
+    abstract_text = None
+    cited_articles_url = None
+    cited_by = None
+    authors_with_urls = {}
+
+    if results:
+        for result in results:
+            try:
+                # Extract title HTML and process inline tags
+                title_tag = result.find('h3', class_='gs_rt')
+                if title_tag:
+                    extracted_title = normalize_text(extract_text_with_inline_tags(title_tag))
+                    # Remove unwanted prefixes like [CITATION], [C], etc.
+                    extracted_title = re.sub(r'\[.*?\]', '', extracted_title).strip()
+
+                    extracted_title = ' '.join(extracted_title.split())
+                    title_query = ' '.join(title_query.split())
+
+                # Compare the extracted title with the query
+                if normalize_text(extracted_title.lower()) == normalize_text(title_query.lower()):
+                    matched_title = extracted_title
+                    matched_url = title_tag.find('a')['href'] if title_tag.find('a') else None
+                    #Extract Abstract
+                    abstract_text = extract_abstract(result)
 
                     # Extract cited articles URL
-                    cited_by_tag = single_result.find('a', text=lambda x: x and (x.startswith('Cited by') or x.startswith('被引用次数')))
+                    cited_by_tag = result.find('a', text= lambda x: x and (x.startswith('Cited by') or x.startswith('被引用次数')))
                     cited_articles_url = (
                         f"https://scholar.google.com{cited_by_tag['href']}"
                         if cited_by_tag
                         else None
                     )
+                    cited_by = cited_by_count(cited_by_tag)
 
                     # Extract authors and their URLs
-                    authors_tag = single_result.find('div', class_=['gs_a', 'gs_fmaa'])
+                    authors_tag = result.find('div', class_=['gs_a', 'gs_fmaa'])
                     if authors_tag:
                         authors_links = authors_tag.find_all('a')
                         for author_link in authors_links:
                             author_name = author_link.get_text(strip=True)
                             author_url = f"https://scholar.google.com{author_link['href']}" if author_link.has_attr('href') else None
                             authors_with_urls[author_name] = author_url
-                except Exception as e:
-                    print(f"Error processing single result: {e}")
-
-        # Return matched data
-        return {
-            'Matched Title': matched_title,
-            'URL': matched_url,
-            'Abstract': abstract_text,
-            'Cited Articles URL': cited_articles_url,
-            'Authors with URLs': authors_with_urls,
-        }
 
+                    break  # Exit loop if an exact match is found
+
+            except Exception as e:
+                print(f"Error processing a result: {e}")
+                continue
+
+        # If no exact match is found but there's only one result, treat it as matched
+        if not matched_title and len(results) == 1:
+            single_result = results[0]
+            try:
+                title_tag = single_result.find('h3', class_='gs_rt')
+                if title_tag:
+                    matched_title = title_tag.get_text(strip=True)
+                    matched_url = title_tag.find('a')['href'] if title_tag.find('a') else None
+
+                    # Try to extract the abstract
+                    abstract_text = extract_abstract(single_result)
+
+                # Extract cited articles URL
+                cited_by_tag = single_result.find('a', text=lambda x: x and (x.startswith('Cited by') or x.startswith('被引用次数')))
+                cited_articles_url = (
+                    f"https://scholar.google.com{cited_by_tag['href']}"
+                    if cited_by_tag
+                    else None
+                )
+                cited_by = cited_by_count(cited_by_tag)
+
+                # Extract authors and their URLs
+                authors_tag = single_result.find('div', class_=['gs_a', 'gs_fmaa'])
+                if authors_tag:
+                    authors_links = authors_tag.find_all('a')
+                    for author_link in authors_links:
+                        author_name = author_link.get_text(strip=True)
+                        author_url = f"https://scholar.google.com{author_link['href']}" if author_link.has_attr('href') else None
+                        authors_with_urls[author_name] = author_url
+            except Exception as e:
+                print(f"Error processing single result: {e}")
+
+    # Return matched data
+    return {
+        'Matched Title': matched_title,
+        'URL': matched_url,
+        'Abstract': abstract_text,
+        'Cited Articles URL': cited_articles_url,
+        'Cited By Count': cited_by,
+        'Authors with URLs': authors_with_urls,
+    }
+
+
+# Function to request the results page for a title query
+def fetch_search_page(fetcher, title_query):
+    search_url = scholar_search_url + quote_plus(title_query)
+    return fetcher.get_html(search_url, expected_marker='gs_res_ccl')
+
+
+# Function to pick the match for a title query from its fetched results page; runs in a parse worker.
+# Every result on the page comes back too, for the writing process to put in the title index
+def parse_search_page(html, title_query):
+    try:
+        soup = parse_html(html)
+        entries = result_entries(soup)
+        with timed('extract'):
+            return extract_search_details(soup, title_query), entries
     except Exception as e:
+        # Not a "no match": the writer counts the title as failed, to be searched again on the next run
         print(f"Error during search for '{title_query}': {e}")
-        return {
-            'Matched Title': None,
-            'URL': None,
-            'Abstract': None,
-            'Cited Articles URL': None,
-            'Authors with URLs': {},
-        }
-
+        raise
 
-# Configure Selenium WebDriver
-options = webdriver.ChromeOptions()
-options.page_load_strategy = 'normal'
-driver = webdriver.Chrome(options=options)
 
-# Initialize storage for new rows
-batch_size = 10
-detailed_data = []
+# Function to index the titles a results page listed, so later queries for them need no search.
+# Only the writing process calls it: parse workers neither share its settings nor its SQLite lock
+def index_titles(entries):
+    if use_title_index and entries:
+        open_title_index(title_index_path).add(entries)
 
 
-# Process each title in the DataFrame
-for index, row in input_df.iterrows():
+# Function to answer one input title from the title index, or fetch its results page; runs inside a browser pool worker
+def fetch_title_row(fetcher, row):
     title_query = row['title']
     print(f"Processing: {title_query}...")
-    result = search_google_scholar_details(title_query)
+    result = None
+    if use_title_index:
+        title_index = open_title_index(title_index_path)
+        # A similar title is only taken when it is the same paper, known by its cluster id
+        result = title_index.lookup(title_query) or title_index.near_match(title_query, row.get('Cluster ID'))
+    if result is not None:
+        print(f"Found in the title index: {result['Matched Title']}")
+        return {'result': result}
+    try:
+        return {'html': fetch_search_page(fetcher, title_query)}
+    except BlockedError:
+        # Not a "no match": the worker hands the title back for a later attempt
+        raise
+    except Exception as e:
+        print(f"Error during search for '{title_query}': {e}")
+        raise
+
+
+# Function to build the output row for one input title, and the titles to index; runs in a parse worker
+def parse_title_row(fetched, row):
+    if 'result' in fetched:
+        result, entries = fetched['result'], []
+    else:
+        result, entries = parse_search_page(fetched['html'], row['title'])
 
     # Add the original title and URL to the result
     result['Original Title'] = row['title']
     result['Original URL'] = row['paper url']
 
+    # Carry the paper's IDs; the matched result's "Cited by" link names its cluster
+    result['Article ID'] = row.get('Article ID') if has_value(row.get('Article ID')) else None
+    result['Cluster ID'] = cluster_id(result['Cited Articles URL'])
+    if result['Cluster ID'] is None and has_value(row.get('Cluster ID')):
+        result['Cluster ID'] = row['Cluster ID']
+
     # If no match, keep only the original title and URL
     if not result['Matched Title']:
         result['Abstract'] = None
-    detailed_data.append(result)
+    return [result], entries
+
+
+# Function to skip input rows without a title as they are read: there is nothing to search, and their
+# empty or NaN cells would all share one checkpoint key
+def titled_rows(rows):
+    return (row for row in rows if has_value(row['title']))
+
+
+# Function to search one input title, parsing in the parse pool
+def search_title_row(fetcher, row):
+    rows, entries = parse(parse_title_row, fetch_title_row(fetcher, row), row)
+    index_titles(entries)
+    return rows
 
-    # Save data in batches
-    if len(detailed_data) >= batch_size:
-        print(f"Saving batch of {len(detailed_data)} records...")
-        pd.DataFrame(detailed_data).to_csv(output_filename, mode='a', header=False, index=False)
-        detailed_data = []  # Reset batch list
 
-# Save any remaining data after processing all rows
-if detailed_data:
-    print(f"Saving final batch of {len(detailed_data)} records...")
-    pd.DataFrame(detailed_data).to_csv(output_filename, mode='a', header=False, index=False)
+if __name__ == '__main__':
+    # Stream only the columns the search needs, a chunk at a time
+    rows = titled_rows(iter_input_rows(file_path, ['title', 'paper url'], optional=['Article ID', 'Cluster ID']))
 
+    # Resume from the checkpoint store instead of re-reading the whole output
+    checkpoint = CheckpointStore('title_search')
+    checkpoint.import_existing(output_filename, 'Original Title')
 
+    ## Exclude existing data
+    rows = checkpoint.pending_rows(rows, 'title')
 
+    # Search titles in parallel, parsing the results pages in the parse pool; this process is the single writer
+    run_browser_pool(fetch_title_row, rows, output_filename,
+                     output_columns, workers=workers, headless=headless, requests_per_second=requests_per_second,
+                     cache_directory=cache_directory, checkpoint=checkpoint, key_column='title',
+                     output_format=output_format, stage='title_search', parse_func=parse_title_row,
+                     extras_func=index_titles)
@@ -1,134 +1,287 @@
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
-import time
-import random
+import asyncio
+import re
+from collections import deque
+from scholar_fetch import AsyncFetcher, BlockedError, with_query_params
+from page_cache import PageCache
+from scholar_parser import cited_by_count, parse_html
+from checkpoint_store import CheckpointStore
+from input_stream import iter_input_rows
+from instrumentation import count, set_stage, timed
+from parse_pool import close_parse_pool, parse_async
+from result_sink import open_sink
+from scholar_ids import cluster_id, paper_key
+from title_index import open_title_index, result_entries
 
 # Load input data
 file_path = '1by1_searched_paper_details.csv'
 output_file = 'cited_articles_with_original.csv'
 
-# Read input and output data
-input_df = pd.read_csv(file_path)
-processed_titles = set()
+# Fetch settings
+concurrency = 8  # Pages downloading at the same time
+requests_per_second = 0.5  # Budget per host, shared by all pages in flight
+papers_in_flight = 16  # Papers being scraped at the same time
+results_per_page = 20  # The most results Scholar puts on one page
+max_results = 1000  # Scholar lists no results past this offset, however many citations a paper has
+cache_directory = 'page_cache'  # Raw pages are read from here before touching the network
+output_format = 'csv'  # 'csv', 'parquet' (typed nested columns) or 'both'
+requeue_rounds = 2  # Passes over the papers a block interrupted, once the host's pause is over
+title_index_path = 'title_index.sqlite3'  # Citing articles are added here for stage 3 to find without a search
+use_title_index = True
 
-# Check if the output file exists and read its content
-try:
-    existing_data = pd.read_csv(output_file)
-    processed_titles.update(existing_data['Original Paper Title'].unique())
-except FileNotFoundError:
-    # If the file does not exist, initialize it with headers
-    pd.DataFrame(columns=[
-        'Original Paper Title', 'Original Paper URL', 'Original Cited Page URL',
-        'Cited Article Title', 'Cited Article URL', 'Next Cited Articles URL'
-    ]).to_csv(output_file, index=False)
+output_columns = [
+    'Original Paper Title', 'Original Paper URL', 'Original Cited Page URL', 'Original Cluster ID',
+    'Cited Article Title', 'Cited Article URL', 'Next Cited Articles URL', 'Cited Article Cluster ID',
+    'Cited Article Cited By Count'
+]
 
-# Exclude existing data
-input_df = input_df[~input_df['Original Title'].isin(processed_titles)]
-input_df = input_df[input_df['Cited Articles URL'].notnull()]
 
+# Function to extract the cited articles listed on one results page
+def extract_cited_articles(soup, row):
+    articles = []
+    results = soup.find_all('div', class_=['gs_r gs_or gs_scl', 'gs_r gs_or gs_scl gs_fmar'])
+    for result in results:
+        try:
+            # Extract title and URL
+            title_tag = result.find('h3', class_='gs_rt')
+            title, url = None, None
+            if title_tag:
+                title = title_tag.get_text(separator=" ", strip=True)
+                url = title_tag.find('a')['href'] if title_tag.find('a') else None
 
-# Function to scrape cited articles for a given URL using requests
-def scrape_cited_articles(row):
+            # Extract cited articles URL
+            cited_by_tag = result.find('a', text=lambda x: x and (
+                    x.startswith('Cited by') or x.startswith('被引用次数')))
+            cited_articles_url = (
+                f"https://scholar.google.com{cited_by_tag['href']}"
+                if cited_by_tag
+                else None
+            )
+
+            # Append the cited article data along with the original paper details
+            articles.append({
+                'Original Paper Title': row['Original Title'],
+                'Original Paper URL': row['URL'],
+                'Original Cited Page URL': row['Cited Articles URL'],
+                'Original Cluster ID': cluster_id(row['Cited Articles URL']),
+                'Cited Article Title': title,
+                'Cited Article URL': url,
+                'Next Cited Articles URL': cited_articles_url,
+                'Cited Article Cluster ID': cluster_id(cited_articles_url),
+                'Cited Article Cited By Count': cited_by_count(cited_by_tag)
+            })
+        except Exception as e:
+            print(f"Error processing a result: {e}")
+            continue
+    return articles
+
+
+# Function to read the total from "About 1,230 results (0.03 sec)" above the result list
+def parse_result_count(soup):
+    summary = soup.find('div', id='gs_ab_md')
+    if not summary:
+        return None
+    # Later pages say "Page 3 of about 1,230 results", so take the largest number before the timing
+    text = summary.get_text(" ", strip=True).split('(')[0]
+    counts = [int(re.sub(r'\D', '', number)) for number in re.findall(r'\d[\d,.\s]*\d|\d', text)]
+    return max(counts) if counts else None
+
+
+# Function to read the "Cited by N" count stage 3 found for the paper, if the input has it
+def reported_citations(row):
+    try:
+        total = int(float(row.get('Cited By Count')))
+    except (TypeError, ValueError):
+        return None
+    return total if total >= 0 else None
+
+
+# Function to pull the cited articles off a parsed page
+def read_results_page(soup, row):
+    with timed('extract'):
+        return extract_cited_articles(soup, row)
+
+
+# Function to parse a fetched results page into its cited articles, the result count and, when index is set,
+# the entries for the title index; runs in a parse worker, so the caller's setting comes with the page
+def parse_results_page(html, paper, index=False):
+    soup = parse_html(html)
+    return read_results_page(soup, paper), parse_result_count(soup), result_entries(soup) if index else []
+
+
+# Function to parse a results page in the parse pool; the titles it lists come back for the title index
+async def parse_page(html, paper):
+    return await parse_async(parse_results_page, html, paper, use_title_index)
+
+
+# Function to add the titles a paper's pages listed to the title index: one write per paper, off the event loop
+async def index_titles(entries):
+    if entries:
+        await asyncio.get_running_loop().run_in_executor(None, open_title_index(title_index_path).add, entries)
+
+
+# The input columns copied into every cited article, sent to the parse workers with each page
+def paper_fields(row):
+    return {column: row[column] for column in ['Original Title', 'URL', 'Cited Articles URL']}
+
+
+# Function to fetch and parse the results page starting at a given offset
+async def fetch_results_page(fetcher, cited_url, start, paper):
+    page_url = with_query_params(cited_url, start=start, num=results_per_page)
+    print(f"Processing page: {page_url}")
+    articles, _, entries = await parse_page(await fetcher.fetch(page_url), paper)
+    return articles, entries
+
+
+# Function to compare what was collected with the "Cited by N" Scholar reported
+def check_completeness(row, articles, total):
+    reported = reported_citations(row)
+    if reported is None:
+        reported = total
+    if reported is None:
+        return
+    # Scholar's counts are estimates and it stops listing at max_results
+    expected = min(reported, max_results)
+    if len(articles) < expected:
+        print(f"Only {len(articles)} of {reported} citing articles collected for: {row['Original Title']}")
+    elif reported > max_results:
+        print(f"{row['Original Title']} is cited {reported} times; Scholar lists only the first {max_results}.")
+
+
+# Function to scrape cited articles for a given URL using the shared async fetcher
+async def scrape_cited_articles(fetcher, row):
     try:
         cited_url = row['Cited Articles URL']
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        response = requests.get(cited_url, headers=headers)
-        time.sleep(random.uniform(2, 5))  # Avoid making requests too quickly
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        all_articles = []  # To store all articles from multiple pages
-        visited_pages = set()  # Track visited pages to avoid loops
-
-        # Extract all page links once
-        navigation_div = soup.find('div', id='gs_nml')
-        if not navigation_div:
-            print("No navigation bar found. Proceeding with only the current page.")
-            page_links = []
+        paper = paper_fields(row)
+
+        # The first page gives the result count, so every other page is known before it is fetched
+        first_page_url = with_query_params(cited_url, num=results_per_page)
+        print(f"Processing page: {first_page_url}")
+        all_articles, total, entries = await parse_page(await fetcher.fetch(first_page_url), paper)
+
+        if total is not None:
+            # Fetch the remaining pages concurrently; the fetcher enforces the rate budget
+            offsets = range(results_per_page, min(total, max_results), results_per_page)
+            pages = await asyncio.gather(*(fetch_results_page(fetcher, cited_url, start, paper) for start in offsets),
+                                         return_exceptions=True)
+            for page in pages:
+                if isinstance(page, BaseException):
+                    raise page
+                all_articles.extend(page[0])
+                entries.extend(page[1])
         else:
-            page_links = navigation_div.find_all('a', class_='gs_nma')
-            page_links = [f"https://scholar.google.com{link['href']}" for link in page_links]
-
-        # Add the first page link (current page) at the beginning
-        page_links.insert(0, cited_url)
-
-        # Process each page link
-        for page_link in page_links:
-            if page_link in visited_pages:
-                print(f"Already visited {page_link}. Skipping.")
-                continue
-
-            visited_pages.add(page_link)
-            print(f"Processing page: {page_link}")
-
-            response = requests.get(page_link, headers=headers)
-            time.sleep(random.uniform(2, 5))  # Avoid making requests too quickly
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Scrape articles on the current page
-            results = soup.find_all('div', class_=['gs_r gs_or gs_scl', 'gs_r gs_or gs_scl gs_fmar'])
-            for result in results:
-                try:
-                    # Extract title and URL
-                    title_tag = result.find('h3', class_='gs_rt')
-                    title, url = None, None
-                    if title_tag:
-                        title_html = str(title_tag)
-                        title = BeautifulSoup(title_html, 'html.parser').get_text(separator=" ", strip=True)
-                        url = title_tag.find('a')['href'] if title_tag.find('a') else None
-
-                    # Extract cited articles URL
-                    cited_by_tag = result.find('a', text=lambda x: x and (
-                            x.startswith('Cited by') or x.startswith('被引用次数')))
-                    cited_articles_url = (
-                        f"https://scholar.google.com{cited_by_tag['href']}"
-                        if cited_by_tag
-                        else None
-                    )
-
-                    # Append the cited article data along with the original paper details
-                    all_articles.append({
-                        'Original Paper Title': row['Original Title'],
-                        'Original Paper URL': row['URL'],
-                        'Original Cited Page URL': row['Cited Articles URL'],
-                        'Cited Article Title': title,
-                        'Cited Article URL': url,
-                        'Next Cited Articles URL': cited_articles_url
-                    })
-                except Exception as e:
-                    print(f"Error processing a result: {e}")
-                    continue
+            # No count on the page: keep going until a page comes back short
+            print("No result count found. Following pages until one is not full.")
+            start, last_page = results_per_page, all_articles
+            while len(last_page) == results_per_page and start < max_results:
+                last_page, page_entries = await fetch_results_page(fetcher, cited_url, start, paper)
+                all_articles.extend(last_page)
+                entries.extend(page_entries)
+                start += results_per_page
 
+        check_completeness(row, all_articles, total)
+        await index_titles(entries)
         return all_articles
 
+    except BlockedError:
+        # A block page is not "no citations"; the caller requeues the paper
+        raise
     except Exception as e:
+        # Nor is an error; the caller counts the paper as failed
         print(f"Error scraping cited articles for URL: {row['Cited Articles URL']} - {e}")
-        return []
+        raise
+
+
+# Function to append one batch of scraped articles to the output file
+def save_articles(articles, sink):
+    if articles:
+        print(f"Saving batch of {len(articles)} articles...")
+        sink.write_rows(articles)
 
 
-# Initialize a list to store all scraped data
-batch_size = 1
-all_cited_articles = []
+# Function to save one finished paper and record it in the checkpoint store; a blocked paper is returned
+async def save_paper(row, task, sink, checkpoint):
+    try:
+        articles = await task
+    except BlockedError as e:
+        print(f"Requeueing {row['Original Title']}: {e}")
+        count('items', status='blocked')
+        return row
+    except Exception:
+        count('items', status='failed')
+        if checkpoint is not None:
+            checkpoint.mark_failed(row['Paper Key'])
+        return None
+    save_articles(articles, sink)
+    # A paper nobody cites is done too
+    count('items', status='done')
+    if checkpoint is not None:
+        checkpoint.mark_done([row['Paper Key']])
+    return None
+
 
-try:
-    # Loop through each row in the original DataFrame
-    for index, row in input_df.iterrows():
+# Function to scrape a list of papers; returns the ones that were blocked
+async def scrape_rows(fetcher, rows, sink, checkpoint):
+    # Keep several papers in flight but save them in input order
+    pending = deque()
+    blocked = []
+    for row in rows:
         print(f"Scraping cited articles for: {row['Original Title']}")
-        articles = scrape_cited_articles(row)
-        all_cited_articles.extend(articles)  # Add to the main list
-
-        # Save data in batches
-        if len(all_cited_articles) >= batch_size:
-            print(f"Saving batch of {len(all_cited_articles)} articles...")
-            pd.DataFrame(all_cited_articles).to_csv(output_file, mode='a', header=False, index=False)
-            all_cited_articles = []  # Reset the batch list
-
-    # Save any remaining data after the loop
-    if all_cited_articles:
-        print(f"Saving final batch of {len(all_cited_articles)} articles...")
-        pd.DataFrame(all_cited_articles).to_csv(output_file, mode='a', header=False, index=False)
-
-except Exception as e:
-    print(f"An error occurred: {e}")
+        pending.append((row, asyncio.ensure_future(scrape_cited_articles(fetcher, row))))
+        if len(pending) >= papers_in_flight:
+            blocked.append(await save_paper(*pending.popleft(), sink, checkpoint))
+
+    # Save the papers still in flight after the loop
+    while pending:
+        blocked.append(await save_paper(*pending.popleft(), sink, checkpoint))
+    return [row for row in blocked if row is not None]
+
+
+# Function to key each input paper as it is read; titles that found the same paper share its cluster id
+def keyed_papers(rows):
+    for row in rows:
+        if isinstance(row['Cited Articles URL'], str):
+            row['Paper Key'] = paper_key(row['Original Title'], cluster_id(row['Cited Articles URL']))
+            yield row
+
+
+# Function to scrape every paper in rows, an iterable of dicts read as the first pass goes
+async def scrape_all_cited_articles(rows, output_file, checkpoint=None):
+    set_stage('cited_articles')
+    page_cache = PageCache(cache_directory)
+    sink = open_sink(output_file, output_columns, output_format, 'cited_articles')
+    async with AsyncFetcher(concurrency=concurrency, requests_per_second=requests_per_second,
+                            cache=page_cache) as fetcher:
+        for round_number in range(requeue_rounds + 1):
+            rows = await scrape_rows(fetcher, rows, sink, checkpoint)
+            if not rows:
+                break
+            # Pages fetched before the block come from the page cache on the next pass
+            print(f"{len(rows)} papers were interrupted by a block.")
+
+        # Papers still blocked are left for a later run
+        for row in rows:
+            if checkpoint is not None:
+                checkpoint.mark_failed(row['Paper Key'])
+    sink.close()
+    page_cache.close()
+    close_parse_pool()
+
+
+if __name__ == '__main__':
+    # Stream only the columns the scrape needs; papers without a cited-by link are skipped as they are read
+    rows = keyed_papers(iter_input_rows(file_path, ['Original Title', 'URL', 'Cited Articles URL'],
+                                          optional=['Cited By Count']))
+
+    # Resume from the checkpoint store instead of re-reading the whole output
+    checkpoint = CheckpointStore('cited_articles')
+    checkpoint.import_existing(output_file, 'Original Paper Title')
+
+    ## Exclude existing data
+    # Papers finished before fetches were keyed by ID were recorded by title
+    rows = (row for row in rows if checkpoint.should_fetch(row['Original Title']))
+    rows = checkpoint.pending_rows(rows, 'Paper Key')
+
+    try:
+        asyncio.run(scrape_all_cited_articles(rows, output_file, checkpoint))
+    except Exception as e:
+        print(f"An error occurred: {e}")
@@ -0,0 +1,129 @@
+import ast
+
+import numpy as np
+import pandas as pd
+
+from result_sink import FilePrefix, output_snapshot, stage_schema
+from scholar_ids import ID_DTYPES
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+ARTICLE_FIELDS = ['Title', 'Year', 'URL', 'Article ID', 'Cluster ID', 'Citations']
+
+# Rows an .xlsx sheet can hold, header included
+EXCEL_MAX_ROWS = 1048576
+
+
+def parse_articles(cell):
+    # Cells hold the repr of a list of dicts; literal_eval reads it without running code
+    if not isinstance(cell, str) or not cell.strip():
+        return []
+    return ast.literal_eval(cell)
+
+
+'''One row per article: repeat each researcher's columns once per article'''
+def flatten_records(profiles, articles):
+    # A researcher without articles keeps one row with empty article columns, as explode did
+    counts = np.fromiter((max(len(items), 1) for items in articles), dtype=np.int64, count=len(articles))
+    flat = profiles.iloc[np.repeat(np.arange(len(profiles)), counts)].reset_index(drop=True)
+    records = [article for items in articles for article in (items or [{}])]
+    for field in ARTICLE_FIELDS:
+        # Object columns keep counts as integers next to the empty cells of uncited papers, as the Arrow path does
+        flat[field] = pd.Series([article.get(field) for article in records], dtype=object)
+    return flat
+
+
+def iter_expanded_csv(profiles_csv, chunksize=100):
+    for chunk in pd.read_csv(profiles_csv, chunksize=chunksize, dtype=ID_DTYPES):
+        articles = [parse_articles(cell) for cell in chunk['Articles']]
+        yield flatten_records(chunk.drop(columns=['Articles']), articles)
+
+
+def expand_batch(batch):
+    # The Articles column is already a typed list, so the flat table is built from its
+    # offsets in Arrow without reading any article back into Python dicts
+    articles = batch.column('Articles')
+    lengths = articles.value_lengths().fill_null(0).to_numpy(zero_copy_only=False)
+    counts = np.maximum(lengths, 1)
+    rows = np.repeat(np.arange(batch.num_rows), counts)
+    # Position of each output row inside the flattened article values; empty profiles get a null
+    starts = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts, counts) + np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    empty = lengths[rows] == 0
+    values = articles.flatten().take(pa.array(np.where(empty, 0, positions), mask=empty))
+
+    profiles = batch.drop_columns(['Articles']).to_pandas(integer_object_nulls=True)
+    if 'Annual Citation' in profiles:
+        # Same text as the CSV output: {'2020': '5', ...}
+        profiles['Annual Citation'] = [
+            None if items is None else str({str(item['year']): str(item['citations']) for item in items})
+            for items in profiles['Annual Citation']]
+    # Part files written before a column was added to the schema get it empty
+    profile_columns = [name for name in stage_schema('researcher_profiles').names if name != 'Articles']
+    flat = profiles.reindex(columns=profile_columns).iloc[rows].reset_index(drop=True)
+    article_columns = dict(zip([field.name for field in values.type], values.flatten()))
+    for field in ARTICLE_FIELDS:
+        column = article_columns.get(field)
+        flat[field] = column.to_pandas(integer_object_nulls=True) if column is not None else None
+    return flat
+
+
+def iter_expanded_parquet(parts, chunksize=100):
+    # One part file at a time; a dataset scan would read ahead through the whole directory
+    for path in parts:
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield expand_batch(batch)
+
+
+def iter_expanded(profiles_csv, source='csv', chunksize=100, snapshot=None):
+    snapshot = snapshot or output_snapshot(profiles_csv)
+    if source == 'parquet':
+        if not HAS_PYARROW:
+            raise ImportError("Reading Parquet output needs pyarrow (pip install pyarrow)")
+        return iter_expanded_parquet(snapshot['parquet_parts'], chunksize)
+    if not snapshot['csv_bytes']:
+        return iter([])
+    return iter_expanded_csv(FilePrefix(profiles_csv, snapshot['csv_bytes']), chunksize)
+
+
+'''Write the flat article table chunk by chunk, so memory stays bounded by one chunk'''
+def expand_articles(profiles_csv, expand_csv, expand_excel=None, source='csv', chunksize=100):
+    workbook = sheet = None
+    if expand_excel:
+        import openpyxl
+        # Write-only mode streams rows to disk instead of keeping every cell in memory
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+
+    written = 0
+    excel_rows = 0
+    first = True
+    for flat in iter_expanded(profiles_csv, source, chunksize):
+        flat.to_csv(expand_csv, mode='w' if first else 'a', header=first, index=False)
+        if sheet is not None:
+            if first:
+                sheet.append(list(flat.columns))
+                excel_rows += 1
+            rows = flat.astype(object).where(flat.notna(), None).itertuples(index=False)
+            for row in rows:
+                if excel_rows >= EXCEL_MAX_ROWS:
+                    print(f"{expand_excel} is full at {EXCEL_MAX_ROWS} rows; the rest is only in {expand_csv}.")
+                    sheet = None
+                    break
+                sheet.append(list(row))
+                excel_rows += 1
+        written += len(flat)
+        first = False
+
+    if first:
+        print("No researcher profiles to expand.")
+        return 0
+    if workbook is not None:
+        workbook.save(expand_excel)
+    print(f"Wrote {written} article rows to {expand_csv}.")
+    return written
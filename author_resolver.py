@@ -0,0 +1,225 @@
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from checkpoint_store import normalize_key
+from instrumentation import set_stage
+from page_cache import PageCache
+from scholar_fetch import AsyncFetcher, BlockedError, HttpFirstFetcher, looks_like_browser_only_page
+from scholar_parser import parse_html
+from scholar_ids import researcher_id
+
+'''Resolver settings'''
+cache_path = 'author_ids.sqlite3'
+negative_ttl = 7 * 24 * 3600  # Names that found no profile are searched again after this many seconds
+concurrency = 4  # Author searches downloading at the same time
+requests_per_second = 0.5  # Budget per host, shared by all searches in flight
+cache_directory = 'page_cache'  # Raw pages are read from here before touching the network
+
+# Base URL for Google Scholar's author search
+author_search_url = "https://scholar.google.com/citations?view_op=search_authors&hl=en&oi=ao&mauthors="
+profile_url_prefix = "https://scholar.google.com/citations?hl=en&user="
+
+# Profile ids are 12 characters of letters, digits, '-' and '_'
+SCHOLAR_ID = re.compile(r'^[A-Za-z0-9_-]{12}$')
+
+
+def search_url(name):
+    return author_search_url + name.replace(" ", "+").replace(",", "%2C")
+
+
+def profile_url(user_id):
+    return profile_url_prefix + user_id
+
+
+def given_profile_url(value):
+    # An input cell naming the profile directly, as a profile URL or a bare user id
+    if not isinstance(value, str) or not value.strip():
+        return None
+    value = value.strip()
+    if SCHOLAR_ID.match(value):
+        return profile_url(value)
+    return value if researcher_id(value) else None
+
+
+def use_given_profile(cache, name, value):
+    # A profile named in the input wins over the cache and over searches, and is remembered for the name
+    url = given_profile_url(value)
+    if url is not None:
+        cache.put(name, url, 'input')
+    return url
+
+
+# Function to find the profile URL of the first author search result, or None
+def first_author_url(soup):
+    first_result = soup.find('h3', class_='gs_ai_name')
+    link = first_result.find('a') if first_result else None
+    if link is None or not link.has_attr('href'):
+        return None
+    return f"https://scholar.google.com{link['href']}"
+
+
+'''Persistent name -> profile cache, kept in SQLite'''
+class AuthorCache:
+    def __init__(self, path=cache_path, negative_ttl=negative_ttl):
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # A row without a url records a search that found nobody
+        self.db.execute('''CREATE TABLE IF NOT EXISTS authors (
+            key TEXT PRIMARY KEY, name TEXT, researcher_id TEXT, url TEXT, source TEXT, updated_at REAL)
+            WITHOUT ROWID''')
+        self.db.commit()
+
+    def lookup(self, name):
+        # (True, url or None) when the name is settled, (False, None) when it still needs a search
+        with self.lock:
+            row = self.db.execute('SELECT url, updated_at FROM authors WHERE key = ?',
+                                  (normalize_key(name),)).fetchone()
+        if row is None:
+            return False, None
+        url, updated_at = row
+        if url is None and time.time() - updated_at > self.negative_ttl:
+            return False, None
+        return True, url
+
+    def put(self, name, url, source='search'):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO authors VALUES (?, ?, ?, ?, ?, ?)',
+                            (normalize_key(name), name, researcher_id(url), url, source, time.time()))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+# One handle per process and cache file, shared by that process's threads
+open_caches = {}
+open_caches_lock = threading.Lock()
+
+
+def open_author_cache(path=cache_path):
+    with open_caches_lock:
+        handle = open_caches.get((os.getpid(), path))
+        if handle is None:
+            handle = open_caches[(os.getpid(), path)] = AuthorCache(path)
+        return handle
+
+
+'''Searches for the names the cache cannot answer'''
+async def search_author(fetcher, cache, name):
+    # The profile URL, or None; names whose page needs a browser are returned as blocked
+    url = search_url(name)
+    print(f"Searching for: {name}")
+    try:
+        html = await fetcher.fetch(url)
+    except Exception as e:
+        print(f"Author search failed for {name}: {e}")
+        return name, None, True
+    if looks_like_browser_only_page(html, url):
+        return name, None, True
+    found = first_author_url(parse_html(html))
+    print(f"Found URL: {found}" if found else f"No results found for {name}")
+    cache.put(name, found)
+    return name, found, False
+
+
+async def search_authors(names, cache, page_cache):
+    set_stage('author_search')
+    async with AsyncFetcher(concurrency=concurrency, requests_per_second=requests_per_second,
+                            cache=page_cache) as fetcher:
+        return await asyncio.gather(*(search_author(fetcher, cache, name) for name in names))
+
+
+def find_author_url(fetcher, name, cache=None, given=None):
+    # One name through a blocking fetcher, as the streaming pipeline's workers resolve them;
+    # given is the name's optional profile URL or user id, as in resolve_authors
+    cache = cache or open_author_cache()
+    url = use_given_profile(cache, name, given)
+    if url is not None:
+        return url
+    known, url = cache.lookup(name)
+    if known:
+        return url
+    print(f"Searching for: {name}")
+    try:
+        url = first_author_url(parse_html(fetcher.get_html(search_url(name))))
+    except BlockedError:
+        raise
+    except Exception as e:
+        print(f"No results found for {name}: {e}")
+        return None
+    print(f"Found URL: {url}" if url else f"No results found for {name}")
+    cache.put(name, url)
+    return url
+
+
+def search_with_browser(names, cache):
+    # The few names plain HTTP could not search go through the HTTP-first fetcher, which opens Chrome
+    page_cache = PageCache(cache_directory)
+    fetcher = HttpFirstFetcher(cache=page_cache, requests_per_second=requests_per_second)
+    found = {}
+    try:
+        for name in names:
+            try:
+                # The cached copy is the blocked page, so it is fetched again and replaced if the browser got through
+                html, complete = fetcher.fetch_page(search_url(name))
+                if complete:
+                    page_cache.put(search_url(name), html)
+                url = first_author_url(parse_html(html))
+            except Exception as e:
+                print(f"No results found for {name}: {e}")
+                continue
+            print(f"Found URL: {url}" if url else f"No results found for {name}")
+            cache.put(name, url)
+            found[name] = url
+    finally:
+        fetcher.close()
+        page_cache.close()
+    return found
+
+
+def resolve_authors(names, given=None, cache=None):
+    # Profile URL for each name, in order; given holds optional profile URLs or user ids per name
+    own_cache = cache is None
+    cache = AuthorCache() if own_cache else cache
+    given = list(given) if given is not None else [None] * len(names)
+    resolved, to_search = {}, []
+    try:
+        # Profiles named in the input win over the cache and over searches
+        for name, value in zip(names, given):
+            direct = use_given_profile(cache, name, value)
+            if direct is not None:
+                resolved[normalize_key(name)] = direct
+        for name in names:
+            key = normalize_key(name)
+            if key in resolved:
+                continue
+            known, url = cache.lookup(name)
+            if known:
+                resolved[key] = url
+            else:
+                to_search.append(name)
+                resolved[key] = None
+        print(f"{len(names) - len(to_search)} of {len(names)} names resolved without a search.")
+
+        if to_search:
+            page_cache = PageCache(cache_directory)
+            try:
+                searched = asyncio.run(search_authors(to_search, cache, page_cache))
+            finally:
+                page_cache.close()
+            resolved.update((normalize_key(name), url) for name, url, blocked in searched if not blocked)
+            blocked = [name for name, _, was_blocked in searched if was_blocked]
+            if blocked:
+                print(f"{len(blocked)} searches need a browser.")
+                found = search_with_browser(blocked, cache)
+                resolved.update((normalize_key(name), url) for name, url in found.items())
+    finally:
+        if own_cache:
+            cache.close()
+    return [resolved.get(normalize_key(name)) for name in names]
@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citation_graph import CitationGraph, stage4
+
+'''Citation graph store on a synthetic graph: build time and query latency'''
+def synthetic_edges(papers, citations, seed=7):
+    # Citing papers are uniform; cited papers follow a power law, as citation counts do
+    random = np.random.default_rng(seed)
+    citing = random.integers(0, papers, citations)
+    cited = np.minimum((random.pareto(1.2, citations) * papers / 1000).astype(np.int64), papers - 1)
+    return np.column_stack([citing, cited]).astype(np.int32)
+
+
+def timed(function, repeat=20):
+    # Best of repeat runs, in milliseconds
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def bench_queries(directory, papers, citations):
+    graph = CitationGraph(directory)
+    # Nodes go straight into the store, skipping the CSV parsing measured below
+    graph.db.executemany('INSERT INTO nodes (key, title, title_key) VALUES (?, ?, ?)',
+                         ((f"cites:{i}", f"Paper {i}", f"paper {i}") for i in range(papers)))
+    graph.db.commit()
+    synthetic_edges(papers, citations).tofile(graph.path('edges.bin'))
+    start = time.perf_counter()
+    graph.build()
+    print(f"Built CSR arrays for {graph.edge_count} citations in {time.perf_counter() - start:.1f}s")
+    graph.close()
+
+    # A fresh handle, so the queries start from memory-mapped files
+    graph = CitationGraph(directory)
+    top = graph.most_cited(2)
+    middle = int(np.argsort(graph.in_degree())[-1000])
+    queries = {
+        'in-degree of one paper': lambda: graph.in_degree(int(top[0])),
+        'in-degree of all papers': lambda: graph.in_degree(),
+        'most cited 10': lambda: graph.most_cited(10),
+        'citing papers of the top paper': lambda: graph.citing(int(top[0])).sum(),
+        '2-hop citers of a 1000th paper': lambda: sum(len(layer) for layer in graph.k_hop(middle, 2)),
+        'co-citation of the top 2': lambda: graph.co_citation(int(top[0]), int(top[1])),
+        'co-cited with a 1000th paper': lambda: graph.co_cited_with(middle, 10)[1].sum(),
+    }
+    print(f"{'query':<34}{'ms':>10}")
+    for name, query in queries.items():
+        milliseconds, _ = timed(query)
+        print(f"{name:<34}{milliseconds:>10.2f}")
+    graph.close()
+
+
+def bench_ingest(directory, rows):
+    # Stage 4 output rows through update(): parsing, interning and the CSR rebuild
+    output_file = os.path.join(directory, 'cited_articles.csv')
+    edges = synthetic_edges(rows // 10, rows, seed=11)
+    pd.DataFrame({
+        'Original Paper Title': [f"Paper {i}" for i in edges[:, 1]],
+        'Original Cited Page URL': [f"https://scholar.google.com/scholar?cites={i}" for i in edges[:, 1]],
+        'Original Cluster ID': edges[:, 1].astype(str),
+        'Cited Article Title': [f"Paper {i}" for i in edges[:, 0]],
+        'Next Cited Articles URL': [f"https://scholar.google.com/scholar?cites={i}" for i in edges[:, 0]],
+        'Cited Article Cluster ID': edges[:, 0].astype(str),
+    }).reindex(columns=stage4.output_columns).to_csv(output_file, index=False)
+    graph = CitationGraph(os.path.join(directory, 'ingest_graph'))
+    start = time.perf_counter()
+    graph.update([(output_file, 'csv')])
+    seconds = time.perf_counter() - start
+    print(f"Ingested {rows} stage 4 rows in {seconds:.1f}s ({rows / seconds:.0f} rows/s)")
+    graph.close()
+
+
+def run(papers=2000000, citations=20000000, ingest_rows=1000000):
+    with tempfile.TemporaryDirectory() as directory:
+        bench_queries(os.path.join(directory, 'graph'), papers, citations)
+        bench_ingest(directory, ingest_rows)
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:]))
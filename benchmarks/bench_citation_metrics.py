@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citation_metrics import compute_metrics
+
+'''Researcher metrics on synthetic article arrays: the vectorised pass against a per-researcher loop'''
+def synthetic_articles(researchers, articles_per_researcher, years_per_article, seed=7):
+    random = np.random.default_rng(seed)
+    sizes = random.poisson(articles_per_researcher, researchers)
+    groups = np.repeat(np.arange(researchers), sizes)
+    citations = np.floor(random.lognormal(2, 1.5, len(groups))).astype(np.int64)
+    # A few years of annual citations per article, ending this year
+    spans = np.minimum(random.poisson(years_per_article, len(groups)), 20)
+    annual_article = np.repeat(np.arange(len(groups)), spans)
+    annual_year = 2024 - (np.arange(len(annual_article)) - np.repeat(np.cumsum(spans) - spans, spans))
+    annual_count = random.poisson(3, len(annual_article))
+    return groups, citations.astype(float), annual_article, annual_year, annual_count
+
+
+def loop_metrics(groups, citations, annual_article, annual_year, annual_count, researchers, window=5, last_year=2024):
+    # The straightforward version: one sorted list per researcher
+    by_researcher = [[] for _ in range(researchers)]
+    for group, count in zip(groups.tolist(), citations.tolist()):
+        by_researcher[group].append(count)
+    recent = [0] * len(groups)
+    for article, year, count in zip(annual_article.tolist(), annual_year.tolist(), annual_count.tolist()):
+        if last_year - window < year <= last_year:
+            recent[article] += count
+    recent_by_researcher = [[] for _ in range(researchers)]
+    for group, count in zip(groups.tolist(), recent):
+        recent_by_researcher[group].append(count)
+
+    def indices(counts):
+        counts = sorted(counts, reverse=True)
+        h = sum(1 for rank, count in enumerate(counts, 1) if count >= rank)
+        total, g = 0, 0
+        for rank, count in enumerate(counts, 1):
+            total += count
+            if total >= rank * rank:
+                g = rank
+        return sum(counts), h, sum(1 for count in counts if count >= 10), g
+
+    return [indices(counts) + indices(recent_counts)
+            for counts, recent_counts in zip(by_researcher, recent_by_researcher)]
+
+
+def run(researchers=100000, articles_per_researcher=100, years_per_article=6, loop_researchers=10000):
+    arrays = synthetic_articles(researchers, articles_per_researcher, years_per_article)
+    print(f"{researchers} researchers, {len(arrays[0])} articles, {len(arrays[2])} annual citation counts")
+
+    start = time.perf_counter()
+    metrics, _, _ = compute_metrics(researchers, *arrays, windows=[5], last_year=2024)
+    print(f"vectorised, all researchers: {time.perf_counter() - start:.2f}s")
+
+    # The loop runs on a slice of the researchers and is scaled up
+    small = synthetic_articles(loop_researchers, articles_per_researcher, years_per_article)
+    start = time.perf_counter()
+    expected = loop_metrics(*small, loop_researchers)
+    seconds = time.perf_counter() - start
+    print(f"per-researcher loop, {loop_researchers} researchers: {seconds:.2f}s "
+          f"(~{seconds * researchers / loop_researchers:.0f}s for all)")
+
+    small_metrics, _, _ = compute_metrics(loop_researchers, *small, windows=[5], last_year=2024)
+    columns = ['citations', 'h-index', 'i10-index', 'g-index',
+               'citations (5y)', 'h-index (5y)', 'i10-index (5y)', 'g-index (5y)']
+    if [tuple(row) for row in small_metrics[columns].itertuples(index=False)] != expected:
+        raise AssertionError("Vectorised metrics differ from the per-researcher loop")
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:]))
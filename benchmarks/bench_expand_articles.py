@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from article_table import expand_articles
+from result_sink import HAS_PYARROW, open_sink
+
+'''Stage 1 expand step on a synthetic profiles file: the old eval/explode code against the chunked one'''
+PROFILE_COLUMNS = [
+    'name', 'researcher_url', 'Researcher ID', 'position', 'institution_href', 'institution',
+    'personal_website', 'research_areas', 'Total Citations', 'h-index', 'i10-index', 'Annual Citation',
+    'total access articles', 'Articles'
+]
+
+
+def synthetic_profile(number, articles_per_researcher):
+    articles = [{'Title': f"Paper {number}-{i} on learning representations for graphs", 'Year': str(2000 + i % 25),
+                 'URL': f"https://scholar.google.com/citations?view_op=view_citation&citation_for_view=R{number}:{i}",
+                 'Article ID': f"R{number}:{i}", 'Cluster ID': str(10 ** 9 + number * 1000 + i)}
+                for i in range(articles_per_researcher)]
+    return {
+        'name': f"Researcher {number}", 'researcher_url': f"https://scholar.google.com/citations?user=R{number}",
+        'Researcher ID': f"R{number}",
+        'position': 'Professor of Computer Science', 'institution_href': '/citations?view_op=view_org&org=1',
+        'institution': 'Example University', 'personal_website': 'https://example.org',
+        'research_areas': 'Machine Learning, Graphs', 'Total Citations': '12345', 'h-index': '40', 'i10-index': '90',
+        'Annual Citation': {str(year): str(year - 2000) for year in range(2010, 2025)},
+        'total access articles': '12', 'Articles': articles,
+    }
+
+
+def write_profiles(profiles_csv, researchers, articles_per_researcher, output_format):
+    sink = open_sink(profiles_csv, PROFILE_COLUMNS, output_format, 'researcher_profiles')
+    for start in range(0, researchers, 100):
+        sink.write_rows([synthetic_profile(number, articles_per_researcher)
+                         for number in range(start, min(start + 100, researchers))])
+    sink.close()
+
+
+def original_expand(profiles_csv, expand_csv):
+    # The post-processing stage 1 used to run, minus the Excel copy
+    df_professor_info = pd.read_csv(profiles_csv)
+    df_professor_info['Articles'] = df_professor_info['Articles'].apply(eval)
+    df_professor_info = df_professor_info.explode('Articles')
+    df_expanded = df_professor_info['Articles'].apply(pd.Series)
+    df_professor_info = pd.concat([df_professor_info, df_expanded], axis=1)
+    df_professor_info = df_professor_info.drop(columns=['Articles'])
+    df_professor_info.to_csv(expand_csv, index=False)
+
+
+APPROACHES = {
+    'original (eval + explode)': original_expand,
+    'chunked from CSV': lambda profiles_csv, expand_csv: expand_articles(profiles_csv, expand_csv),
+    'chunked from Parquet': lambda profiles_csv, expand_csv: expand_articles(profiles_csv, expand_csv, source='parquet'),
+}
+
+
+def peak_rss_mb():
+    # VmHWM belongs to this process alone; ru_maxrss on Linux can carry over the parent's peak
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(name, profiles_csv, expand_csv, results):
+    # Each approach runs in its own process so the peak RSS is its own
+    start = time.perf_counter()
+    APPROACHES[name](profiles_csv, expand_csv)
+    results.put((time.perf_counter() - start, peak_rss_mb()))
+
+
+def run(articles=1000000, articles_per_researcher=200, original_articles=100000):
+    researchers = articles // articles_per_researcher
+    formats = 'both' if HAS_PYARROW else 'csv'
+    # Spawned, not forked, so a child does not start out with this process's memory
+    spawn = multiprocessing.get_context('spawn')
+    print(f"{'approach':<28}{'articles':>10}{'seconds':>10}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        # The original code needs the whole table in memory, so it runs on a smaller file by default
+        for size in sorted({original_articles, articles}):
+            profiles_csv = os.path.join(directory, f"profiles_{size}.csv")
+            write_profiles(profiles_csv, size // articles_per_researcher, articles_per_researcher, formats)
+            outputs = {}
+            for name in APPROACHES:
+                if (name.startswith('original') and size > original_articles) or \
+                        (name.endswith('Parquet') and not HAS_PYARROW):
+                    continue
+                expand_csv = os.path.join(directory, f"expand_{len(outputs)}_{size}.csv")
+                results = spawn.Queue()
+                process = spawn.Process(target=measure, args=(name, profiles_csv, expand_csv, results))
+                process.start()
+                seconds, peak = results.get()
+                process.join()
+                outputs[name] = expand_csv
+                print(f"{name:<28}{size:>10}{seconds:>10.2f}{peak:>10.0f}")
+
+            # Every approach has to produce the same table; the old code also added a stray
+            # column named 0 for researchers without articles, which is left out here
+            tables = [pd.read_csv(path, dtype=str) for path in outputs.values()]
+            columns = list(tables[-1].columns)
+            if any(not table[columns].equals(tables[-1]) for table in tables):
+                raise AssertionError(f"Expanded tables differ at {size} articles")
+    print(f"({researchers} researchers x {articles_per_researcher} articles at full size)")
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:]))
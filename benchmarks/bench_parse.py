@@ -0,0 +1,57 @@
+import importlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scholar_parser import HAS_LXML, PARSER_BACKENDS, parse_html
+from make_fixtures import SEARCH_TITLE, fixture_directory
+
+stage1 = importlib.import_module('1_researcher_profile_extraction_v2')
+stage2 = importlib.import_module('2_google_articles_search')
+stage3 = importlib.import_module('3_title_google_search')
+stage4 = importlib.import_module('4_cited_articles_request')
+
+'''Parse throughput of each stage's extraction on the saved fixture pages'''
+ORIGINAL_ROW = {'Original Title': SEARCH_TITLE, 'URL': 'https://example.org/p', 'Cited Articles URL': 'https://example.org/c'}
+
+SCENARIOS = {
+    'profile.html': lambda soup: (stage1.extract_profile_details(soup), stage1.extract_articles(soup)),
+    'view_citation.html': lambda soup: stage2.extract_paper_details(soup, SEARCH_TITLE, 'https://example.org/p'),
+    'search.html': lambda soup: stage3.extract_search_details(soup, SEARCH_TITLE),
+    'cited_by.html': lambda soup: stage4.extract_cited_articles(soup, ORIGINAL_ROW),
+}
+
+
+def check_backends_agree(backends):
+    # A faster backend is only useful if every extraction gives the same answer
+    for name, extract in SCENARIOS.items():
+        with open(os.path.join(fixture_directory, name), encoding='utf-8') as f:
+            html = f.read()
+        results = [extract(parse_html(html, backend)) for backend in backends]
+        if any(result != results[0] for result in results[1:]):
+            raise AssertionError(f"Parser backends disagree on {name}")
+
+
+def time_scenario(html, extract, backend, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        extract(parse_html(html, backend))
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def run(rounds=50):
+    backends = [backend for backend in PARSER_BACKENDS if backend != 'lxml' or HAS_LXML]
+    check_backends_agree(backends)
+    print(f"{'page':<20}" + ''.join(f"{backend + ' us/page':>22}" for backend in backends) + f"{'speedup':>10}")
+    for name, extract in SCENARIOS.items():
+        with open(os.path.join(fixture_directory, name), encoding='utf-8') as f:
+            html = f.read()
+        timings = [time_scenario(html, extract, backend, rounds) for backend in backends]
+        speedup = timings[-1] / timings[0]
+        print(f"{name:<20}" + ''.join(f"{timing:>22.0f}" for timing in timings) + f"{speedup:>9.1f}x")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,219 @@
+import asyncio
+import contextlib
+import importlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scholar_fetch
+from bench_parse import SCENARIOS as PARSE_SCENARIOS, time_scenario
+from browser_pool import run_browser_pool
+from make_fixtures import fixture_directory, title
+from scholar_parser import parser_backend
+from scholar_server import base_url, start_server, stats, stop_server
+
+stage1 = importlib.import_module('1_researcher_profile_extraction_v2')
+stage2 = importlib.import_module('2_google_articles_search')
+stage3 = importlib.import_module('3_title_google_search')
+stage4 = importlib.import_module('4_cited_articles_request')
+
+'''Suite settings'''
+baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+tolerance = 0.25  # A metric this fraction worse than its baseline fails the suite
+server_port = 8791
+client_requests_per_second = 200  # Per host, well above what the unthrottled stand-in can serve
+parse_rounds = 50  # Each parse timing is the best of five runs of this many pages
+researchers = 16  # Profiles for stage 1, each served as 3 pages of articles
+papers = 200  # Citation pages for stage 2
+titles = 200  # Title searches for stage 3
+cited_papers = 16  # Cited-by lists for stage 4, each 10 pages long
+throttled_rate = 40  # Requests per second the throttled stand-in answers before sending 429s
+
+# Whether a larger value of each metric is better
+HIGHER_IS_BETTER = {'pages_per_second': True, 'us_per_page': False, 'peak_rss_mb': False}
+
+
+'''End-to-end runs of each stage against the local stand-in; each returns the number of rows written'''
+def run_profiles(url):
+    rows = pd.DataFrame({'name': [f"Researcher {i}" for i in range(researchers)],
+                         'researcher_url': [f"{url}/citations?hl=en&user=Bench{i:07d}" for i in range(researchers)]})
+    stage1.requests_per_second = client_requests_per_second
+    stage1.scrape_researcher_data(rows, 'profiles.csv')
+    return len(pd.read_csv('profiles.csv'))
+
+
+def run_paper_details(url):
+    rows = [{'Title': title(), 'URL': f"{url}/citations?view_op=view_citation&hl=en&user=BenchUser001"
+                                      f"&citation_for_view=BenchUser001:{i:012d}",
+             'Article ID': f"BenchUser001:{i:012d}", 'Cluster ID': None, 'Paper Key': str(i)} for i in range(papers)]
+    run_browser_pool(stage2.fetch_paper_details, rows, 'paper_details.csv', stage2.output_columns,
+                     workers=stage2.workers, requests_per_second=client_requests_per_second,
+                     key_column='Paper Key', stage='paper_details', parse_func=stage2.parse_paper_details)
+    return len(pd.read_csv('paper_details.csv'))
+
+
+def run_title_search(url):
+    rows = [{'title': title(), 'paper url': f"https://example.org/paper{i}"} for i in range(titles)]
+    stage3.scholar_search_url = f"{url}/scholar?q="
+    run_browser_pool(stage3.fetch_title_row, rows, 'title_search.csv', stage3.output_columns,
+                     workers=stage3.workers, requests_per_second=client_requests_per_second,
+                     key_column='title', stage='title_search', parse_func=stage3.parse_title_row,
+                     extras_func=stage3.index_titles)
+    return len(pd.read_csv('title_search.csv'))
+
+
+def run_cited_articles(url):
+    rows = pd.DataFrame({
+        'Original Title': [title() for _ in range(cited_papers)],
+        'URL': [f"https://example.org/paper{i}" for i in range(cited_papers)],
+        'Cited Articles URL': [f"{url}/scholar?cites={1000000 + i}&as_sdt=2005&sciodt=0,5&hl=en"
+                               for i in range(cited_papers)],
+        'Paper Key': [str(1000000 + i) for i in range(cited_papers)],
+    }).to_dict('records')
+    stage4.requests_per_second = client_requests_per_second
+    asyncio.run(stage4.scrape_all_cited_articles(rows, 'cited_articles.csv'))
+    return len(pd.read_csv('cited_articles.csv'))
+
+
+# Scenario: (run, stand-in settings, rows the run must write)
+END_TO_END = {
+    'profiles': (run_profiles, {}, researchers),
+    'paper_details': (run_paper_details, {}, papers),
+    'title_search': (run_title_search, {}, titles),
+    'cited_articles': (run_cited_articles, {}, cited_papers * 187),
+    'cited_articles_throttled': (run_cited_articles, {'rate_limit': throttled_rate}, cited_papers * 187),
+}
+PARSE = {f"parse_{name[:-len('.html')]}": name for name in PARSE_SCENARIOS}
+
+
+'''Measurement: every scenario runs in a fresh process and directory, so peak RSS is its own'''
+def peak_rss_mb():
+    # Linux reports kilobytes; stage workers are counted through RUSAGE_CHILDREN
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def parse_scenario(name):
+    with open(os.path.join(fixture_directory, PARSE[name]), encoding='utf-8') as f:
+        html = f.read()
+    extract = PARSE_SCENARIOS[PARSE[name]]
+    return {'us_per_page': min(time_scenario(html, extract, parser_backend, parse_rounds) for _ in range(5))}
+
+
+def end_to_end_scenario(name):
+    run, _, _ = END_TO_END[name]
+    # Pauses after a 429 follow the stand-in's Retry-After instead of a real host's backoff
+    scholar_fetch.backoff_seconds = 1
+    start = time.perf_counter()
+    rows = run(base_url(server_port))
+    seconds = time.perf_counter() - start
+    return {'pages_per_second': stats(server_port)['pages'] / seconds, 'rows': rows}
+
+
+def scenario_process(scenario, name, directory, results):
+    os.chdir(directory)
+    try:
+        # The stages report every page; only the numbers are wanted here
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            metrics = scenario(name)
+        metrics['peak_rss_mb'] = peak_rss_mb()
+    except BaseException as e:
+        metrics = {'error': repr(e)}
+    results.put(metrics)
+
+
+def measure(name):
+    scenario = parse_scenario if name in PARSE else end_to_end_scenario
+    server = start_server(server_port, **END_TO_END[name][1]) if name in END_TO_END else None
+    directory = tempfile.mkdtemp(prefix='scholar_bench_')
+    try:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=scenario_process, args=(scenario, name, directory, results))
+        process.start()
+        metrics = results.get()
+        process.join()
+    finally:
+        if server is not None:
+            stop_server(server)
+        shutil.rmtree(directory, ignore_errors=True)
+    return metrics
+
+
+'''Comparison against the stored baselines'''
+def check(name, metrics, baselines):
+    # Lines to print, broken runs, and metrics worse than their baseline
+    if 'error' in metrics:
+        return [f"{name:<26}failed: {metrics['error']}"], [f"{name} failed: {metrics['error']}"], []
+    lines, failures, regressions = [], [], []
+    if name in END_TO_END and metrics['rows'] != END_TO_END[name][2]:
+        # A run that lost rows is broken, however fast it was
+        failures.append(f"{name} wrote {metrics['rows']} rows instead of {END_TO_END[name][2]}")
+    for metric, higher_is_better in HIGHER_IS_BETTER.items():
+        if metric not in metrics:
+            continue
+        value = metrics[metric]
+        baseline = baselines.get(name, {}).get(metric)
+        if baseline is None:
+            lines.append(f"{name:<26}{metric:<18}{value:>12.1f}{'':>12}  no baseline")
+            continue
+        change = value / baseline - 1
+        worse = -change if higher_is_better else change
+        status = 'REGRESSED' if worse > tolerance else 'ok'
+        lines.append(f"{name:<26}{metric:<18}{value:>12.1f}{baseline:>12.1f}{change:>+9.0%}  {status}")
+        if worse > tolerance:
+            regressions.append(f"{name} {metric} is {value:.1f} against a baseline of {baseline:.1f} ({change:+.0%})")
+    return lines, failures, regressions
+
+
+def run(names=None, update_baseline=False):
+    names = names or list(PARSE) + list(END_TO_END)
+    unknown = [name for name in names if name not in PARSE and name not in END_TO_END]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}. Choose from {', '.join(list(PARSE) + list(END_TO_END))}")
+    baselines = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file, encoding='utf-8') as f:
+            baselines = json.load(f)
+
+    print(f"{'scenario':<26}{'metric':<18}{'value':>12}{'baseline':>12}{'change':>9}")
+    results, failures, regressions = {}, [], []
+    for name in names:
+        results[name] = measure(name)
+        lines, failed, regressed = check(name, results[name], baselines)
+        print('\n'.join(lines))
+        failures += failed
+        regressions += regressed
+
+    if update_baseline:
+        # Baselines belong to one machine; record them again after moving the suite
+        for name, metrics in results.items():
+            if 'error' not in metrics:
+                baselines[name] = {metric: round(metrics[metric], 1) for metric in HIGHER_IS_BETTER if metric in metrics}
+        with open(baseline_file, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baselines written to {baseline_file}.")
+        regressions = []
+    problems = failures + regressions
+    if problems:
+        print('\n' + '!' * 80)
+        for problem in problems:
+            print(f"!! {problem}")
+        print('!' * 80)
+        sys.exit(f"{len(problems)} benchmark check(s) failed.")
+
+
+if __name__ == '__main__':
+    # python benchmarks/bench_suite.py [--update-baseline] [scenario ...]
+    arguments = sys.argv[1:]
+    run([argument for argument in arguments if argument != '--update-baseline'],
+        update_baseline='--update-baseline' in arguments)
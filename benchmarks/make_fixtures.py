@@ -0,0 +1,132 @@
+import os
+import random
+import zlib
+
+'''Generate offline fixture pages that mirror Google Scholar's markup'''
+fixture_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+random.seed(7)
+WORDS = ('learning deep neural network graph citation analysis model data robust adaptive '
+         'framework large scale optimisation survey theory inference bayesian sparse temporal').split()
+
+# Real pages carry a lot of inline script and style before the content
+PAGE_HEAD = ('<!doctype html><html><head><title>Google Scholar</title><style>'
+             + '.gs_x{margin:0;padding:0}' * 400 + '</style><script>'
+             + 'var gs_x=function(a){return a};' * 400 + '</script></head><body>')
+PAGE_TAIL = '</body></html>'
+
+
+def title(n_words=9):
+    return ' '.join(random.choice(WORDS) for _ in range(n_words)).capitalize()
+
+
+def profile_page(user='AbCdEfGhIjK', article_count=100, cstart=0, more=False):
+    rows = []
+    for i in range(cstart, cstart + article_count):
+        rows.append(
+            f'<tr class="gsc_a_tr"><td class="gsc_a_t"><a href="/citations?view_op=view_citation&amp;hl=en'
+            f'&amp;user={user}&amp;citation_for_view={user}:{i:012d}" class="gsc_a_at">{title()}</a>'
+            f'<div class="gs_gray">A Author, B Author, C Author</div><div class="gs_gray">Journal of Things '
+            f'{i % 40}, {i % 300}-{i % 300 + 12}</div></td><td class="gsc_a_c"><a href="https://scholar.google.com/'
+            f'scholar?oi=bibs&amp;hl=en&amp;cites={1000000 + i}" class="gsc_a_ac gs_ibl">{(i * 37) % 500}</a></td>'
+            f'<td class="gsc_a_y"><span class="gsc_a_h gsc_a_hc gs_ibl">{2000 + i % 24}</span></td></tr>')
+    years = ''.join(f'<span class="gsc_g_t" style="right:{i * 32}px">{2010 + i}</span>' for i in range(14))
+    bars = ''.join(f'<a href="#" class="gsc_g_a" style="right:{i * 32}px"><span class="gsc_g_al">{100 + i * 25}</span></a>'
+                   for i in range(14))
+    disabled = '' if more else ' disabled=""'
+    return (
+        PAGE_HEAD
+        + f'<div id="gsc_prf_w"><div id="gsc_prf_in">Ada Example</div><div class="gsc_prf_il">Professor of Computing, '
+          f'<a href="/citations?view_op=view_org&amp;org=123" class="gsc_prf_ila">Example University</a></div>'
+          f'<div id="gsc_prf_ivh">Verified email at example.edu - <a href="https://example.edu/~ada" rel="nofollow" '
+          f'class="gsc_prf_ila">Homepage</a></div><div id="gsc_prf_int">'
+        + ''.join(f'<a href="/citations?view_op=search_authors&amp;mauthors=label:{w}" class="gsc_prf_inta gs_ibl">{w}</a>'
+                  for w in WORDS[:5])
+        + '</div></div><table id="gsc_rsb_st"><thead><tr><th></th><th class="gsc_rsb_sth">All</th>'
+          '<th class="gsc_rsb_sth">Since 2019</th></tr></thead><tbody>'
+          '<tr><td class="gsc_rsb_sc1"><a href="#" class="gsc_rsb_f gs_ibl">Citations</a></td><td class="gsc_rsb_std">12345</td><td class="gsc_rsb_std">6789</td></tr>'
+          '<tr><td class="gsc_rsb_sc1"><a href="#" class="gsc_rsb_f gs_ibl">h-index</a></td><td class="gsc_rsb_std">45</td><td class="gsc_rsb_std">30</td></tr>'
+          '<tr><td class="gsc_rsb_sc1"><a href="#" class="gsc_rsb_f gs_ibl">i10-index</a></td><td class="gsc_rsb_std">120</td><td class="gsc_rsb_std">90</td></tr>'
+          '</tbody></table>'
+        + f'<div class="gsc_md_hist_b">{years}{bars}</div>'
+        + '<div class="gsc_rsb_m"><div class="gsc_rsb_m_a"><span>42 articles</span></div>'
+          '<div class="gsc_rsb_m_na"><div>7 articles</div></div></div>'
+        + f'<table id="gsc_a_t"><tbody id="gsc_a_b">{"".join(rows)}</tbody></table>'
+        + f'<button type="button" id="gsc_bpf_more" class="gs_btnPD"{disabled}><span class="gs_lbl">Show more</span></button>'
+        + PAGE_TAIL)
+
+
+def author_search_page(name):
+    # One profile per name, with a user id made from the name, so each name finds its own researcher
+    user = f'U{zlib.crc32(name.encode("utf-8")):011d}'
+    return (PAGE_HEAD + '<div id="gsc_sa_ccl"><div class="gsc_1usr"><div class="gs_ai gs_scl gs_ai_chpr">'
+            f'<div class="gs_ai_t"><h3 class="gs_ai_name"><a href="/citations?hl=en&amp;user={user}">{name}</a></h3>'
+            '<div class="gs_ai_aff">Example University</div></div></div></div></div>' + PAGE_TAIL)
+
+
+def view_citation_page():
+    fields = [
+        ('Authors', 'Ada Example, Bob Example, Carol Example'),
+        ('Publication date', '2019/6/1'),
+        ('Journal', 'Journal of Examples'),
+        ('Volume', '12'),
+        ('Pages', '101-118'),
+        ('Publisher', 'Example Press'),
+    ]
+    rows = ''.join(f'<div class="gs_scl"><div class="gsc_oci_field">{name}</div><div class="gsc_oci_value">{value}</div></div>'
+                   for name, value in fields)
+    description = ('<div class="gs_scl"><div class="gsc_oci_field">Description</div><div class="gsc_oci_value" '
+                   f'id="gsc_oci_descr"><div class="gsh_small"><div class="gsh_csp">{" ".join(title() for _ in range(15))}'
+                   '</div></div></div></div>')
+    years = ''.join(f'<span class="gsc_oci_g_t" style="left:{i * 30}px">{2012 + i}</span>' for i in range(12))
+    bars = ''.join(f'<a href="#" class="gsc_oci_g_a" style="left:{i * 30}px"><span class="gsc_oci_g_al">{5 + i * 3}</span></a>'
+                   for i in range(12))
+    citations = ('<div class="gs_scl"><div class="gsc_oci_field">Total citations</div><div class="gsc_oci_value">'
+                 '<div style="margin-bottom:1em"><a href="https://scholar.google.com/scholar?oi=bibs&amp;hl=en&amp;'
+                 f'cites=1234567">Cited by 321</a></div><div id="gsc_oci_graph_bars">{years}{bars}</div></div></div>')
+    return (PAGE_HEAD + f'<div id="gsc_oci_title"><a class="gsc_oci_title_link" href="https://example.org/p">{title()}</a></div>'
+            + f'<div id="gsc_oci_table">{rows}{description}{citations}</div>' + PAGE_TAIL)
+
+
+def result_entry(i, matched_title=None):
+    shown_title = matched_title or title()
+    return (
+        f'<div class="gs_r gs_or gs_scl" data-cid="cid{i}"><div class="gs_ri"><h3 class="gs_rt">'
+        f'<span class="gs_ctc"><span class="gs_ct1">[PDF]</span></span> <a href="https://example.org/paper{i}">'
+        f'{shown_title.replace("learning", "<b>learning</b>")}</a></h3>'
+        f'<div class="gs_a"><a href="/citations?user=User{i:07d}&amp;hl=en">A Author</a>, B Author - '
+        f'Journal of Things, 20{10 + i % 14} - example.org</div>'
+        f'<div class="gs_rs">{" ".join(title() for _ in range(6))}</div>'
+        f'<div class="gs_fl"><a href="/scholar?cites={5000 + i}&amp;as_sdt=2005&amp;sciodt=0,5&amp;hl=en">Cited by {i * 7}</a>'
+        f' <a href="/scholar?q=related:abc{i}:scholar.google.com/">Related articles</a></div></div></div>')
+
+
+def search_page(query_title):
+    entries = [result_entry(0, query_title)] + [result_entry(i) for i in range(1, 10)]
+    return (PAGE_HEAD + '<div id="gs_ab_md"><div class="gs_ab_mdw">About 1,230 results (0.05 sec)</div></div>'
+            + f'<div id="gs_res_ccl"><div id="gs_res_ccl_mid">{"".join(entries)}</div></div>' + PAGE_TAIL)
+
+
+def cited_by_page(start=0, total=187, num=10):
+    entries = [result_entry(start + i) for i in range(min(num, total - start))]
+    nav = ''.join(f'<a href="/scholar?start={page * num}&amp;hl=en&amp;cites=1234567" class="gs_nma">{page + 1}</a>'
+                  for page in range(1, 10))
+    return (PAGE_HEAD + f'<div id="gs_ab_md"><div class="gs_ab_mdw">About {total} results (0.03 sec)</div></div>'
+            + f'<div id="gs_res_ccl"><div id="gs_res_ccl_mid">{"".join(entries)}</div></div>'
+            + f'<div id="gs_n"><div id="gs_nml">{nav}</div></div>' + PAGE_TAIL)
+
+
+SEARCH_TITLE = 'Deep learning for citation graph analysis'
+
+if __name__ == '__main__':
+    os.makedirs(fixture_directory, exist_ok=True)
+    pages = {
+        'profile.html': profile_page(),
+        'view_citation.html': view_citation_page(),
+        'search.html': search_page(SEARCH_TITLE),
+        'cited_by.html': cited_by_page(),
+    }
+    for name, html in pages.items():
+        with open(os.path.join(fixture_directory, name), 'w', encoding='utf-8') as f:
+            f.write(html)
+        print(f"Wrote {name} ({len(html)} bytes)")
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import time
+import urllib.request
+
+from aiohttp import web
+
+from make_fixtures import author_search_page, cited_by_page, profile_page, search_page, view_citation_page
+
+'''Local stand-in for Google Scholar: fixture pages behind configurable latency and throttling'''
+port = 8790
+latency = 0.02  # Mean seconds before each page is sent, standing in for the network and Scholar's own time
+latency_jitter = 0.5  # Each wait is latency times a factor within 1 +/- this
+rate_limit = None  # Requests per second answered before the server starts sending 429s; None never throttles
+burst = 10  # Requests let through at once before rate_limit applies
+retry_after_seconds = 1  # Sent in the Retry-After header of a 429
+profile_articles = 250  # Articles on every profile, served a pagesize at a time
+cited_by_total = 187  # Results in every cited-by list
+
+
+class ScholarStandIn:
+    def __init__(self, latency=latency, latency_jitter=latency_jitter, rate_limit=rate_limit, burst=burst,
+                 retry_after_seconds=retry_after_seconds, profile_articles=profile_articles,
+                 cited_by_total=cited_by_total):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.retry_after_seconds = retry_after_seconds
+        self.profile_articles = profile_articles
+        self.cited_by_total = cited_by_total
+        self.next_token = time.monotonic()
+        # Each URL is rendered once, so a page asked for twice is the same page and the server stays cheap
+        self.pages = {}
+        self.served = 0
+        self.throttled = 0
+        # Every request received, as (seconds since start, path and query), the most handled at once
+        # and the client connections they came over
+        self.started_at = time.monotonic()
+        self.log = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.connections = set()
+
+    def throttle(self):
+        # The same token bucket as the fetchers' HostRateLimiter; the event loop is the only writer
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        due = max(self.next_token, now)
+        if due - now > (self.burst - 1) / self.rate_limit:
+            return True
+        self.next_token = due + 1 / self.rate_limit
+        return False
+
+    def render(self, request):
+        query = request.query
+        if request.path == '/citations':
+            if query.get('view_op') == 'view_citation':
+                return view_citation_page()
+            if query.get('view_op') == 'search_authors':
+                return author_search_page(query.get('mauthors', ''))
+            cstart = int(query.get('cstart', 0))
+            page_size = int(query.get('pagesize', 20))
+            article_count = max(min(page_size, self.profile_articles - cstart), 0)
+            return profile_page(query.get('user', 'AbCdEfGhIjK'), article_count, cstart,
+                                more=cstart + page_size < self.profile_articles)
+        if request.path == '/scholar':
+            if 'cites' in query:
+                return cited_by_page(int(query.get('start', 0)), self.cited_by_total, int(query.get('num', 10)))
+            if 'q' in query:
+                return search_page(query['q'])
+        return None
+
+    async def handle(self, request):
+        if request.path == '/stats':
+            return web.json_response({'pages': self.served, 'throttled': self.throttled})
+        if request.path == '/log':
+            return web.json_response({'requests': self.log, 'max_in_flight': self.max_in_flight,
+                                      'connections': len(self.connections)})
+        self.log.append((time.monotonic() - self.started_at, request.path_qs))
+        self.connections.add(request.transport.get_extra_info('peername'))
+        if self.throttle():
+            self.throttled += 1
+            return web.Response(status=429, text='<html><body>Too many requests</body></html>',
+                                content_type='text/html', headers={'Retry-After': str(self.retry_after_seconds)})
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency * random.uniform(1 - self.latency_jitter, 1 + self.latency_jitter))
+        finally:
+            self.in_flight -= 1
+        html = self.pages.get(request.path_qs)
+        if html is None:
+            html = self.render(request)
+            if html is None:
+                return web.Response(status=404, text='Not found')
+            self.pages[request.path_qs] = html
+        self.served += 1
+        return web.Response(text=html, content_type='text/html')
+
+
+def serve(port=port, **settings):
+    app = web.Application()
+    app.router.add_route('GET', '/{path:.*}', ScholarStandIn(**settings).handle)
+    web.run_app(app, host='127.0.0.1', port=port, print=None)
+
+
+def base_url(port=port):
+    return f'http://127.0.0.1:{port}'
+
+
+def stats(port=port):
+    # Pages served and requests throttled since the server started
+    with urllib.request.urlopen(base_url(port) + '/stats', timeout=5) as response:
+        return json.load(response)
+
+
+def request_log(port=port):
+    # Requests received as [seconds since start, path and query], the most in flight at once
+    # and the number of client connections used
+    with urllib.request.urlopen(base_url(port) + '/log', timeout=5) as response:
+        return json.load(response)
+
+
+def start_server(port=port, **settings):
+    # The server runs in its own process, so its work and memory stay out of the measurements
+    process = multiprocessing.Process(target=serve, args=(port,), kwargs=settings, daemon=True)
+    process.start()
+    for _ in range(100):
+        try:
+            stats(port)
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"The Scholar stand-in did not start on port {port}")
+
+
+def stop_server(process):
+    process.terminate()
+    process.join()
+
+
+if __name__ == '__main__':
+    # python benchmarks/scholar_server.py [port] [latency] [rate_limit]
+    arguments = sys.argv[1:]
+    print(f"Serving fixture pages on {base_url(int(arguments[0]) if arguments else port)}")
+    serve(int(arguments[0]) if arguments else port,
+          latency=float(arguments[1]) if len(arguments) > 1 else latency,
+          rate_limit=float(arguments[2]) if len(arguments) > 2 else rate_limit)
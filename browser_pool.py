@@ -0,0 +1,183 @@
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future
+from functools import partial
+
+from instrumentation import count, flush, set_stage
+from page_cache import PageCache
+from parse_pool import close_parse_pool, submit
+from result_sink import open_sink
+from scholar_fetch import BlockedError, HttpFirstFetcher, load_identities, new_chrome_driver, shared_block_state
+
+# Times an item interrupted by a block is tried again, once the fetcher's pause for the host is over
+requeue_rounds = 2
+
+
+'''Worker process: one fetcher and at most one headless browser each'''
+def browser_worker(task_func, task_queue, result_queue, headless, requests_per_second, cache_directory, index,
+                   workers, stage=None, shared_blocks=None):
+    set_stage(stage or '')
+    # Each worker opens its own handle on the shared page cache, and sends as its share of the fetch identities
+    cache = PageCache(cache_directory) if cache_directory else None
+    identities = load_identities(requests_per_second, shared=shared_blocks).partition(index, workers)
+    fetcher = HttpFirstFetcher(driver_factory=partial(new_chrome_driver, headless=headless), cache=cache,
+                               identities=identities)
+    try:
+        while True:
+            row = task_queue.get()
+            if row is None:
+                break
+            result_queue.put((row, run_task(task_func, fetcher, row)))
+    finally:
+        fetcher.close()
+        if cache is not None:
+            cache.close()
+        # Tasks that parse through the parse pool themselves leave one behind in this worker
+        close_parse_pool()
+        flush()
+        # Tell the writer this worker is done
+        result_queue.put(None)
+
+
+def run_task(task_func, fetcher, row):
+    # Rows for one item, or None when it failed; a blocked item is tried again, and fails if it stays blocked.
+    # An item that found nothing gives an empty list, and is done
+    for attempt in range(requeue_rounds + 1):
+        try:
+            return task_func(fetcher, row)
+        except BlockedError as e:
+            print(f"Worker blocked ({attempt + 1} of {requeue_rounds + 1}): {e}")
+        except Exception as e:
+            print(f"Worker error: {e}")
+            break
+    return None
+
+
+def feed_tasks(rows, task_queue, workers):
+    for row in rows:
+        task_queue.put(row)
+    # One stop signal per worker
+    for _ in range(workers):
+        task_queue.put(None)
+
+
+def collect_results(result_queue, processes, workers, parse_func, results):
+    # With parse_func the workers only fetch; their pages go to the parse pool and the writer waits on
+    # the parse instead, so a worker is back on the network as soon as it has handed its page over
+    finished_workers = 0
+    while finished_workers < workers:
+        try:
+            result = result_queue.get(timeout=5)
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                print("All workers exited unexpectedly.")
+                break
+            continue
+
+        if result is None:
+            finished_workers += 1
+            continue
+        row, fetched = result
+        if parse_func is not None and fetched is not None:
+            fetched = submit(parse_func, fetched, row)
+        results.put((row, fetched))
+    results.put(None)
+
+
+def parsed_rows(future, extras_func=None):
+    try:
+        rows = future.result()
+    except Exception as e:
+        print(f"Parse error: {e}")
+        return None
+    if extras_func is not None:
+        rows, extras = rows
+        try:
+            extras_func(extras)
+        except Exception as e:
+            # The rows themselves are fine, so they are still saved
+            print(f"Could not save what the parse returned besides its rows: {e}")
+    return rows
+
+
+def save_batch(batch, sink):
+    print(f"Saving batch of {len(batch)} records...")
+    sink.write_rows(batch)
+
+
+'''Run task_func(fetcher, row) over rows in N worker processes with a single CSV writer'''
+# With parse_func, task_func only fetches and parse_func(fetched, row) turns its result into rows in the parse pool.
+# With extras_func as well, parse_func returns (rows, extras) and this process hands the extras to extras_func
+def run_browser_pool(task_func, rows, output_filename, columns, workers=4, headless=True,
+                     requests_per_second=0.5, batch_size=10, cache_directory='page_cache',
+                     checkpoint=None, key_column=None, output_format='csv', stage=None, parse_func=None,
+                     extras_func=None):
+    set_stage(stage or '')
+    task_queue = multiprocessing.Queue(maxsize=workers * 4)
+    result_queue = multiprocessing.Queue()
+
+    # Each identity's rate budget is spent by one worker, or split between the workers sharing it;
+    # a block one of them meets pauses and slows all of them
+    manager = multiprocessing.Manager()
+    shared_blocks = shared_block_state(manager)
+    processes = [
+        multiprocessing.Process(target=browser_worker,
+                                args=(task_func, task_queue, result_queue, headless,
+                                      requests_per_second, cache_directory, index, workers, stage, shared_blocks))
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    # Feed the work queue from a thread so the writer below can keep draining results
+    feeder = threading.Thread(target=feed_tasks, args=(rows, task_queue, workers), daemon=True)
+    feeder.start()
+    results = queue.Queue()
+    collector = threading.Thread(target=collect_results, args=(result_queue, processes, workers, parse_func, results),
+                                 daemon=True)
+    collector.start()
+
+    # This process is the only writer, so rows are never interleaved in the CSV
+    sink = open_sink(output_filename, columns, output_format, stage)
+    batch = []
+    batch_keys = []
+    while True:
+        result = results.get()
+        if result is None:
+            break
+
+        row, rows = result
+        if isinstance(rows, Future):
+            rows = parsed_rows(rows, extras_func)
+        count('items', status='failed' if rows is None else 'done')
+        if rows is None:
+            # The item failed; let it be retried later
+            if checkpoint is not None:
+                checkpoint.mark_failed(row[key_column])
+            continue
+
+        # An item that found nothing is done as well, and is recorded with the next batch
+        batch.extend(rows)
+        batch_keys.append(row[key_column] if key_column else None)
+        if len(batch) >= batch_size:
+            save_batch(batch, sink)
+            # Items only count as done once their rows are on disk
+            if checkpoint is not None:
+                checkpoint.mark_done(batch_keys)
+            batch = []
+            batch_keys = []
+
+    # Save any remaining data
+    if batch_keys:
+        if batch:
+            save_batch(batch, sink)
+        if checkpoint is not None:
+            checkpoint.mark_done(batch_keys)
+
+    sink.close()
+    for process in processes:
+        process.join()
+    manager.shutdown()
+    if parse_func is not None:
+        close_parse_pool()
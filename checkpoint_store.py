@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import pandas as pd
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+RETRY = 'retry'
+
+# Characters that make the same title look different between pages and files
+QUOTE_TABLE = str.maketrans({'‘': "'", '’': "'", '“': '"', '”': '"', '–': '-', '—': '-'})
+
+
+def normalize_key(text):
+    # Titles that differ only in unicode form, quoting, spacing or case share one key
+    text = unicodedata.normalize('NFKC', str(text)).translate(QUOTE_TABLE)
+    text = ' '.join(text.split()).casefold()
+    if len(text) > 1 and text[0] == text[-1] and text[0] in '"\'':
+        text = text[1:-1].strip()
+    return text
+
+
+'''Per-item resume state for one stage, kept in SQLite'''
+class CheckpointStore:
+    def __init__(self, stage, path='checkpoints.sqlite3', retry_delay=3600, max_attempts=5):
+        self.stage = stage
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        # Streamed inputs are filtered in the pool's feeder thread while the writer marks items done
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # The primary key is the index every resume lookup goes through
+        self.db.execute('''CREATE TABLE IF NOT EXISTS items (
+            stage TEXT, key TEXT, status TEXT, attempts INTEGER, retry_after REAL, updated_at REAL,
+            PRIMARY KEY (stage, key)) WITHOUT ROWID''')
+        self.db.commit()
+
+    def lookup(self, text):
+        with self.lock:
+            return self.db.execute('SELECT status, retry_after FROM items WHERE stage = ? AND key = ?',
+                                   (self.stage, normalize_key(text))).fetchone()
+
+    def should_fetch(self, text):
+        row = self.lookup(text)
+        if row is None:
+            return True
+        status, retry_after = row
+        if status == RETRY:
+            return retry_after <= time.time()
+        return status == PENDING
+
+    def pending(self, df, column):
+        # Keep rows that still need work, and only the first row of each key
+        seen = set()
+        keep = []
+        for text in df[column]:
+            key = normalize_key(text)
+            keep.append(key not in seen and self.should_fetch(text))
+            seen.add(key)
+        return df[keep]
+
+    def pending_rows(self, rows, column, commit_every=1000):
+        # The same filter over a stream of row dicts, with the store itself remembering the keys already let
+        # through: each is claimed by stamping it with this pass's start, so memory stays flat however long the input
+        claimed_at = time.time()
+        unsaved = 0
+        for row in rows:
+            if self.claim(row[column], claimed_at):
+                # Committed before the row is handed out, so other connections to the file are never held up
+                with self.lock:
+                    self.db.commit()
+                unsaved = 0
+                yield row
+                continue
+            unsaved += 1
+            if unsaved >= commit_every:
+                with self.lock:
+                    self.db.commit()
+                unsaved = 0
+        with self.lock:
+            self.db.commit()
+
+    def claim(self, text, claimed_at):
+        # True for a key seen for the first time, or one still due that this pass has not claimed yet
+        key = normalize_key(text)
+        with self.lock:
+            claimed = self.db.execute(
+                '''UPDATE items SET updated_at = ? WHERE stage = ? AND key = ? AND updated_at < ?
+                   AND (status = ? OR (status = ? AND retry_after <= ?))''',
+                (claimed_at, self.stage, key, claimed_at, PENDING, RETRY, time.time())).rowcount
+            if not claimed:
+                claimed = self.db.execute('INSERT OR IGNORE INTO items VALUES (?, ?, ?, 0, NULL, ?)',
+                                          (self.stage, key, PENDING, claimed_at)).rowcount
+        return claimed == 1
+
+    def mark_done(self, texts):
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO items VALUES (?, ?, ?, COALESCE((SELECT attempts FROM items WHERE stage = ? AND key = ?), 0) + 1, NULL, ?)',
+                [(self.stage, key, DONE, self.stage, key, now) for key in {normalize_key(text) for text in texts}])
+            self.db.commit()
+
+    def mark_failed(self, text):
+        # Failed items come back after retry_delay, until they run out of attempts
+        key = normalize_key(text)
+        with self.lock:
+            row = self.db.execute('SELECT attempts FROM items WHERE stage = ? AND key = ?',
+                                  (self.stage, key)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            status = FAILED if attempts >= self.max_attempts else RETRY
+            now = time.time()
+            self.db.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)',
+                            (self.stage, key, status, attempts, now + self.retry_delay, now))
+            self.db.commit()
+
+    def is_empty(self):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM items WHERE stage = ? LIMIT 1', (self.stage,)).fetchone() is None
+
+    def import_existing(self, output_filename, column, chunksize=100000):
+        # One-off migration: outputs written before the store existed count as done
+        if not self.is_empty() or not os.path.exists(output_filename):
+            return
+        print(f"Importing finished items from {output_filename} into the checkpoint store...")
+        for chunk in pd.read_csv(output_filename, usecols=[column], chunksize=chunksize):
+            self.mark_done(chunk[column].dropna())
+
+    def close(self):
+        self.db.close()
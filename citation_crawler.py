@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import importlib
+import math
+import sqlite3
+import time
+
+from checkpoint_store import DONE, FAILED, PENDING
+from instrumentation import count, set_stage
+from page_cache import PageCache
+from result_sink import iter_output_chunks, open_sink
+from scholar_fetch import AsyncFetcher
+from scholar_ids import cluster_id, has_value
+
+stage3 = importlib.import_module('3_title_google_search')
+stage4 = importlib.import_module('4_cited_articles_request')
+
+'''Crawl settings'''
+frontier_path = 'citation_frontier.sqlite3'
+output_file = 'citation_crawl.csv'
+max_depth = 2  # Seed papers are depth 0, the papers citing them depth 1, and so on
+max_nodes = 1000  # Papers whose citing articles are fetched in one run; the rest wait in the frontier
+order = 'bfs'  # 'bfs': depth by depth, most cited first within a depth; 'priority': most cited first at any depth
+max_attempts = 3  # A paper whose citations cannot be fetched is given up after this many runs
+use_bloom_filter = False  # Keep visited clusters in a Bloom filter instead of a set, for very large crawls
+expected_clusters = 10000000  # Bloom filter size, and its false positive rate at that size
+false_positive_rate = 0.001
+output_format = 'csv'  # 'csv', 'parquet' or 'both'
+
+output_columns = stage4.output_columns + ['Depth']
+
+FRONTIER_ORDER = {
+    'bfs': 'depth, cited_by DESC',
+    'priority': 'cited_by DESC, depth',
+}
+
+
+'''Visited clusters: a plain set, or a Bloom filter when a set would not fit in memory'''
+class BloomFilter:
+    def __init__(self, expected_items, false_positive_rate=0.001):
+        # About 14 bits per cluster at a 0.1% false positive rate, against ~100 bytes in a set
+        self.size = max(8, int(-expected_items * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / expected_items * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        # Two halves of one digest give every position (double hashing)
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+'''Crawl frontier: every cluster ever queued, with its depth and status, kept in SQLite'''
+class CrawlFrontier:
+    def __init__(self, path=frontier_path, visited=None):
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS nodes (
+            cluster TEXT PRIMARY KEY, title TEXT, url TEXT, cited_url TEXT, cited_by INTEGER, depth INTEGER,
+            parent TEXT, status TEXT, attempts INTEGER, updated_at REAL) WITHOUT ROWID''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS next_nodes ON nodes (status, depth, cited_by)')
+        self.db.commit()
+
+        # A cluster counts as visited once it is queued, so no paper is queued or fetched twice
+        self.visited = set() if visited is None else visited
+        for (cluster,) in self.db.execute('SELECT cluster FROM nodes'):
+            self.visited.add(cluster)
+
+    def insert(self, nodes, status=PENDING):
+        now = time.time()
+        rows = []
+        for node in nodes:
+            if node['cluster'] in self.visited:
+                continue
+            self.visited.add(node['cluster'])
+            rows.append((node['cluster'], node.get('title'), node.get('url'), node.get('cited_url'),
+                         node.get('cited_by'), node['depth'], node.get('parent'), status, 0, now))
+        self.db.executemany('INSERT OR IGNORE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def add(self, nodes, status=PENDING):
+        added = self.insert(nodes, status)
+        self.db.commit()
+        return added
+
+    def next_nodes(self, limit, max_depth, exclude=()):
+        # Nodes past max_depth stay queued, so a later run with a larger max_depth carries on from them
+        rows = self.db.execute(
+            f'SELECT cluster, title, url, cited_url, cited_by, depth FROM nodes WHERE status = ? AND depth <= ? '
+            f'ORDER BY {FRONTIER_ORDER[order]} LIMIT ?', (PENDING, max_depth, limit + len(exclude))).fetchall()
+        nodes = [dict(zip(['cluster', 'title', 'url', 'cited_url', 'cited_by', 'depth'], row)) for row in rows]
+        return [node for node in nodes if node['cluster'] not in exclude][:limit]
+
+    def mark_done(self, node, children):
+        # The citing papers are queued in the same transaction that closes their parent
+        self.insert(children)
+        self.db.execute('UPDATE nodes SET status = ?, attempts = attempts + 1, updated_at = ? WHERE cluster = ?',
+                        (DONE, time.time(), node['cluster']))
+        self.db.commit()
+
+    def mark_failed(self, node):
+        # Left pending for the next run until it runs out of attempts
+        self.db.execute('UPDATE nodes SET attempts = attempts + 1, updated_at = ?, '
+                        'status = CASE WHEN attempts + 1 >= ? THEN ? ELSE status END WHERE cluster = ?',
+                        (time.time(), max_attempts, FAILED, node['cluster']))
+        self.db.commit()
+
+    def summary(self):
+        return self.db.execute('SELECT depth, status, COUNT(*) FROM nodes GROUP BY depth, status '
+                               'ORDER BY depth, status').fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+'''Seeding: papers Steps 3 and 4 already reached start the crawl'''
+def citing_node(row, depth, parent=None):
+    return {'cluster': cluster_id(row['Next Cited Articles URL']), 'title': row['Cited Article Title'],
+            'url': row['Cited Article URL'], 'cited_url': row['Next Cited Articles URL'],
+            'cited_by': count_value(row.get('Cited Article Cited By Count')), 'depth': depth, 'parent': parent}
+
+
+def count_value(value):
+    return None if value is None or value != value else int(value)
+
+
+def seed_frontier(frontier):
+    # Papers Step 4 finished are done at depth 0 and their citing papers wait at depth 1,
+    # so nothing Step 4 fetched is fetched again
+    columns = ['Original Paper Title', 'Original Paper URL', 'Original Cited Page URL', 'Cited Article Title',
+               'Cited Article URL', 'Next Cited Articles URL', 'Cited Article Cited By Count']
+    added = 0
+    for chunk in iter_output_chunks(stage4.output_file, columns, stage4.output_format):
+        for row in chunk.to_dict('records'):
+            parent = cluster_id(row['Original Cited Page URL'])
+            if parent is None:
+                continue
+            added += frontier.insert([{'cluster': parent, 'title': row['Original Paper Title'],
+                                       'url': row['Original Paper URL'], 'cited_url': row['Original Cited Page URL'],
+                                       'depth': 0}], DONE)
+            child = citing_node(row, 1, parent)
+            if has_value(child['cluster']):
+                added += frontier.insert([child])
+        frontier.db.commit()
+
+    # Papers Step 3 found that Step 4 has not finished start at depth 0
+    columns = ['Original Title', 'URL', 'Cited Articles URL', 'Cited By Count']
+    for chunk in iter_output_chunks(stage3.output_filename, columns, stage3.output_format):
+        nodes = [{'cluster': cluster_id(row['Cited Articles URL']), 'title': row['Original Title'], 'url': row['URL'],
+                  'cited_url': row['Cited Articles URL'], 'cited_by': count_value(row['Cited By Count']), 'depth': 0}
+                 for row in chunk.to_dict('records')]
+        added += frontier.add([node for node in nodes if has_value(node['cluster'])])
+    print(f"Queued {added} new papers from the Step 3 and Step 4 outputs.")
+
+
+'''The crawl: fetch the citing papers of frontier nodes, and queue them one hop deeper'''
+def node_row(node):
+    # The row scrape_cited_articles expects for one paper
+    return {'Original Title': node['title'], 'URL': node['url'], 'Cited Articles URL': node['cited_url'],
+            'Cited By Count': node['cited_by']}
+
+
+async def crawl(frontier, sink, max_depth=max_depth, max_nodes=max_nodes):
+    set_stage('citation_crawl')
+    page_cache = PageCache(stage4.cache_directory)
+    crawled = 0
+    running = {}
+    # Papers taken this run, so one that fails is not retried until the next run
+    taken = set()
+    async with AsyncFetcher(concurrency=stage4.concurrency, requests_per_second=stage4.requests_per_second,
+                            cache=page_cache) as fetcher:
+        while True:
+            # Keep papers_in_flight papers in flight, taken in frontier order, until the budget is spent
+            room = min(stage4.papers_in_flight - len(running), max_nodes - crawled - len(running))
+            if room > 0:
+                for node in frontier.next_nodes(room, max_depth, taken):
+                    taken.add(node['cluster'])
+                    print(f"Crawling depth {node['depth']}: {node['title']}")
+                    running[asyncio.ensure_future(stage4.scrape_cited_articles(fetcher, node_row(node)))] = node
+            if not running:
+                break
+
+            finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                node = running.pop(task)
+                crawled += 1
+                try:
+                    rows = task.result()
+                except Exception as e:
+                    # A block or an error counts as a failed attempt; the paper stays in the frontier for a later run
+                    print(f"Could not crawl {node['title']}: {e}")
+                    count('items', status='failed')
+                    frontier.mark_failed(node)
+                    continue
+                # A paper nobody cites is done, with no children
+                count('items', status='done')
+                for row in rows:
+                    row['Depth'] = node['depth']
+                # Rows are on disk before their paper is marked done
+                if rows:
+                    sink.write_rows(rows)
+                children = [citing_node(row, node['depth'] + 1, node['cluster']) for row in rows]
+                frontier.mark_done(node, [child for child in children if has_value(child['cluster'])])
+    page_cache.close()
+    return crawled
+
+
+if __name__ == '__main__':
+    visited = BloomFilter(expected_clusters, false_positive_rate) if use_bloom_filter else None
+    frontier = CrawlFrontier(frontier_path, visited)
+    seed_frontier(frontier)
+
+    sink = open_sink(output_file, output_columns, output_format, 'citation_crawl')
+    try:
+        crawled = asyncio.run(crawl(frontier, sink))
+        print(f"Fetched the citing articles of {crawled} papers.")
+    finally:
+        sink.close()
+        for depth, status, total in frontier.summary():
+            print(f"Depth {depth}: {total} {status}")
+        frontier.close()
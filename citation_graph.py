@@ -0,0 +1,291 @@
+import importlib
+import json
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+
+import citation_crawler
+from checkpoint_store import normalize_key
+from result_sink import iter_output_chunks, output_snapshot
+from scholar_ids import ID_DTYPES, cluster_id
+
+stage4 = importlib.import_module('4_cited_articles_request')
+
+'''Graph settings'''
+graph_directory = 'citation_graph'
+# Outputs the edges are read from, each with the format it was written in
+edge_sources = [
+    (stage4.output_file, stage4.output_format),
+    (citation_crawler.output_file, citation_crawler.output_format),
+]
+
+EDGE_COLUMNS = [
+    'Original Paper Title', 'Original Cited Page URL', 'Original Cluster ID',
+    'Cited Article Title', 'Next Cited Articles URL', 'Cited Article Cluster ID',
+]
+
+
+def paper_keys(titles, clusters, urls):
+    # One key per paper: the cluster if known, as in scholar_ids.paper_key, else the normalised title.
+    # paper_key keeps the raw title, since the checkpoint store normalises the keys it is given; the node
+    # table matches keys exactly, so two spellings of one title must be normalised before they get there
+    clusters = clusters.copy()
+    missing = clusters.isna() | (clusters == '')
+    if missing.any():
+        # Files written before the ID columns existed only have the URL
+        clusters[missing] = urls[missing].map(cluster_id)
+    keys = 'cites:' + clusters
+    untitled = keys.isna() & titles.notna()
+    keys[untitled] = titles[untitled].map(normalize_key)
+    return keys
+
+
+def gather(offsets, neighbors, nodes):
+    # The neighbour lists of many nodes at once, in one fancy-indexing pass over the array
+    starts = offsets[nodes]
+    lengths = offsets[nodes + 1] - starts
+    bases = np.cumsum(lengths) - lengths
+    return neighbors[np.repeat(starts - bases, lengths) + np.arange(lengths.sum())]
+
+
+def sorted_unique(values):
+    # np.unique, but through a plain sort, which is many times faster on large integer arrays
+    values = np.sort(values)
+    if len(values) == 0:
+        return values
+    keep = np.empty(len(values), dtype=bool)
+    keep[0] = True
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+
+def save_array(path, array):
+    # Written to a temporary file first, so an interrupted build leaves the old graph readable
+    temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    with open(temp_path, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+'''Citation graph: paper IDs interned to integers, edges in CSR arrays memory-mapped from disk'''
+class CitationGraph:
+    def __init__(self, directory=graph_directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        # Node n is row n + 1; keys are cites:<cluster id>, or the normalised title for papers without one
+        self.db = sqlite3.connect(os.path.join(directory, 'nodes.sqlite3'), timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS nodes (id INTEGER PRIMARY KEY, key TEXT UNIQUE, title TEXT, '
+                        'title_key TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS node_titles ON nodes (title_key)')
+        self.db.commit()
+        self.load()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        # Opening a graph reads nothing; pages of the arrays are read as queries touch them
+        self.csr = {}
+        for direction in ('in', 'out'):
+            if os.path.exists(self.path(f"{direction}_offsets.npy")):
+                self.csr[direction] = (np.load(self.path(f"{direction}_offsets.npy"), mmap_mode='r'),
+                                       np.load(self.path(f"{direction}_neighbors.npy"), mmap_mode='r'))
+            else:
+                self.csr[direction] = (np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32))
+        self.node_count = len(self.csr['in'][0]) - 1
+        self.edge_count = len(self.csr['in'][1])
+
+    '''Building: new stage 4 and crawl rows are interned and appended, then the CSR arrays are rebuilt'''
+    def read_state(self):
+        # How far each source output has been read, as an output snapshot
+        if not os.path.exists(self.path('sources.json')):
+            return {}
+        with open(self.path('sources.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def write_state(self, state):
+        temp_path = self.path('.sources.json.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path('sources.json'))
+
+    def intern(self, keys, titles):
+        # Existing keys keep their number; new ones get the next free numbers
+        title_keys = [normalize_key(title) if isinstance(title, str) else None for title in titles]
+        self.db.executemany('INSERT OR IGNORE INTO nodes (key, title, title_key) VALUES (?, ?, ?)',
+                            zip(keys, titles, title_keys))
+        ids = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            ids.update(self.db.execute(f"SELECT key, id - 1 FROM nodes WHERE key IN ({','.join('?' * len(batch))})",
+                                       batch))
+        self.db.commit()
+        return np.array([ids[key] for key in keys], dtype=np.int32)
+
+    def intern_edges(self, chunk):
+        citing = paper_keys(chunk['Cited Article Title'], chunk['Cited Article Cluster ID'],
+                            chunk['Next Cited Articles URL'])
+        cited = paper_keys(chunk['Original Paper Title'], chunk['Original Cluster ID'], chunk['Original Cited Page URL'])
+        keep = (citing.notna() & cited.notna()).to_numpy()
+        keys = pd.concat([citing[keep], cited[keep]], ignore_index=True)
+        titles = pd.concat([chunk['Cited Article Title'][keep], chunk['Original Paper Title'][keep]], ignore_index=True)
+
+        # Each distinct paper in the chunk goes to SQLite once
+        nodes = pd.DataFrame({'key': keys, 'title': titles}).drop_duplicates('key')
+        node_ids = self.intern(nodes['key'].tolist(), nodes['title'].where(nodes['title'].notna(), None).tolist())
+        codes = node_ids[pd.Index(nodes['key']).get_indexer(keys)]
+        return np.column_stack([codes[:keep.sum()], codes[keep.sum():]]).astype(np.int32)
+
+    def update(self, sources=None, chunksize=100000):
+        # Only rows written since the last update are read; edges are kept as (citing, cited) pairs
+        state = self.read_state()
+        added = 0
+        with open(self.path('edges.bin'), 'ab') as edges_file:
+            for output_filename, output_format in sources or edge_sources:
+                snapshot = output_snapshot(output_filename)
+                for chunk in iter_output_chunks(output_filename, EDGE_COLUMNS, output_format, chunksize, snapshot,
+                                                dtype=ID_DTYPES, since=state.get(output_filename)):
+                    edges = self.intern_edges(chunk)
+                    edges.tofile(edges_file)
+                    added += len(edges)
+                state[output_filename] = snapshot
+            edges_file.flush()
+            os.fsync(edges_file.fileno())
+        # The edges are on disk before the sources count as read
+        self.write_state(state)
+        if added or not os.path.exists(self.path('in_offsets.npy')):
+            self.build()
+        return added
+
+    def build(self):
+        node_count = self.db.execute('SELECT COUNT(*) FROM nodes').fetchone()[0]
+        if node_count == 0:
+            return
+        edges = np.fromfile(self.path('edges.bin'), dtype=np.int32).reshape(-1, 2).astype(np.int64)
+        # Let go of the old memory maps first; Windows cannot replace a mapped file
+        self.csr = {}
+
+        # Sorting (row, neighbour) pairs packed into one integer orders each row's neighbours
+        # and drops edges recorded more than once
+        by_cited = sorted_unique(edges[:, 1] * node_count + edges[:, 0])
+        self.save_csr('in', by_cited // node_count, by_cited % node_count, node_count)
+        by_citing = sorted_unique(edges[:, 0] * node_count + edges[:, 1])
+        self.save_csr('out', by_citing // node_count, by_citing % node_count, node_count)
+
+        # Keep the edge list free of duplicates too, so it grows only with new edges
+        temp_path = self.path('.edges.bin.tmp')
+        np.column_stack([by_citing // node_count, by_citing % node_count]).astype(np.int32).tofile(temp_path)
+        os.replace(temp_path, self.path('edges.bin'))
+        self.load()
+        print(f"Citation graph: {self.node_count} papers, {self.edge_count} citations.")
+
+    def save_csr(self, direction, rows, neighbors, node_count):
+        offsets = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=node_count), out=offsets[1:])
+        save_array(self.path(f"{direction}_offsets.npy"), offsets)
+        save_array(self.path(f"{direction}_neighbors.npy"), neighbors.astype(np.int32))
+
+    '''Lookups between node numbers and papers'''
+    def find(self, cluster=None, title=None):
+        if cluster is not None:
+            row = self.db.execute('SELECT id - 1 FROM nodes WHERE key = ?', (f"cites:{cluster}",)).fetchone()
+        else:
+            row = self.db.execute('SELECT id - 1 FROM nodes WHERE title_key = ? ORDER BY id LIMIT 1',
+                                  (normalize_key(title),)).fetchone()
+        return row[0] if row else None
+
+    def describe(self, nodes):
+        # Key and title of each node, in the order given
+        nodes = [int(node) for node in np.atleast_1d(nodes)]
+        found = {}
+        for start in range(0, len(nodes), 500):
+            batch = [node + 1 for node in nodes[start:start + 500]]
+            for node_id, key, title in self.db.execute(
+                    f"SELECT id, key, title FROM nodes WHERE id IN ({','.join('?' * len(batch))})", batch):
+                found[node_id - 1] = (key, title)
+        return [found.get(node, (None, None)) for node in nodes]
+
+    '''Queries'''
+    def citing(self, node):
+        # Papers citing node, sorted
+        offsets, neighbors = self.csr['in']
+        return neighbors[offsets[node]:offsets[node + 1]]
+
+    def cited(self, node):
+        # Papers node cites, among those whose citations were scraped
+        offsets, neighbors = self.csr['out']
+        return neighbors[offsets[node]:offsets[node + 1]]
+
+    def in_degree(self, node=None):
+        offsets = self.csr['in'][0]
+        if node is None:
+            return np.diff(offsets)
+        return int(offsets[node + 1] - offsets[node])
+
+    def most_cited(self, count=10):
+        degrees = self.in_degree()
+        count = min(count, len(degrees))
+        if count == 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-degrees, count - 1)[:count]
+        return top[np.argsort(-degrees[top], kind='stable')]
+
+    def k_hop(self, node, hops=2, direction='in'):
+        # Nodes first reached at each hop: 'in' follows citing papers, 'out' cited ones
+        offsets, neighbors = self.csr[direction]
+        seen = np.array([node], dtype=np.int64)
+        frontier = seen
+        layers = []
+        for _ in range(hops):
+            reached = sorted_unique(gather(offsets, neighbors, frontier))
+            frontier = np.setdiff1d(reached, seen, assume_unique=True)
+            if len(frontier) == 0:
+                break
+            layers.append(frontier)
+            seen = np.union1d(seen, frontier)
+        return layers
+
+    def co_citation(self, first, second):
+        # How many papers cite both; the neighbour lists are sorted and unique
+        return len(np.intersect1d(self.citing(first), self.citing(second), assume_unique=True))
+
+    def co_cited_with(self, node, count=10):
+        # Papers cited together with node most often, and how often, from the reference lists of its citers
+        together = gather(*self.csr['out'], self.citing(node).astype(np.int64))
+        together = np.sort(together[together != node])
+        if len(together) == 0:
+            return together, np.zeros(0, dtype=np.int64)
+        starts = np.flatnonzero(np.concatenate([[True], together[1:] != together[:-1]]))
+        papers, counts = together[starts], np.diff(np.append(starts, len(together)))
+        order = np.argsort(-counts, kind='stable')[:count]
+        return papers[order], counts[order]
+
+    def close(self):
+        self.db.close()
+
+
+if __name__ == '__main__':
+    graph = CitationGraph(graph_directory)
+    added = graph.update()
+    print(f"Added {added} citation rows; {graph.node_count} papers, {graph.edge_count} citations.")
+    top = graph.most_cited(10)
+    for node, (key, title) in zip(top, graph.describe(top)):
+        print(f"{graph.in_degree(node):>8}  {title} ({key})")
+    if len(sys.argv) > 1:
+        # python citation_graph.py "<title>": its citing papers two hops out and its most co-cited papers
+        node = graph.find(title=sys.argv[1])
+        if node is None:
+            print(f"{sys.argv[1]} is not in the graph.")
+        else:
+            for hop, layer in enumerate(graph.k_hop(node, 2), 1):
+                print(f"{len(layer)} papers {hop} hop(s) away")
+            papers, counts = graph.co_cited_with(node, 10)
+            for count, (key, title) in zip(counts, graph.describe(papers)):
+                print(f"{count:>8}  co-cited: {title}")
+    graph.close()
@@ -0,0 +1,236 @@
+import importlib
+
+import numpy as np
+import pandas as pd
+
+from article_table import iter_expanded
+from result_sink import iter_output_chunks
+from scholar_ids import ID_DTYPES, has_value, paper_key
+
+stage1 = importlib.import_module('1_researcher_profile_extraction_v2')
+stage2 = importlib.import_module('2_google_articles_search')
+
+'''Metric settings'''
+output_file = 'researcher_metrics.csv'
+window_years = [5]  # Also compute each metric on the citations of the last N years, like Scholar's "Since" column
+current_year = None  # Last year of every window; None takes the latest year in the annual citations
+
+# Citation counts are packed under researcher numbers; no paper comes near this many citations
+COUNT_LIMIT = 2 ** 31 - 1
+
+SCRAPED_METRICS = {'citations': 'Total Citations', 'h-index': 'h-index', 'i10-index': 'i10-index'}
+
+
+'''Metrics for every researcher in one pass over flat article arrays'''
+def group_starts(groups):
+    # First position of each run of equal values in a sorted array
+    if len(groups) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+
+
+def index_metrics(groups, citations, group_count):
+    # h-index, i10-index and g-index of every group (researcher), from one citation count per article
+    # One sort of (researcher, most cited first) packed into a single integer; only the sorted
+    # values are needed, which is several times faster than lexsort's permutation
+    citations = np.minimum(np.asarray(citations, dtype=np.int64), COUNT_LIMIT)
+    packed = np.sort(np.asarray(groups, dtype=np.int64) * (COUNT_LIMIT + 1) + (COUNT_LIMIT - citations))
+    groups, citations = packed // (COUNT_LIMIT + 1), COUNT_LIMIT - packed % (COUNT_LIMIT + 1)
+
+    # Rank of each article within its researcher, most cited first
+    starts = group_starts(groups)
+    lengths = np.diff(np.append(starts, len(groups)))
+    ranks = np.arange(1, len(groups) + 1) - np.repeat(starts, lengths)
+    # Citations of the top `rank` articles, restarted at every researcher
+    cumulative = np.cumsum(citations)
+    cumulative -= np.repeat(cumulative[starts] - citations[starts], lengths)
+
+    # Each condition holds for the top articles of a researcher and for none after them,
+    # so counting the articles that meet it gives the index
+    return {
+        'citations': np.bincount(groups, weights=citations, minlength=group_count).astype(np.int64),
+        'h-index': np.bincount(groups[citations >= ranks], minlength=group_count),
+        'i10-index': np.bincount(groups[citations >= 10], minlength=group_count),
+        'g-index': np.bincount(groups[cumulative >= ranks ** 2], minlength=group_count),
+    }
+
+
+def window_citations(article_count, annual_article, annual_year, annual_count, first_year, last_year):
+    # Citations each article received from first_year to last_year
+    inside = (annual_year >= first_year) & (annual_year <= last_year)
+    return np.bincount(annual_article, weights=np.where(inside, annual_count, 0),
+                       minlength=article_count).astype(np.int64)
+
+
+def yearly_totals(group_count, article_group, annual_article, annual_year, annual_count):
+    # Citations per researcher per year, as a (researchers x years) matrix
+    if len(annual_year) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((group_count, 0), dtype=np.int64)
+    first = annual_year.min()
+    span = int(annual_year.max() - first + 1)
+    cells = article_group[annual_article].astype(np.int64) * span + (annual_year - first)
+    totals = np.bincount(cells, weights=annual_count, minlength=group_count * span)
+    return np.arange(first, first + span), totals.reshape(group_count, span).astype(np.int64)
+
+
+def compute_metrics(group_count, article_group, article_citations, annual_article, annual_year, annual_count,
+                    windows=None, last_year=None):
+    # All metrics as columns, one row per researcher; articles with unknown citations count as 0
+    windows = window_years if windows is None else windows
+    last_year = current_year if last_year is None else last_year
+    metrics = index_metrics(article_group, np.nan_to_num(article_citations).astype(np.int64), group_count)
+    metrics['articles'] = np.bincount(article_group, minlength=group_count)
+    metrics['articles with citations'] = np.bincount(article_group[~np.isnan(article_citations)],
+                                                     minlength=group_count)
+
+    years, totals = yearly_totals(group_count, article_group, annual_article, annual_year, annual_count)
+    if last_year is None:
+        last_year = int(years[-1]) if len(years) else None
+    for span in windows if last_year is not None else []:
+        cited = window_citations(len(article_group), annual_article, annual_year, annual_count,
+                                 last_year - span + 1, last_year)
+        for name, values in index_metrics(article_group, cited, group_count).items():
+            metrics[f"{name} ({span}y)"] = values
+
+    # Growth of the last full year over the one before; the latest year is usually still running
+    if len(years) >= 3:
+        previous, last = totals[:, -3], totals[:, -2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            metrics[f"growth {years[-2]}"] = np.where(previous > 0, last / previous - 1, np.nan)
+    return pd.DataFrame(metrics), years, totals
+
+
+'''Loading: stage 1 articles per researcher, joined to stage 2's citation counts by paper'''
+def parse_annual_cells(cells):
+    # Stage 2 cells, as CSV text "{'2019': 5}" or as Parquet lists of {'year', 'citations'},
+    # become (row, year, count) arrays
+    cells = pd.Series(list(cells))
+    text = cells.map(lambda cell: isinstance(cell, str))
+    rows, years, counts = [], [], []
+    if text.any():
+        found = cells[text].str.extractall(r"'(\d{4})':\s*'?(\d+)")
+        rows.append(found.index.get_level_values(0).to_numpy())
+        years.append(found[0].to_numpy(dtype=np.int64))
+        counts.append(found[1].to_numpy(dtype=np.int64))
+    for row, cell in cells[~text].items():
+        if isinstance(cell, (list, np.ndarray)):
+            pairs = [(item['year'], item['citations']) for item in cell
+                     if item['year'] is not None and item['citations'] is not None]
+            rows.append(np.full(len(pairs), row))
+            years.append(np.array([year for year, _ in pairs], dtype=np.int64))
+            counts.append(np.array([count for _, count in pairs], dtype=np.int64))
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(rows).astype(np.int64), np.concatenate(years), np.concatenate(counts)
+
+
+def load_paper_details(details_file=None, output_format=None):
+    # One row per paper key: stage 2's citation total and its annual citations
+    details_file = details_file or stage2.output_filename
+    columns = ['title', 'Article ID', 'Cluster ID', 'Total Citations', 'Annual Citations']
+    keys, totals, annual = [], [], []
+    offset = 0
+    for chunk in iter_output_chunks(details_file, columns, output_format or stage2.output_format, dtype=ID_DTYPES):
+        keys += [paper_key(title, cluster, article)
+                 for title, cluster, article in zip(chunk['title'], chunk['Cluster ID'], chunk['Article ID'])]
+        totals.append(pd.to_numeric(chunk['Total Citations'], errors='coerce').to_numpy(dtype=float))
+        rows, years, counts = parse_annual_cells(chunk['Annual Citations'])
+        annual.append((rows + offset, years, counts))
+        offset += len(chunk)
+    totals = np.concatenate(totals) if totals else np.zeros(0)
+    annual = tuple(np.concatenate(parts) for parts in zip(*annual)) if annual else (np.zeros(0, dtype=np.int64),) * 3
+    return pd.Index(keys), totals, annual
+
+
+def researcher_keys(flat):
+    # Researchers are told apart by profile id, so two people with one name stay two; rows saved
+    # before the id was recorded fall back to the name
+    ids = flat['Researcher ID'] if 'Researcher ID' in flat.columns else pd.Series(None, index=flat.index, dtype=object)
+    ids = ids.where(ids.map(has_value)).astype(object)
+    return ('id:' + ids).fillna('name:' + flat['name'].astype(str))
+
+
+def load_articles(profiles_file=None, source=None):
+    # Researchers in file order, and each article's researcher number, paper key and profile citation count
+    profiles_file = profiles_file or stage1.output_filename
+    source = source or ('csv' if stage1.output_format == 'csv' else 'parquet')
+    profile_columns = ['name', 'Researcher ID'] + list(SCRAPED_METRICS.values())
+    researchers, groups, keys, citations = [], [], [], []
+    codes, names = {}, {}
+    for flat in iter_expanded(profiles_file, source, chunksize=1000):
+        # A researcher's rows can run on into the next chunk, so numbers are kept by researcher key
+        flat = flat.assign(researcher=researcher_keys(flat))
+        first_rows = flat.drop_duplicates('researcher')
+        new = first_rows[first_rows['researcher'].map(codes).isna()]
+        for key, name in zip(new['researcher'], new['name']):
+            codes[key] = len(codes)
+            names[key] = name
+        # Outputs written before the id column existed lack it, and it is read back empty
+        researchers.append(new.reindex(columns=profile_columns))
+        # A profile saved under two names is counted once, under the first
+        flat = flat[flat['name'] == flat['researcher'].map(names)]
+
+        # Researchers without articles have one row with no title
+        listed = flat['Title'].notna().to_numpy()
+        groups.append(flat['researcher'][listed].map(codes).to_numpy(dtype=np.int64))
+        keys += [paper_key(title, cluster, article) for title, cluster, article
+                 in zip(flat['Title'][listed], flat['Cluster ID'][listed], flat['Article ID'][listed])]
+        citations.append(pd.to_numeric(flat['Citations'][listed], errors='coerce').to_numpy(dtype=float))
+    researchers = pd.concat(researchers, ignore_index=True) if researchers else pd.DataFrame(columns=profile_columns)
+    groups = np.concatenate(groups) if groups else np.zeros(0, dtype=np.int64)
+    citations = np.concatenate(citations) if citations else np.zeros(0)
+    return researchers, groups, keys, citations
+
+
+def join_paper_details(keys, detail_keys, detail_totals, annual):
+    # Each article's stage 2 total, and its annual citations as (article, year, count) arrays.
+    # Co-authors' copies of one paper all get its rows
+    first = ~detail_keys.duplicated()
+    positions = detail_keys[first].get_indexer(keys) if len(keys) else np.zeros(0, dtype=np.int64)
+    articles = np.flatnonzero(positions >= 0)
+    rows = np.flatnonzero(first)[positions[articles]]
+    totals = np.full(len(keys), np.nan)
+    totals[articles] = detail_totals[rows]
+
+    annual_rows, annual_years, annual_counts = annual
+    order = np.argsort(annual_rows, kind='stable')
+    offsets = np.searchsorted(annual_rows[order], np.arange(len(detail_keys) + 1))
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    entries = order[np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())]
+    return totals, (np.repeat(articles, lengths), annual_years[entries], annual_counts[entries])
+
+
+def scraped_value(values):
+    return pd.to_numeric(values.astype(str).str.replace(',', ''), errors='coerce').to_numpy(dtype=float)
+
+
+def researcher_metrics(profiles_file=None, details_file=None, windows=None, last_year=None):
+    researchers, groups, keys, profile_citations = load_articles(profiles_file)
+    detail_keys, detail_totals, annual = load_paper_details(details_file)
+    detail_citations, (annual_article, annual_year, annual_count) = join_paper_details(
+        keys, detail_keys, detail_totals, annual)
+
+    # The profile's own counts are what Scholar computes its indices from; stage 2 fills the gaps
+    citations = np.where(np.isnan(profile_citations), detail_citations, profile_citations)
+    metrics, _, _ = compute_metrics(len(researchers), groups, citations, annual_article, annual_year, annual_count,
+                                    windows, last_year)
+
+    # Cross-check against the values the profile page shows
+    result = pd.concat([researchers[['name', 'Researcher ID']].reset_index(drop=True), metrics], axis=1)
+    for metric, column in SCRAPED_METRICS.items():
+        scraped = scraped_value(researchers[column])
+        result[f"scraped {metric}"] = scraped
+        result[f"{metric} matches"] = scraped == metrics[metric].to_numpy()
+    return result
+
+
+if __name__ == '__main__':
+    result = researcher_metrics()
+    result.to_csv(output_file, index=False)
+    print(f"Wrote metrics for {len(result)} researchers to {output_file}.")
+    for metric, column in SCRAPED_METRICS.items():
+        # Differences come from articles whose citations are unknown, or from profiles scraped on another day
+        checked = result[f"scraped {metric}"].notna()
+        matched = result.loc[checked, f"{metric} matches"].sum()
+        print(f"{metric}: {matched} of {checked.sum()} researchers match their profile.")
@@ -0,0 +1,29 @@
+import pandas as pd
+
+'''Input settings'''
+chunksize = 20000  # Input rows held in memory at a time, however long the file is
+
+
+def input_columns(path, columns, optional=()):
+    # The columns to read. Without a required one every row would fail, so that is an error at once;
+    # optional ones the file lacks are read as empty
+    present = set(pd.read_csv(path, nrows=0).columns)
+    missing = [column for column in columns if column not in present]
+    if missing:
+        raise ValueError(f"{path} lacks the column(s) {', '.join(map(repr, missing))}; is it the right input file?")
+    return list(columns) + list(optional)
+
+
+def iter_input_chunks(path, columns, optional=(), chunksize=chunksize):
+    # Only the named columns are read, all as text so pandas never guesses a type. The columns are checked
+    # here rather than on the first chunk, so a wrong file fails in the caller and not in a feeder thread
+    wanted = input_columns(path, columns, optional)
+    chunks = pd.read_csv(path, usecols=lambda column: column in wanted, dtype=str, chunksize=chunksize)
+    return (chunk.reindex(columns=wanted) for chunk in chunks)
+
+
+def iter_input_rows(path, columns, optional=(), chunksize=chunksize):
+    # One small dict per row, built from plain tuples rather than the Series iterrows makes
+    names = list(columns) + list(optional)
+    chunks = iter_input_chunks(path, columns, optional, chunksize)
+    return (dict(zip(names, values)) for chunk in chunks for values in chunk.itertuples(index=False, name=None))
@@ -0,0 +1,225 @@
+import atexit
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+
+'''Instrumentation settings'''
+# Set SCHOLAR_METRICS=1 to record timings and counts; while off, every probe returns at the first check
+enabled = os.environ.get('SCHOLAR_METRICS', '') not in ('', '0')
+export_interval = 10  # Seconds between exports
+jsonl_path = 'metrics.jsonl'  # One JSON line per export, appended by every process
+prometheus_directory = 'metrics'  # One .prom file per process, for node_exporter's textfile collector
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+# The stage the running thread or task works for; threads and asyncio tasks each keep their own
+current_stage = contextvars.ContextVar('current_stage', default='')
+
+
+def set_stage(stage):
+    current_stage.set(stage)
+
+
+'''Metric types'''
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + [float('inf')], self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return None
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started_at = time.time()
+        self.last_export = (time.time(), {})
+
+    def count(self, name, labels, value):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram()
+            histogram.observe(value)
+
+
+registry = Registry()
+
+
+'''Probes used across the scripts'''
+class Timer:
+    __slots__ = ('step', 'labels', 'started_at')
+
+    def __init__(self, step, labels):
+        self.step = step
+        self.labels = labels
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        registry.observe(self.step, self.labels, time.perf_counter() - self.started_at)
+        return False
+
+
+class NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_TIMER = NoTimer()
+
+
+def label_key(labels):
+    return tuple(sorted(dict(labels, stage=current_stage.get()).items()))
+
+
+def timed(step, **labels):
+    # with timed('fetch'): ... records the block's duration in the step's latency histogram
+    if not enabled:
+        return NO_TIMER
+    start_exporter()
+    return Timer(step, label_key(labels))
+
+
+def count(name, value=1, **labels):
+    if not enabled:
+        return
+    start_exporter()
+    registry.count(name, label_key(labels), value)
+
+
+'''Export: JSON lines and a Prometheus text file, from a background thread'''
+def snapshot():
+    now = time.time()
+    with registry.lock:
+        counters = dict(registry.counters)
+        histograms = {key: (list(histogram.counts), histogram.count, histogram.sum, histogram.quantile(0.5),
+                            histogram.quantile(0.95)) for key, histogram in registry.histograms.items()}
+    previous_at, previous = registry.last_export
+    registry.last_export = (now, counters)
+    return now, now - previous_at, counters, previous, histograms
+
+
+def json_line(now, interval, counters, previous, histograms):
+    return json.dumps({
+        'time': now,
+        'pid': os.getpid(),
+        'uptime': now - registry.started_at,
+        'counters': [dict(key[1], name=key[0], total=value,
+                          per_second=(value - previous.get(key, 0)) / interval if interval > 0 else None)
+                     for key, value in counters.items()],
+        'timers': [dict(key[1], step=key[0], count=total, seconds=seconds, mean=seconds / total if total else None,
+                        p50=p50, p95=p95)
+                   for key, (_, total, seconds, p50, p95) in histograms.items()],
+    })
+
+
+def label_value(value):
+    # The text format's escapes for a label value: backslash, double quote and line feed
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    return '{' + ','.join(f'{key}="{label_value(value)}"' for key, value in pairs) + '}'
+
+
+def prometheus_text(counters, histograms):
+    lines = []
+    names = sorted({key[0] for key in counters})
+    for name in names:
+        lines.append(f'# TYPE scholar_{name}_total counter')
+        lines += [f'scholar_{name}_total{prometheus_labels(labels)} {value}'
+                  for (counter, labels), value in counters.items() if counter == name]
+    if histograms:
+        lines.append('# TYPE scholar_step_seconds histogram')
+    for (step, labels), (counts, total, seconds, _, _) in histograms.items():
+        cumulative = 0
+        for bound, count_in_bucket in zip(BUCKETS + ['+Inf'], counts):
+            cumulative += count_in_bucket
+            lines.append(f'scholar_step_seconds_bucket{prometheus_labels(labels, step=step, le=bound)} {cumulative}')
+        lines.append(f'scholar_step_seconds_sum{prometheus_labels(labels, step=step)} {seconds}')
+        lines.append(f'scholar_step_seconds_count{prometheus_labels(labels, step=step)} {total}')
+    return '\n'.join(lines) + '\n'
+
+
+def export():
+    now, interval, counters, previous, histograms = snapshot()
+    if not counters and not histograms:
+        return
+    with open(jsonl_path, 'a', encoding='utf-8') as file:
+        file.write(json_line(now, interval, counters, previous, histograms) + '\n')
+    # Written to a temporary name and renamed, so the collector never reads half a file
+    os.makedirs(prometheus_directory, exist_ok=True)
+    path = os.path.join(prometheus_directory, f'scholar_{os.getpid()}.prom')
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        file.write(prometheus_text(counters, histograms))
+    os.replace(path + '.tmp', path)
+
+
+def flush():
+    # Forked worker processes end without running atexit handlers, so they export their last numbers
+    # here, and only here: the atexit export is dropped for processes that do run it
+    if enabled and exporter_pid == os.getpid():
+        atexit.unregister(export)
+        export()
+
+
+exporter_pid = None
+exporter_lock = threading.Lock()
+
+
+def export_loop():
+    while True:
+        time.sleep(export_interval)
+        try:
+            export()
+        except OSError as e:
+            print(f"Could not export metrics: {e}")
+
+
+def start_exporter():
+    # One exporter thread per process, started by the first probe; worker processes start their own
+    global exporter_pid, registry
+    if exporter_pid == os.getpid():
+        return
+    with exporter_lock:
+        if exporter_pid == os.getpid():
+            return
+        if exporter_pid is not None:
+            # A forked worker starts from an empty registry; its parent exports what it recorded itself
+            registry = Registry()
+        exporter_pid = os.getpid()
+        threading.Thread(target=export_loop, daemon=True).start()
+        atexit.register(export)
@@ -0,0 +1,134 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DAY = 24 * 3600
+
+# How long a cached page counts as fresh, by page type
+PAGE_TTLS = {
+    'author_search': 30 * DAY,
+    'profile': 7 * DAY,
+    'view_citation': 30 * DAY,
+    'search': 30 * DAY,
+    'cited_by': 7 * DAY,
+    'other': 7 * DAY,
+}
+
+
+def normalize_url(url):
+    # Same page, same key: lower-case scheme and host, sorted query, no fragment
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+
+def page_type(url):
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    if parts.path.startswith('/citations'):
+        if query.get('view_op') == 'search_authors':
+            return 'author_search'
+        if query.get('view_op') == 'view_citation':
+            return 'view_citation'
+        if 'user' in query:
+            return 'profile'
+    if parts.path.startswith('/scholar'):
+        if 'cites' in query:
+            return 'cited_by'
+        if 'q' in query:
+            return 'search'
+    return 'other'
+
+
+'''On-disk cache of raw fetched HTML'''
+class PageCache:
+    def __init__(self, directory='page_cache', max_bytes=2 * 1024 ** 3, ttls=None, replay=False):
+        # replay=True serves every cached page regardless of age, e.g. to re-parse after a selector fix
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = dict(PAGE_TTLS, **(ttls or {}))
+        self.replay = replay
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # The index lives next to the pages; WAL lets several worker processes share it
+        self.db = sqlite3.connect(os.path.join(directory, 'index.sqlite3'), timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS pages (
+            key TEXT PRIMARY KEY, url TEXT, page_type TEXT, size INTEGER, fetched_at REAL, accessed_at REAL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER)')
+        self.db.execute("INSERT OR IGNORE INTO totals VALUES ('bytes', 0)")
+        self.db.commit()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], key + '.html.gz')
+
+    def get(self, url):
+        url = normalize_url(url)
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        with self.lock:
+            row = self.db.execute('SELECT page_type, fetched_at FROM pages WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            cached_type, fetched_at = row
+            if not self.replay and time.time() - fetched_at > self.ttls[cached_type]:
+                return None
+            try:
+                with gzip.open(self.path_for(key), 'rt', encoding='utf-8') as f:
+                    html = f.read()
+            except FileNotFoundError:
+                return None
+            self.db.execute('UPDATE pages SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self.db.commit()
+        return html
+
+    def put(self, url, html):
+        url = normalize_url(url)
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so a crash never leaves a half-written page
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+
+        now = time.time()
+        with self.lock:
+            old = self.db.execute('SELECT size FROM pages WHERE key = ?', (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, url, page_type(url), size, now, now))
+            self.db.execute("UPDATE totals SET value = value + ? WHERE name = 'bytes'",
+                            (size - (old[0] if old else 0),))
+            self.db.commit()
+            self.evict()
+
+    def evict(self):
+        # Drop least recently used pages until the cache fits under its byte cap
+        total = self.db.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone()[0]
+        while total > self.max_bytes:
+            oldest = self.db.execute(
+                'SELECT key, size FROM pages ORDER BY accessed_at LIMIT 100').fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self.path_for(key))
+                except FileNotFoundError:
+                    pass
+                self.db.execute('DELETE FROM pages WHERE key = ?', (key,))
+                self.db.execute("UPDATE totals SET value = value - ? WHERE name = 'bytes'", (size,))
+                total -= size
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
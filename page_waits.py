@@ -0,0 +1,48 @@
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from page_cache import page_type
+
+# What has to be in the DOM before a page can be parsed, by page type
+READY_CONDITIONS = {
+    'author_search': [(By.CSS_SELECTOR, '#gsc_sa_ccl, .gs_ai_t')],
+    # Article rows (or the "no articles" cell) plus the citation-per-year graph
+    'profile': [(By.CSS_SELECTOR, '#gsc_a_b .gsc_a_tr, #gsc_a_b .gsc_a_e'),
+                (By.CSS_SELECTOR, '.gsc_md_hist_b, #gsc_rsb_cit')],
+    'view_citation': [(By.ID, 'gsc_oci_title'),
+                      (By.CSS_SELECTOR, '#gsc_oci_graph_bars, #gsc_oci_table')],
+    'search': [(By.ID, 'gs_res_ccl')],
+    'cited_by': [(By.ID, 'gs_res_ccl')],
+}
+
+
+def document_ready(driver):
+    return driver.execute_script('return document.readyState') == 'complete'
+
+
+'''Wait until a condition holds instead of sleeping for a fixed time'''
+def wait_for(driver, condition, timeout=10, poll_frequency=0.1):
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=poll_frequency).until(condition)
+        return True
+    except TimeoutException:
+        return False
+
+
+def wait_for_element(driver, locator, timeout=10):
+    return wait_for(driver, EC.presence_of_element_located(locator), timeout)
+
+
+def wait_until_ready(driver, url, timeout=10):
+    # Returns as soon as the page is usable; on timeout the caller parses what is there,
+    # which also leaves a person time to clear a consent or CAPTCHA page in a visible browser
+    if not wait_for(driver, document_ready, timeout):
+        print(f"Timed out waiting for {url} to load.")
+        return False
+    for locator in READY_CONDITIONS.get(page_type(url), []):
+        if not wait_for_element(driver, locator, timeout):
+            print(f"Timed out waiting for {locator[1]} on {url}.")
+            return False
+    return True
@@ -0,0 +1,90 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
+from instrumentation import current_stage, flush, set_stage
+
+'''Parse settings'''
+# Processes running the extraction while fetchers only download; one core is left to the fetchers
+# and the writer, and 0 parses inline in the fetching thread
+parse_workers = max((os.cpu_count() or 1) - 1, 0)
+pages_per_worker = 4  # Pages queued per parse worker before fetchers wait for the parsers to catch up
+
+# Workers start from a fresh interpreter: forking a process that already runs fetch threads can copy
+# a lock another thread holds. They read each module's settings as written in its file
+start_method = 'spawn'
+
+
+'''One parse pool per process, shared by every stage and thread in it'''
+pools = {}
+pools_lock = threading.Lock()
+# Slots for pages queued from an event loop, one semaphore per loop, so waiting for one never blocks the loop
+loop_slots = weakref.WeakKeyDictionary()
+
+
+def parse_pool():
+    with pools_lock:
+        pool = pools.get(os.getpid())
+        if pool is None:
+            executor = ProcessPoolExecutor(parse_workers, mp_context=multiprocessing.get_context(start_method),
+                                           initializer=start_worker)
+            pool = pools[os.getpid()] = (executor, threading.BoundedSemaphore(parse_workers * pages_per_worker))
+        return pool
+
+
+def close_parse_pool():
+    with pools_lock:
+        pool = pools.pop(os.getpid(), None)
+    if pool is not None:
+        pool[0].shutdown()
+
+
+def start_worker():
+    # Workers started by fork or forkserver end without running atexit handlers, but multiprocessing
+    # runs its finalizers in every worker, so the last numbers are exported when the pool shuts it down
+    Finalize(None, flush, exitpriority=10)
+
+
+def parse_job(stage, function, args):
+    # Timings recorded in the worker are labelled with the stage that fetched the page
+    set_stage(stage)
+    return function(*args)
+
+
+def submit(function, *args):
+    # Queue function(page, ...) for a parse worker; function must be a module-level function
+    if not parse_workers:
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    executor, slots = parse_pool()
+    # A full queue holds the fetcher here, so unparsed pages never pile up in memory
+    slots.acquire()
+    future = executor.submit(parse_job, current_stage.get(), function, args)
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+def parse(function, *args):
+    # The calling thread waits for the result without holding the GIL, so other threads keep fetching
+    return submit(function, *args).result()
+
+
+async def parse_async(function, *args):
+    if not parse_workers:
+        return function(*args)
+    executor, _ = parse_pool()
+    loop = asyncio.get_running_loop()
+    slots = loop_slots.get(loop)
+    if slots is None:
+        slots = loop_slots[loop] = asyncio.Semaphore(parse_workers * pages_per_worker)
+    # A full queue holds this task, not the loop: the other fetches in flight carry on meanwhile
+    async with slots:
+        return await asyncio.wrap_future(executor.submit(parse_job, current_stage.get(), function, args))
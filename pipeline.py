@@ -0,0 +1,320 @@
+import asyncio
+import importlib
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import repeat
+
+from article_table import expand_articles, iter_expanded
+from author_resolver import find_author_url
+from browser_pool import requeue_rounds, run_task
+from checkpoint_store import CheckpointStore, normalize_key
+from instrumentation import count, set_stage
+from page_cache import PageCache
+from parse_pool import close_parse_pool
+from result_sink import iter_output_chunks, open_sink, output_snapshot
+from scholar_fetch import AsyncFetcher, BlockedError, HttpFirstFetcher, load_identities, new_chrome_driver
+from scholar_ids import ID_DTYPES, article_id, cluster_id, paper_key, researcher_id
+
+stage1 = importlib.import_module('1_researcher_profile_extraction_v2')
+stage2 = importlib.import_module('2_google_articles_search')
+stage3 = importlib.import_module('3_title_google_search')
+stage4 = importlib.import_module('4_cited_articles_request')
+
+'''Pipeline settings'''
+# Worker threads per stage; stage 4 workers are papers in flight on one async fetcher
+stage_workers = {'researcher_profiles': 2, 'paper_details': 4, 'title_search': 4, 'cited_articles': 8}
+queue_size = 100  # Items waiting in front of each stage; a full queue pauses the stage feeding it
+requests_per_second = 0.5  # One budget for the whole pipeline, since every stage hits the same host
+headless = True
+cache_directory = 'page_cache'
+output_format = 'csv'  # 'csv', 'parquet' or 'both'
+
+
+'''One stage: a bounded inbox, its worker threads, one output sink and its checkpoint store'''
+class Stage:
+    def __init__(self, name, task, workers, key_column, output_filename, columns, output_key_column,
+                 downstream_items=None, title_column=None):
+        self.name = name
+        self.task = task
+        self.workers = workers
+        self.key_column = key_column
+        self.title_column = title_column
+        self.downstream_items = downstream_items
+        self.downstream = None
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.producers = 0
+        self.started_at = time.monotonic()
+        self.first_output = True
+
+        self.checkpoint = CheckpointStore(name)
+        self.checkpoint.import_existing(output_filename, output_key_column)
+        # What was saved before this run, for refilling the next stage; rows this run appends are not in it
+        self.saved = output_snapshot(output_filename)
+        self.sink = open_sink(output_filename, columns, output_format, name)
+
+    def add_producer(self):
+        with self.lock:
+            self.producers += 1
+
+    def producer_done(self):
+        # Once nothing can feed this stage any more, tell each of its workers to stop
+        with self.lock:
+            self.producers -= 1
+            last = self.producers == 0
+        if last:
+            for _ in range(self.workers):
+                self.inbox.put(None)
+
+    def offer(self, item):
+        # Each key is queued once per run, and never if the checkpoint store has it done
+        key = normalize_key(item[self.key_column])
+        with self.lock:
+            if key in self.seen or not self.checkpoint.should_fetch(item[self.key_column]):
+                return
+            # Papers finished before fetches were keyed by ID were recorded by title
+            if self.title_column and not self.checkpoint.should_fetch(item[self.title_column]):
+                return
+            self.seen.add(key)
+        # Blocks while the inbox is full, which is what slows the upstream stage down
+        self.inbox.put(item)
+
+    def finish(self, item, rows):
+        # rows is None when the item failed, and empty when it is done but had nothing to save
+        with self.lock:
+            if rows is None:
+                self.checkpoint.mark_failed(item[self.key_column])
+                count('items', status='failed')
+                return
+            if rows:
+                self.sink.write_rows(rows)
+            # Rows are on disk before the item counts as done
+            self.checkpoint.mark_done([item[self.key_column]])
+            if rows and self.first_output:
+                self.first_output = False
+                print(f"First {self.name} rows saved {time.monotonic() - self.started_at:.0f}s after launch.")
+        count('items', status='done')
+        if self.downstream is not None:
+            for row in rows:
+                for next_item in self.downstream_items(row):
+                    self.downstream.offer(next_item)
+
+    def fail(self, item, error):
+        # A worker that could not save an item records it and carries on draining the inbox,
+        # so the stage feeding this one is never left blocked on a full queue
+        print(f"{self.name} could not finish {item[self.key_column]}: {error}")
+        count('items', status='failed')
+        try:
+            with self.lock:
+                self.checkpoint.mark_failed(item[self.key_column])
+        except Exception as e:
+            print(f"{self.name} could not record {item[self.key_column]} as failed: {e}")
+
+    def close(self):
+        self.sink.close()
+        self.checkpoint.close()
+
+
+'''What each stage does with one item, and what it hands to the next stage'''
+# Profiles claimed by a worker in this run, so two names for one researcher are scraped once
+claimed_researchers = set()
+claimed_lock = threading.Lock()
+
+
+def scrape_researcher(fetcher, row):
+    researcher_url = find_author_url(fetcher, row['name'], given=row.get(stage1.profile_column))
+    if researcher_url is None:
+        # Failed, so the name is searched again once the author cache stops answering it
+        return None
+    with claimed_lock:
+        if researcher_id(researcher_url) in claimed_researchers:
+            print(f"{row['name']} has the same profile as an earlier name; skipping it.")
+            return []
+        claimed_researchers.add(researcher_id(researcher_url))
+    return stage1.scrape_researcher_profile(fetcher, {'name': row['name'], 'researcher_url': researcher_url})
+
+
+def paper_item(title, url, cluster=None):
+    article = article_id(url)
+    return {'Title': title, 'URL': url, 'Article ID': article, 'Cluster ID': cluster,
+            'Paper Key': paper_key(title, cluster, article)}
+
+
+def articles_of(profile):
+    return [paper_item(article.get('Title'), article.get('URL'), article.get('Cluster ID'))
+            for article in profile['Articles'] if article.get('Title')]
+
+
+def paper_of(details):
+    if not details.get('title'):
+        return []
+    return [{'title': details['title'], 'paper url': details['paper url'],
+             'Article ID': details.get('Article ID'), 'Cluster ID': details.get('Cluster ID')}]
+
+
+def cited_page_item(title, url, cited_articles_url, cited_by=None):
+    return {'Original Title': title, 'URL': url, 'Cited Articles URL': cited_articles_url, 'Cited By Count': cited_by,
+            'Paper Key': paper_key(title, cluster_id(cited_articles_url))}
+
+
+def cited_page_of(result):
+    if not result.get('Cited Articles URL'):
+        return []
+    return [cited_page_item(result['Original Title'], result['URL'], result['Cited Articles URL'],
+                            result.get('Cited By Count'))]
+
+
+def build_stages():
+    stages = [
+        Stage('researcher_profiles', scrape_researcher, stage_workers['researcher_profiles'], 'name',
+              stage1.output_filename, stage1.output_columns, 'name', articles_of),
+        Stage('paper_details', stage2.scrape_paper_details, stage_workers['paper_details'], 'Paper Key',
+              stage2.output_filename, stage2.output_columns, 'title', paper_of, title_column='Title'),
+        Stage('title_search', stage3.search_title_row, stage_workers['title_search'], 'title',
+              stage3.output_filename, stage3.output_columns, 'Original Title', cited_page_of),
+        Stage('cited_articles', stage4.scrape_cited_articles, stage_workers['cited_articles'], 'Paper Key',
+              stage4.output_file, stage4.output_columns, 'Original Paper Title', title_column='Original Title'),
+    ]
+    for stage, next_stage in zip(stages, stages[1:]):
+        stage.downstream = next_stage
+    return stages
+
+
+'''Feeding: names go into stage 1; earlier outputs refill the later stages after a restart'''
+def feed_names(stage, names, profiles=None):
+    # profiles holds each name's optional profile URL or user id, as stage 1's profile_column does
+    profiles = profiles if profiles is not None else repeat(None)
+    try:
+        for name, profile in zip(names, profiles):
+            stage.offer({'name': name, stage1.profile_column: profile})
+    finally:
+        stage.producer_done()
+
+
+def saved_items(stage, previous):
+    # Items the previous stage saved in earlier runs, so a restart picks up where the last run stopped
+    if stage.name == 'paper_details':
+        source = 'csv' if output_format == 'csv' else 'parquet'
+        for flat in iter_expanded(stage1.output_filename, source, snapshot=previous.saved):
+            for row in flat.dropna(subset=['Title']).to_dict('records'):
+                yield paper_item(row['Title'], row['URL'], row['Cluster ID'])
+    elif stage.name == 'title_search':
+        columns = ['title', 'paper url', 'Article ID', 'Cluster ID']
+        for chunk in iter_output_chunks(stage2.output_filename, columns, output_format, snapshot=previous.saved,
+                                        dtype=ID_DTYPES):
+            yield from chunk.dropna(subset=['title']).to_dict('records')
+    elif stage.name == 'cited_articles':
+        columns = ['Original Title', 'URL', 'Cited Articles URL', 'Cited By Count']
+        for chunk in iter_output_chunks(stage3.output_filename, columns, output_format, snapshot=previous.saved):
+            for row in chunk.dropna(subset=['Original Title', 'Cited Articles URL']).to_dict('records'):
+                yield cited_page_item(row['Original Title'], row['URL'], row['Cited Articles URL'],
+                                      row['Cited By Count'])
+
+
+def feed_saved_items(stage, previous):
+    try:
+        for item in saved_items(stage, previous):
+            stage.offer(item)
+    finally:
+        stage.producer_done()
+
+
+'''Workers'''
+def stage_worker(stage, identities):
+    set_stage(stage.name)
+    # Each thread has its own sessions and page cache handle; all of them share the identity pool
+    page_cache = PageCache(cache_directory)
+    fetcher = HttpFirstFetcher(driver_factory=partial(new_chrome_driver, headless=headless),
+                               cache=page_cache, identities=identities)
+    try:
+        while True:
+            item = stage.inbox.get()
+            if item is None:
+                break
+            try:
+                stage.finish(item, run_task(stage.task, fetcher, item))
+            except Exception as e:
+                stage.fail(item, e)
+    finally:
+        fetcher.close()
+        page_cache.close()
+        if stage.downstream is not None:
+            stage.downstream.producer_done()
+
+
+async def async_stage_worker(stage, fetcher):
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await loop.run_in_executor(None, stage.inbox.get)
+        if item is None:
+            break
+        rows = None
+        for attempt in range(requeue_rounds + 1):
+            try:
+                rows = await stage.task(fetcher, item)
+                break
+            except BlockedError as e:
+                print(f"{stage.name} worker blocked ({attempt + 1} of {requeue_rounds + 1}): {e}")
+            except Exception as e:
+                print(f"{stage.name} worker error: {e}")
+                break
+        # Writing the rows and the checkpoint blocks, so it runs off the event loop
+        try:
+            await loop.run_in_executor(None, stage.finish, item, rows)
+        except Exception as e:
+            stage.fail(item, e)
+
+
+async def run_async_stage(stage, identities):
+    set_stage(stage.name)
+    # Stage 4 keeps its async fetcher; waiting on the inbox and saving happen in helper threads,
+    # one per worker at a time
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(stage.workers))
+    page_cache = PageCache(cache_directory)
+    async with AsyncFetcher(concurrency=stage4.concurrency, cache=page_cache, identities=identities) as fetcher:
+        await asyncio.gather(*(async_stage_worker(stage, fetcher) for _ in range(stage.workers)))
+    page_cache.close()
+
+
+def run_pipeline(names, profiles=None):
+    started_at = time.monotonic()
+    # One pool of fetch identities, and so one set of rate budgets, for every stage
+    identities = load_identities(requests_per_second)
+    stages = build_stages()
+
+    # A stage stops once its feeders are done: the names or the previous stage's workers,
+    # plus the reader that refills it from saved output
+    stages[0].add_producer()
+    for stage, previous in zip(stages[1:], stages):
+        for _ in range(previous.workers + 1):
+            stage.add_producer()
+
+    threads = [threading.Thread(target=feed_names, args=(stages[0], names, profiles), daemon=True)]
+    for stage, previous in zip(stages[1:], stages):
+        threads.append(threading.Thread(target=feed_saved_items, args=(stage, previous), daemon=True))
+    for stage in stages[:-1]:
+        threads += [threading.Thread(target=stage_worker, args=(stage, identities)) for _ in range(stage.workers)]
+    threads.append(threading.Thread(target=asyncio.run, args=(run_async_stage(stages[-1], identities),)))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for stage in stages:
+        stage.close()
+    # Every stage's thread shared this process's parse pool
+    close_parse_pool()
+    print(f"Pipeline finished in {time.monotonic() - started_at:.0f}s.")
+
+
+if __name__ == '__main__':
+    input_df = stage1.read_input(stage1.file_path)
+    run_pipeline(input_df['name'], stage1.given_profiles(input_df))
+
+    # The flat article table stage 2 reads when it is run on its own
+    expand_articles(stage1.output_filename, 'researcher_profiles_13_typical_v1_expand.csv',
+                    source='csv' if output_format == 'csv' else 'parquet')
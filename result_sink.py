@@ -0,0 +1,244 @@
+import csv
+import os
+import time
+
+import pandas as pd
+
+from instrumentation import count, timed
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+OUTPUT_FORMATS = ['csv', 'parquet', 'both']
+
+
+'''Append-only CSV output: each batch is written once, flushed and fsync'd'''
+class CsvSink:
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        has_header = os.path.exists(path) and os.path.getsize(path) > 0
+
+        if has_header:
+            # Keep appending under the header already on disk so old and new rows line up
+            with open(path, newline='', encoding='utf-8') as f:
+                existing_columns = next(csv.reader(f))
+            missing = [column for column in self.columns if column not in existing_columns]
+            if missing:
+                print(f"{path} was written without columns {missing}; they will be left out.")
+            self.columns = existing_columns
+
+        # Same line ending as pandas' to_csv, so files written by either stay consistent
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.columns, extrasaction='ignore',
+                                     lineterminator=os.linesep)
+        if not has_header:
+            self.writer.writeheader()
+            self.sync()
+
+    def write_rows(self, rows):
+        # Missing values are written as empty cells, like pandas does
+        with timed('write', format='csv'):
+            self.writer.writerows({key: '' if value != value else value for key, value in row.items()}
+                                  for row in rows)
+            self.sync()
+        count('rows_written', len(rows), format='csv')
+
+    def sync(self):
+        # Rows are on disk before the caller marks their items as done
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+'''Typed columnar output: one fixed Parquet schema per stage'''
+def stage_schema(stage):
+    text = pa.string()
+    year_counts = pa.list_(pa.struct([('year', pa.int32()), ('citations', pa.int64())]))
+    schemas = {
+        'researcher_profiles': pa.schema([
+            ('name', text), ('researcher_url', text), ('Researcher ID', text), ('position', text), ('institution_href', text),
+            ('institution', text), ('personal_website', text), ('research_areas', text),
+            ('Total Citations', pa.int64()), ('h-index', pa.int64()), ('i10-index', pa.int64()),
+            ('Annual Citation', year_counts), ('total access articles', pa.int64()),
+            ('Articles', pa.list_(pa.struct([('Title', text), ('Year', pa.int32()), ('URL', text),
+                                             ('Article ID', text), ('Cluster ID', text),
+                                             ('Citations', pa.int64())]))),
+        ]),
+        'paper_details': pa.schema([
+            ('title', text), ('paper url', text), ('Article ID', text), ('Cluster ID', text), ('Authors', text), ('Pubilcation_date', text), ('Book', text),
+            ('Pages', text), ('Description', text), ('Total Citations', pa.int64()), ('Annual Citations', year_counts),
+        ]),
+        'title_search': pa.schema([
+            ('Matched Title', text), ('URL', text), ('Abstract', text), ('Cited Articles URL', text),
+            ('Authors with URLs', pa.list_(pa.struct([('name', text), ('url', text)]))),
+            ('Original Title', text), ('Original URL', text), ('Article ID', text), ('Cluster ID', text),
+            ('Cited By Count', pa.int64()),
+        ]),
+        'cited_articles': pa.schema([
+            ('Original Paper Title', text), ('Original Paper URL', text), ('Original Cited Page URL', text),
+            ('Original Cluster ID', text), ('Cited Article Title', text), ('Cited Article URL', text),
+            ('Next Cited Articles URL', text), ('Cited Article Cluster ID', text), ('Cited Article Cited By Count', pa.int64()),
+        ]),
+    }
+    # Crawled citing papers are stage 4 rows plus how many hops they are from a seed paper
+    schemas['citation_crawl'] = schemas['cited_articles'].append(pa.field('Depth', pa.int32()))
+    return schemas[stage]
+
+
+def to_arrow_value(value, arrow_type):
+    # Scraped values arrive as strings and dicts; turn them into the schema's types
+    if value is None or value != value:
+        return None
+    if pa.types.is_integer(arrow_type):
+        try:
+            return int(str(value).replace(',', '').strip())
+        except ValueError:
+            return None
+    if pa.types.is_string(arrow_type):
+        return str(value)
+    if pa.types.is_list(arrow_type):
+        fields = list(arrow_type.value_type)
+        if isinstance(value, dict):
+            # {'2020': 5} or {'name': 'url'} become [{'year': 2020, 'citations': 5}] or [{'name': .., 'url': ..}]
+            value = [dict(zip([field.name for field in fields], item)) for item in value.items()]
+        return [{field.name: to_arrow_value(item.get(field.name), field.type) for field in fields} for item in value]
+    return value
+
+
+class ParquetSink:
+    def __init__(self, directory, schema):
+        if not HAS_PYARROW:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow)")
+        # Every batch becomes one finished part file, so the directory reads back as one dataset
+        # and nothing marked done can be lost in a file that never got its footer
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.schema = schema
+        self.part_number = 0
+
+    def write_rows(self, rows):
+        with timed('write', format='parquet'):
+            self.write_part(rows)
+        count('rows_written', len(rows), format='parquet')
+
+    def write_part(self, rows):
+        records = [{field.name: to_arrow_value(row.get(field.name), field.type) for field in self.schema}
+                   for row in rows]
+        if not records:
+            return
+        name = f"part-{self.run_id}-{self.part_number:06d}.parquet"
+        path = os.path.join(self.directory, name)
+        # Dot-files are skipped by Parquet dataset readers while being written
+        temp_path = os.path.join(self.directory, f".{name}.tmp")
+        pq.write_table(pa.Table.from_pylist(records, schema=self.schema), temp_path)
+        with open(temp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        self.part_number += 1
+
+    def close(self):
+        pass
+
+
+class MultiSink:
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def write_rows(self, rows):
+        for sink in self.sinks:
+            sink.write_rows(rows)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def parquet_directory(output_filename):
+    # Parquet output goes to a directory named after the CSV file
+    return os.path.splitext(output_filename)[0] + '.parquet'
+
+
+def parquet_parts(directory):
+    # Finished part files in the order they were written; temporary files end in .tmp
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.parquet')]
+
+
+class FilePrefix:
+    # A file read only up to a fixed size, so a row being appended meanwhile is never read half-written
+    def __init__(self, path, size, start=0):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = size - start
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def output_snapshot(output_filename):
+    # What an output holds right now; readers given a snapshot skip anything written after it
+    csv_bytes = os.path.getsize(output_filename) if os.path.exists(output_filename) else 0
+    return {'csv_bytes': csv_bytes, 'parquet_parts': parquet_parts(parquet_directory(output_filename))}
+
+
+def iter_output_chunks(output_filename, columns, output_format='csv', chunksize=10000, snapshot=None, dtype=None,
+                       since=None):
+    # Read back some columns of an earlier output in chunks, from whichever format was written.
+    # Columns an older file lacks come back empty. With since, only rows written after that snapshot
+    snapshot = snapshot or output_snapshot(output_filename)
+    if output_format == 'parquet':
+        read_parts = set(since['parquet_parts']) if since else set()
+        for path in snapshot['parquet_parts']:
+            if path in read_parts:
+                continue
+            parquet_file = pq.ParquetFile(path)
+            present = [column for column in columns if column in parquet_file.schema_arrow.names]
+            for batch in parquet_file.iter_batches(batch_size=chunksize, columns=present):
+                yield batch.to_pandas().reindex(columns=columns)
+    elif snapshot['csv_bytes']:
+        start = since['csv_bytes'] if since else 0
+        if start > snapshot['csv_bytes']:
+            # The file is shorter than when it was last read, so it was rewritten: read it all
+            start = 0
+        if start == snapshot['csv_bytes']:
+            return
+        header = {}
+        if start:
+            # Reading from the middle of the file: take the column names from its header line
+            with open(output_filename, newline='', encoding='utf-8') as f:
+                header = {'header': None, 'names': next(csv.reader(f))}
+        reader = FilePrefix(output_filename, snapshot['csv_bytes'], start)
+        try:
+            for chunk in pd.read_csv(reader, usecols=lambda column: column in columns, chunksize=chunksize,
+                                     dtype=dtype, **header):
+                yield chunk.reindex(columns=columns)
+        finally:
+            reader.close()
+
+
+def open_sink(output_filename, columns, output_format='csv', stage=None):
+    # CSV stays the default
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}, expected one of {OUTPUT_FORMATS}")
+    sinks = []
+    if output_format in ('csv', 'both'):
+        sinks.append(CsvSink(output_filename, columns))
+    if output_format in ('parquet', 'both'):
+        sinks.append(ParquetSink(parquet_directory(output_filename), stage_schema(stage)))
+    return sinks[0] if len(sinks) == 1 else MultiSink(sinks)
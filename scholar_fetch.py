@@ -0,0 +1,513 @@
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import aiohttp
+import requests
+from selenium import webdriver
+
+from instrumentation import count, timed
+from page_cache import normalize_url
+from page_waits import wait_until_ready
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+
+def with_query_params(url, **params):
+    # Return url with the given query parameters added or replaced
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    query.update({key: str(value) for key, value in params.items()})
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+'''Rate control settings'''
+rate_increase = 0.05  # Fraction of the configured rate a host gains after each page that is not blocked
+rate_decrease = 0.5  # A host's rate is multiplied by this after a block
+max_rate_factor = 4  # A host's rate never climbs past this multiple of the configured rate
+min_rate_factor = 0.05  # ... nor drops below this one
+backoff_seconds = 30  # Pause after the first block on a host; it doubles with every block in a row
+max_backoff_seconds = 1800
+max_retries = 3  # A blocked page is retried this many times before its item is handed back
+
+'''Fetch identity settings'''
+# A JSON list of identities, each {"name", "proxy", "user_agent", "browser_profile", "requests_per_second"}
+# with every field optional; without the file all requests go out as one identity, as before
+identities_file = 'identities.json'
+health_smoothing = 0.1  # Weight of the latest response in an identity's health score
+min_health = 0.05  # Floor for the health score when weighing identities against each other
+
+
+'''Block, CAPTCHA and rate-limit detection'''
+# Responses that mean the host wants us to slow down
+BLOCK_STATUSES = {429, 503}
+# Elements only a CAPTCHA or "sorry" page has. They are matched inside tags and never in the page's
+# text, so a result titled "Detecting unusual traffic ..." is still a normal page
+BLOCK_ELEMENTS = re.compile(
+    r'<[^>]*\bid=["\']?(?:gs_captcha_ccl|gs_captcha_f|captcha-form|recaptcha)["\'\s>]'
+    r'|<[^>]*\bclass=["\'][^"\']*\bg-recaptcha\b'
+    r'|<form[^>]*\baction=["\'][^"\']*/sorry/', re.IGNORECASE)
+
+
+def has_block_elements(html):
+    # Most pages mention neither word, and the plain substring test is far cheaper than the pattern
+    return ('captcha' in html or 'sorry' in html) and BLOCK_ELEMENTS.search(html) is not None
+
+
+class BlockedError(Exception):
+    # Raised instead of returning a block page, so no caller parses it as an empty result
+    def __init__(self, url, reason):
+        super().__init__(f"Blocked on {url}: {reason}")
+        self.url = url
+        self.reason = reason
+
+
+def block_reason(status, html, url):
+    # Why a response is a block, or None when it is a normal page
+    if status in BLOCK_STATUSES:
+        return f"status {status}"
+    if urlsplit(str(url)).path.startswith('/sorry'):
+        return "redirected to the sorry page"
+    if has_block_elements(html or ''):
+        return "CAPTCHA page"
+    return None
+
+
+def retry_after(headers):
+    # Seconds asked for in a Retry-After header, if it gives a number
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+'''Per-host rate control: the politeness scheduler every fetch path goes through'''
+class HostState:
+    def __init__(self, rate, now):
+        self.rate = rate
+        self.next_token = now  # When the host's token bucket next has a token, the GCRA form of the bucket
+        self.blocked_until = now
+        self.last_block = None
+        self.blocks_in_row = 0
+        self.shared_block = None  # Wall-clock time of the last block taken over from other processes
+
+
+class HostRateLimiter:
+    # A token bucket per host whose rate adapts: additive increase while pages come back,
+    # multiplicative decrease and an exponential pause when the host blocks us
+    # With shared (see shared_block_state), blocks are also seen by the other processes sending as the same identity
+    def __init__(self, requests_per_second=0.5, jitter=0.25, burst=1, label=None, shared=None):
+        self.rate = requests_per_second
+        self.label = label
+        self.jitter = jitter
+        self.burst = burst
+        self.shared = shared
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def state(self, url, now):
+        host = urlsplit(url).netloc
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(self.rate, now)
+        if self.shared is not None:
+            self.pull(host, state, now)
+        return state
+
+    def pull(self, host, state, now):
+        # Take over a block another process recorded: its pause, and its rate cut in proportion to our rate
+        entry = self.shared[0].get((self.label, host))
+        if entry is None or entry[3] == state.shared_block:
+            return
+        paused_until, rate_factor, blocks_in_row, last_block = entry
+        offset = now - time.time()
+        state.shared_block = last_block
+        state.last_block = last_block + offset if state.last_block is None else max(state.last_block, last_block + offset)
+        state.blocked_until = max(state.blocked_until, paused_until + offset)
+        state.next_token = max(state.next_token, state.blocked_until)
+        state.rate = min(state.rate, self.rate * rate_factor)
+        state.blocks_in_row = max(state.blocks_in_row, blocks_in_row)
+
+    def push(self, host, state, now):
+        offset = time.time() - now
+        state.shared_block = state.last_block + offset
+        self.shared[0][(self.label, host)] = (state.blocked_until + offset, state.rate / self.rate, state.blocks_in_row,
+                                              state.shared_block)
+
+    def reserve(self, url):
+        # Take the host's next token and return how long to wait for it
+        with self.lock:
+            now = time.monotonic()
+            state = self.state(url, now)
+            interval = random.uniform(1 - self.jitter, 1 + self.jitter) / state.rate
+            due = max(state.next_token, now, state.blocked_until)
+            state.next_token = due + interval
+            # A bucket of burst tokens lets that many requests go ahead of their due time
+            start = max(due - (self.burst - 1) / state.rate, now, state.blocked_until)
+            return start - now
+
+    def blocked_since(self, url, moment):
+        with self.lock:
+            last_block = self.state(url, time.monotonic()).last_block
+            return last_block is not None and last_block > moment
+
+    def record_success(self, url):
+        with self.lock:
+            state = self.state(url, time.monotonic())
+            state.blocks_in_row = 0
+            state.rate = min(state.rate + self.rate * rate_increase, self.rate * max_rate_factor)
+
+    def record_block(self, url, sent_at, reason, wait=None):
+        # The shared lock keeps two processes blocked at once from both halving the rate
+        with self.lock, (self.shared[1] if self.shared is not None else contextlib.nullcontext()):
+            now = time.monotonic()
+            state = self.state(url, now)
+            # Requests already sent when the last block came in tell us nothing new
+            if state.last_block is not None and sent_at < state.last_block:
+                return
+            state.last_block = now
+            state.blocks_in_row += 1
+            state.rate = max(state.rate * rate_decrease, self.rate * min_rate_factor)
+            pause = min(backoff_seconds * 2 ** (state.blocks_in_row - 1), max_backoff_seconds)
+            pause = max(pause, wait or 0) * random.uniform(1, 1 + self.jitter)
+            state.blocked_until = max(state.blocked_until, now + pause)
+            state.next_token = max(state.next_token, state.blocked_until)
+            if self.shared is not None:
+                self.push(urlsplit(url).netloc, state, now)
+        print(f"Blocked by {urlsplit(url).netloc}{f' as {self.label}' if self.label else ''} ({reason}). Pausing {pause:.0f}s, "
+              f"then {state.rate:.2f} requests per second.")
+
+    def next_delay(self, url):
+        # How long a request reserved now would wait, without reserving it
+        with self.lock:
+            now = time.monotonic()
+            state = self.state(url, now)
+            due = max(state.next_token, now, state.blocked_until)
+            return max(due - (self.burst - 1) / state.rate, now, state.blocked_until) - now
+
+    async def wait(self, url, delay=None):
+        reserved_at = time.monotonic()
+        delay = self.reserve(url) if delay is None else delay
+        while delay > 0:
+            await asyncio.sleep(delay)
+            # A block recorded while waiting voids the slot; take a new one behind the pause, at the lower rate
+            if not self.blocked_since(url, reserved_at):
+                break
+            reserved_at = time.monotonic()
+            delay = self.reserve(url)
+
+    def wait_blocking(self, url, delay=None):
+        reserved_at = time.monotonic()
+        delay = self.reserve(url) if delay is None else delay
+        while delay > 0:
+            time.sleep(delay)
+            if not self.blocked_since(url, reserved_at):
+                break
+            reserved_at = time.monotonic()
+            delay = self.reserve(url)
+
+
+'''Fetch identities: proxy, cookie jar, user agent and browser profile, each with its own rate budget'''
+class Identity:
+    def __init__(self, name='default', proxy=None, user_agent=None, browser_profile=None, requests_per_second=0.5,
+                 rate_limiter=None, headers=None):
+        self.name = name
+        self.proxy = proxy
+        self.user_agent = user_agent
+        self.headers = dict(headers or HEADERS)
+        if user_agent:
+            self.headers['User-Agent'] = user_agent
+        self.browser_profile = browser_profile
+        self.rate_limiter = rate_limiter or HostRateLimiter(requests_per_second, label=name)
+        # 1 while every page comes back, falling towards 0 as blocks come in
+        self.health = 1.0
+        self.lock = threading.Lock()
+
+    def record_success(self, url):
+        self.rate_limiter.record_success(url)
+        self.update_health(1.0)
+
+    def record_block(self, url, sent_at, reason, wait=None):
+        self.rate_limiter.record_block(url, sent_at, reason, wait)
+        self.update_health(0.0)
+
+    def update_health(self, outcome):
+        with self.lock:
+            self.health += health_smoothing * (outcome - self.health)
+
+
+class IdentityPool:
+    def __init__(self, identities):
+        self.identities = identities
+        self.lock = threading.Lock()
+
+    def reserve(self, url):
+        # Route to the identity that can send soonest, with its wait stretched by poor health;
+        # paused identities wait out their pause, so they are passed over while others are free
+        with self.lock:
+            identity = min(self.identities, key=lambda identity: (identity.rate_limiter.next_delay(url) + 0.001)
+                           / max(identity.health, min_health))
+            return identity, identity.rate_limiter.reserve(url)
+
+    def partition(self, index, workers):
+        # The identities worker index of workers uses, so each identity's budget is spent once across processes;
+        # with fewer identities than workers, the workers sharing one identity split its rate, and its blocks
+        # reach all of them through the shared block state
+        if len(self.identities) >= workers:
+            return IdentityPool(self.identities[index::workers])
+        identity = self.identities[index % len(self.identities)]
+        sharing = len(range(index % len(self.identities), workers, len(self.identities)))
+        rate_limiter = HostRateLimiter(identity.rate_limiter.rate / sharing, label=identity.rate_limiter.label,
+                                       shared=identity.rate_limiter.shared)
+        return IdentityPool([Identity(identity.name, identity.proxy, identity.user_agent, identity.browser_profile,
+                                      rate_limiter=rate_limiter, headers=identity.headers)])
+
+
+def shared_block_state(manager):
+    # Block state for limiters in several processes: {(identity, host): (paused until, rate factor,
+    # blocks in a row, last block)}, times by the wall clock, and the lock that orders updates to it
+    return manager.dict(), manager.Lock()
+
+
+def load_identities(requests_per_second=0.5, rate_limiter=None, headers=None, path=None, shared=None):
+    # The pool from identities_file, or the single identity every request used before
+    path = path or identities_file
+    if not os.path.exists(path):
+        return IdentityPool([Identity(rate_limiter=rate_limiter or HostRateLimiter(requests_per_second, shared=shared),
+                                      headers=headers)])
+    with open(path, encoding='utf-8') as file:
+        entries = json.load(file)
+    identities = []
+    for number, entry in enumerate(entries):
+        name = entry.get('name', f"identity-{number}")
+        identities.append(Identity(name, entry.get('proxy'), entry.get('user_agent'), entry.get('browser_profile'),
+                                   rate_limiter=HostRateLimiter(entry.get('requests_per_second', requests_per_second),
+                                                                label=name, shared=shared),
+                                   headers=headers))
+    return IdentityPool(identities)
+
+
+'''Pooled keep-alive HTTP client'''
+class AsyncFetcher:
+    def __init__(self, concurrency=8, requests_per_second=0.5, headers=None, timeout=30, cache=None,
+                 rate_limiter=None, identities=None):
+        self.concurrency = concurrency
+        self.cache = cache
+        self.timeout = timeout
+        # Fetchers that hit the same hosts can share one limiter or identity pool, and so one budget
+        self.identities = identities or load_identities(requests_per_second, rate_limiter, headers)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.sessions = {}
+        # Downloads under way, by normalised URL, so a page asked for twice at once is fetched once
+        self.in_flight = {}
+
+    async def __aenter__(self):
+        # One connection pool and cookie jar per identity for the whole run, so connections are reused
+        for identity in self.identities.identities:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+            self.sessions[identity.name] = aiohttp.ClientSession(
+                connector=connector,
+                headers=identity.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for session in self.sessions.values():
+            await session.close()
+
+    async def fetch(self, url):
+        # Pages already on disk never touch the network or the rate budget
+        if self.cache is not None:
+            html = self.cache.get(url)
+            if html is not None:
+                count('pages', source='cache')
+                return html
+
+        key = normalize_url(url)
+        download = self.in_flight.get(key)
+        if download is None:
+            download = asyncio.ensure_future(self.download(url))
+            self.in_flight[key] = download
+            download.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # One caller giving up does not cancel the download for the others
+        return await asyncio.shield(download)
+
+    async def download(self, url):
+        for attempt in range(max_retries + 1):
+            async with self.semaphore:
+                identity, delay = self.identities.reserve(url)
+                with timed('wait'):
+                    await identity.rate_limiter.wait(url, delay)
+                sent_at = time.monotonic()
+                with timed('fetch'):
+                    async with self.sessions[identity.name].get(url, proxy=identity.proxy) as response:
+                        html = await response.text()
+                        status, final_url, headers = response.status, response.url, response.headers
+                        reason = block_reason(status, html, final_url)
+                        # An error page that is not a block is not a page: it raises, and counts as no success
+                        if reason is None:
+                            response.raise_for_status()
+                if reason is None:
+                    count('pages', source='network')
+                    identity.record_success(url)
+                    if self.cache is not None and status == 200:
+                        self.cache.put(url, html)
+                    return html
+                count('blocks')
+                identity.record_block(url, sent_at, reason, retry_after(headers))
+            # The next attempt goes to the identity free soonest, which is not the paused one
+            if attempt < max_retries:
+                print(f"Retrying {url} after a block ({attempt + 1} of {max_retries}).")
+        raise BlockedError(url, reason)
+
+
+'''HTTP-first page fetching with Selenium as fallback'''
+# The form of a consent interstitial, which posts back to consent.google.*
+CONSENT_ELEMENTS = re.compile(r'<form[^>]*\baction=["\']https?://consent\.google\.', re.IGNORECASE)
+
+
+def looks_like_browser_only_page(html, url, expected_marker=None):
+    if 'consent.google.' in urlsplit(str(url)).netloc:
+        return True
+    if has_block_elements(html) or ('consent.google.' in html and CONSENT_ELEMENTS.search(html)):
+        return True
+    # A static page that lacks the element we came for was most likely not rendered, or needs JavaScript
+    return expected_marker is not None and expected_marker not in html
+
+
+def new_chrome_driver(headless=False, proxy=None, user_agent=None, browser_profile=None):
+    options = webdriver.ChromeOptions()
+    options.page_load_strategy = 'normal'
+    if headless:
+        options.add_argument('--headless=new')
+    # A fetch identity's proxy, user agent and profile directory (which keeps its cookies)
+    if proxy:
+        options.add_argument(f'--proxy-server={proxy}')
+    if user_agent:
+        options.add_argument(f'--user-agent={user_agent}')
+    if browser_profile:
+        options.add_argument(f'--user-data-dir={os.path.abspath(browser_profile)}')
+    return webdriver.Chrome(options=options)
+
+
+class HttpFirstFetcher:
+    def __init__(self, driver_factory=new_chrome_driver, requests_per_second=0.5, headers=None, timeout=30,
+                 cache=None, browser_timeout=10, rate_limiter=None, identities=None):
+        self.identities = identities or load_identities(requests_per_second, rate_limiter, headers)
+        # One session per identity keeps its cookies between pages, like a browser would
+        self.sessions = {}
+        for identity in self.identities.identities:
+            session = self.sessions[identity.name] = requests.Session()
+            session.headers.update(identity.headers)
+            if identity.proxy:
+                session.proxies.update({'http': identity.proxy, 'https': identity.proxy})
+        self.timeout = timeout
+        self.driver_factory = driver_factory
+        self.drivers = {}
+        self.cache = cache
+        self.browser_timeout = browser_timeout
+
+    def get_html(self, url, expected_marker=None):
+        # Pages already on disk never touch the network or the rate budget
+        if self.cache is not None:
+            html = self.cache.get(url)
+            if html is not None:
+                # A copy cached before pages were checked may be a consent page or half loaded
+                if not looks_like_browser_only_page(html, url, expected_marker):
+                    count('pages', source='cache')
+                    return html
+                print(f"The cached copy of {url} is not a usable page. Fetching it again.")
+
+        html, complete = self.fetch_page(url, expected_marker)
+        # Only complete pages are cached, so a page the browser timed out on is fetched again next time
+        if self.cache is not None and complete:
+            self.cache.put(url, html)
+        return html
+
+    def fetch_page(self, url, expected_marker=None):
+        # The page, and whether it is complete: the element we came for is there and no wait timed out
+        for attempt in range(max_retries + 1):
+            identity, delay = self.identities.reserve(url)
+            with timed('wait'):
+                identity.rate_limiter.wait_blocking(url, delay)
+            sent_at = time.monotonic()
+            try:
+                with timed('fetch'):
+                    response = self.sessions[identity.name].get(url, timeout=self.timeout)
+                    html = response.text
+            except requests.RequestException as e:
+                print(f"HTTP request failed for {url}: {e}. Falling back to Selenium.")
+                break
+            reason = block_reason(response.status_code, html, response.url)
+            if reason is None:
+                identity.record_success(url)
+                if response.ok and not looks_like_browser_only_page(html, response.url, expected_marker):
+                    count('pages', source='network')
+                    return html, True
+                print(f"Plain HTTP is not enough for {url} (status {response.status_code}). Falling back to Selenium.")
+                break
+            count('blocks')
+            identity.record_block(url, sent_at, reason, retry_after(response.headers))
+            # A CAPTCHA may clear in a real browser; a rate limit only clears with time
+            if response.status_code not in BLOCK_STATUSES:
+                break
+            if attempt < max_retries:
+                print(f"Retrying {url} after a block ({attempt + 1} of {max_retries}).")
+        else:
+            raise BlockedError(url, reason)
+        # The browser takes the page over as the same identity, so cookies and proxy stay together
+        return self.browse(url, identity, expected_marker)
+
+    def browse(self, url, identity=None, expected_marker=None):
+        if self.driver_factory is None:
+            raise RuntimeError(f"{url} needs a browser but no Selenium driver is configured")
+        if identity is None:
+            identity, delay = self.identities.reserve(url)
+        else:
+            delay = None
+        # Only start Chrome once a page actually needs it; each identity gets its own
+        driver = self.drivers.get(identity.name)
+        if driver is None:
+            options = {key: value for key, value in [('proxy', identity.proxy), ('user_agent', identity.user_agent),
+                                                     ('browser_profile', identity.browser_profile)] if value}
+            driver = self.drivers[identity.name] = self.driver_factory(**options)
+
+        # Pacing comes from the rate limiter; the wait itself ends as soon as the page is usable
+        with timed('wait'):
+            identity.rate_limiter.wait_blocking(url, delay)
+        sent_at = time.monotonic()
+        with timed('browser'):
+            driver.get(url)
+            ready = wait_until_ready(driver, url, self.browser_timeout)
+        with timed('page_source'):
+            html = driver.page_source
+        reason = block_reason(None, html, driver.current_url)
+        if reason is not None:
+            count('blocks')
+            identity.record_block(url, sent_at, reason)
+            raise BlockedError(url, reason)
+        identity.record_success(url)
+        count('pages', source='browser')
+
+        # Hand the browser cookies (consent, CAPTCHA clearance) back to the identity's HTTP session
+        for cookie in driver.get_cookies():
+            self.sessions[identity.name].cookies.set(cookie['name'], cookie['value'],
+                                                     domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        return html, ready and not looks_like_browser_only_page(html, driver.current_url, expected_marker)
+
+    def close(self):
+        # The page cache belongs to the caller, who may share it, so it is left open
+        for session in self.sessions.values():
+            session.close()
+        for driver in self.drivers.values():
+            driver.quit()
+        self.drivers = {}
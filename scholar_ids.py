@@ -0,0 +1,48 @@
+from html import unescape
+from urllib.parse import parse_qs, urlsplit
+
+# Read ID columns back as text; pandas would turn numeric cluster ids into floats
+ID_DTYPES = {
+    'Researcher ID': str,
+    'Article ID': str,
+    'Cluster ID': str,
+    'Original Cluster ID': str,
+    'Cited Article Cluster ID': str,
+}
+
+
+def query_value(url, name):
+    # Works on full URLs and on hrefs as scraped: relative, with &amp; entities
+    if not isinstance(url, str) or not url:
+        return None
+    values = parse_qs(urlsplit(unescape(url)).query).get(name)
+    return values[0] if values else None
+
+
+'''Stable Scholar IDs'''
+def researcher_id(url):
+    # citations?user=XXXXXXXXXXXX: one per profile
+    return query_value(url, 'user')
+
+
+def article_id(url):
+    # citation_for_view=USER:KEY: one article in one profile; co-authors each have their own
+    return query_value(url, 'citation_for_view')
+
+
+def cluster_id(url):
+    # scholar?cites=NNNN: the paper's cluster, the same from every profile and search page that lists it
+    return query_value(url, 'cites')
+
+
+def has_value(value):
+    return isinstance(value, str) and value != ''
+
+
+def paper_key(title, cluster=None, article=None):
+    # One key per paper: the cluster if known, then the profile article, then the title as before
+    if has_value(cluster):
+        return f"cites:{cluster}"
+    if has_value(article):
+        return f"citation_for_view:{article}"
+    return title
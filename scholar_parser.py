@@ -0,0 +1,167 @@
+import os
+import re
+
+from bs4 import BeautifulSoup
+
+from instrumentation import timed
+
+try:
+    import lxml.html
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+# Supported parser backends, fastest first
+PARSER_BACKENDS = ['lxml', 'html.parser']
+
+# lxml builds and searches the tree in C; html.parser is BeautifulSoup's pure-Python fallback
+default_backend = 'lxml' if HAS_LXML else 'html.parser'
+parser_backend = os.environ.get('SCHOLAR_HTML_PARSER', default_backend)
+
+# BeautifulSoup leaves the text of these tags out of get_text()
+NON_TEXT_TAGS = {'script', 'style', 'template'}
+
+
+def set_parser_backend(backend):
+    global parser_backend
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend {backend!r}, expected one of {PARSER_BACKENDS}")
+    parser_backend = backend
+
+
+'''Parse a fetched page with the configured backend'''
+def parse_html(html, backend=None):
+    backend = backend or parser_backend
+    with timed('parse'):
+        if backend == 'lxml':
+            if not html.strip():
+                html = '<html></html>'
+            return LxmlTag(lxml.html.document_fromstring(html))
+        return BeautifulSoup(html, backend)
+
+
+def cited_by_count(cited_by_tag):
+    # N from a "Cited by N" (or "被引用次数：N") link
+    digits = re.sub(r'\D', '', cited_by_tag.get_text()) if cited_by_tag else ''
+    return int(digits) if digits else None
+
+
+'''The subset of the BeautifulSoup Tag API the extraction functions use, over lxml elements'''
+def attribute_matches(value, wanted):
+    # Like BeautifulSoup: a wanted value matches one of the space-separated
+    # values (class, rel) or the whole attribute string
+    if value is None:
+        return False
+    values = value.split()
+    for option in (wanted if isinstance(wanted, (list, tuple, set)) else [wanted]):
+        if option in values or option == ' '.join(values):
+            return True
+    return False
+
+
+def element_string(element):
+    # BeautifulSoup's .string: the text of a tag whose only content is one string
+    children = list(element)
+    if not children:
+        return element.text
+    if element.text or len(children) != 1 or children[0].tail or not isinstance(children[0].tag, str):
+        return None
+    return element_string(children[0])
+
+
+def iter_element_text(element):
+    if element.text:
+        yield element.text
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in NON_TEXT_TAGS:
+            yield from iter_element_text(child)
+        if child.tail:
+            yield child.tail
+
+
+class LxmlTag:
+    __slots__ = ('element',)
+
+    def __init__(self, element):
+        self.element = element
+
+    def __bool__(self):
+        return True
+
+    def __getitem__(self, key):
+        value = self.element.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __str__(self):
+        return lxml.html.tostring(self.element, encoding='unicode')
+
+    @property
+    def name(self):
+        return self.element.tag
+
+    @property
+    def text(self):
+        return self.get_text()
+
+    @property
+    def string(self):
+        return element_string(self.element)
+
+    def get(self, key, default=None):
+        return self.element.get(key, default)
+
+    def has_attr(self, key):
+        return key in self.element.attrib
+
+    def get_text(self, separator='', strip=False):
+        pieces = iter_element_text(self.element)
+        if strip:
+            pieces = [piece.strip() for piece in pieces]
+            pieces = [piece for piece in pieces if piece]
+        return separator.join(pieces)
+
+    def matches(self, element, class_, string, attrs):
+        if class_ is not None and not attribute_matches(element.get('class'), class_):
+            return False
+        for key, wanted in attrs.items():
+            if not attribute_matches(element.get(key), wanted):
+                return False
+        if string is not None:
+            value = element_string(element)
+            return string(value) if callable(string) else value == string
+        return True
+
+    def filter(self, elements, name, class_, string, attrs, limit=None):
+        found = []
+        for element in elements:
+            if not isinstance(element.tag, str) or (name is not None and element.tag != name):
+                continue
+            if self.matches(element, class_, string, attrs):
+                found.append(LxmlTag(element))
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def find_all(self, name=None, class_=None, string=None, text=None, limit=None, **attrs):
+        # iterdescendants walks the tree in C; only candidates with the right tag reach Python
+        elements = self.element.iterdescendants(name) if name else self.element.iterdescendants()
+        return self.filter(elements, None, class_, string if string is not None else text, attrs, limit)
+
+    def find(self, name=None, class_=None, string=None, text=None, **attrs):
+        found = self.find_all(name, class_, string, text, limit=1, **attrs)
+        return found[0] if found else None
+
+    def find_next_sibling(self, name=None, class_=None, **attrs):
+        found = self.filter(self.element.itersiblings(), name, class_, None, attrs, limit=1)
+        return found[0] if found else None
+
+    def find_next(self, name=None, class_=None, **attrs):
+        # Everything after this tag in document order: its descendants first, then what follows it
+        found = self.find_all(name, class_, limit=1, **attrs)
+        if found:
+            return found[0]
+        following = self.element.xpath(f'following::{name or "*"}')
+        found = self.filter(following, name, class_, None, attrs, limit=1)
+        return found[0] if found else None
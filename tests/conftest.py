@@ -0,0 +1,46 @@
+import os
+import sys
+
+import aiohttp
+import pytest
+import requests
+
+# The scripts are top-level modules, and the stand-in server lives with the benchmarks
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+
+from scholar_server import base_url, start_server, stop_server  # noqa: E402
+
+stand_in_port = 8796
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'stand_in(**settings): settings for the local Scholar stand-in server')
+
+
+@pytest.fixture
+def scholar(request):
+    # The stand-in server's base URL, paging or slowing down as the test's stand_in marker asks
+    marker = request.node.get_closest_marker('stand_in')
+    server = start_server(stand_in_port, **{'latency': 0.005, **(marker.kwargs if marker else {})})
+    yield base_url(stand_in_port)
+    stop_server(server)
+
+
+@pytest.fixture
+def scholar_host(scholar, monkeypatch):
+    # Sends the scholar.google.com URLs the scripts build to the stand-in server instead
+    def to_stand_in(url):
+        return str(url).replace('https://scholar.google.com', scholar, 1)
+
+    send = requests.Session.request
+    monkeypatch.setattr(requests.Session, 'request',
+                        lambda self, method, url, *args, **kwargs: send(self, method, to_stand_in(url), *args, **kwargs))
+    request = aiohttp.ClientSession._request
+
+    async def request_stand_in(self, method, url, *args, **kwargs):
+        return await request(self, method, to_stand_in(url), *args, **kwargs)
+
+    monkeypatch.setattr(aiohttp.ClientSession, '_request', request_stand_in)
+    yield scholar
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from article_table import expand_articles
+from result_sink import open_sink, stage_schema
+
+profile_columns = stage_schema('researcher_profiles').names
+
+
+def profile(user, article_count):
+    articles = [{'Title': f'Paper {i} of {user}', 'Year': str(2000 + i), 'URL': f'https://scholar.google.com/x?u={user}&i={i}',
+                 'Article ID': f'{user}:{i:012d}', 'Cluster ID': str(1000000 + i) if i % 2 else None,
+                 'Citations': i * 3 if i % 2 else None} for i in range(article_count)]
+    return {'name': f'Researcher {user}', 'researcher_url': f'https://scholar.google.com/citations?user={user}',
+            'Researcher ID': user, 'Total Citations': '1200', 'h-index': '12',
+            'Annual Citation': {'2021': '4', '2022': '9'}, 'Articles': articles}
+
+
+@pytest.fixture
+def profiles_csv(tmp_path):
+    # Both formats, written in two batches, with a researcher who has no articles in between
+    path = str(tmp_path / 'researcher_profiles.csv')
+    sink = open_sink(path, profile_columns, 'both', 'researcher_profiles')
+    sink.write_rows([profile('AAAAAAAAAAAA', 3), profile('BBBBBBBBBBBB', 0)])
+    sink.write_rows([profile('CCCCCCCCCCCC', 5)])
+    sink.close()
+    return path
+
+
+def expanded(profiles_csv, tmp_path, source, chunksize):
+    expand_csv = str(tmp_path / f'expand_{source}_{chunksize}.csv')
+    written = expand_articles(profiles_csv, expand_csv, source=source, chunksize=chunksize)
+    flat = pd.read_csv(expand_csv, dtype=str)
+    assert written == len(flat)
+    return flat
+
+
+def explode_baseline(profiles_csv):
+    # What stage 1 did before expanding in chunks: explode the whole table, then spread each article's fields
+    df = pd.read_csv(profiles_csv, dtype=str)
+    df['Articles'] = df['Articles'].apply(eval)
+    df = df.explode('Articles').reset_index(drop=True)
+    articles = pd.json_normalize(df['Articles'].apply(lambda article: article if isinstance(article, dict) else {}))
+    return pd.concat([df.drop(columns=['Articles']), articles], axis=1)
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 100])
+def test_csv_expansion_matches_explode_whatever_the_chunk_size(profiles_csv, tmp_path, chunksize):
+    flat = expanded(profiles_csv, tmp_path, 'csv', chunksize)
+    baseline = explode_baseline(profiles_csv).astype(object).where(lambda df: df.notna(), None)
+    assert len(flat) == 9
+    assert list(flat['Researcher ID']) == ['AAAAAAAAAAAA'] * 3 + ['BBBBBBBBBBBB'] + ['CCCCCCCCCCCC'] * 5
+    for column in ['Researcher ID', 'Title', 'Article ID', 'Cluster ID']:
+        assert list(flat[column].astype(object).where(flat[column].notna(), None)) == list(baseline[column])
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 100])
+def test_arrow_expansion_writes_the_same_table_as_the_csv_path(profiles_csv, tmp_path, chunksize):
+    from_csv = expanded(profiles_csv, tmp_path, 'csv', 100)
+    from_parquet = expanded(profiles_csv, tmp_path, 'parquet', chunksize)
+    assert list(from_parquet.columns) == list(from_csv.columns)
+    pd.testing.assert_frame_equal(from_parquet, from_csv)
+    # The researcher without articles keeps one row with empty article columns
+    empty = from_parquet[from_parquet['Researcher ID'] == 'BBBBBBBBBBBB']
+    assert len(empty) == 1 and empty[['Title', 'Article ID', 'Citations']].isna().all(axis=None)
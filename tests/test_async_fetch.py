@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+import scholar_fetch
+from conftest import stand_in_port as port
+from scholar_fetch import AsyncFetcher
+from scholar_server import request_log, stats
+
+
+def fetch_all(urls, **fetcher_settings):
+    async def run():
+        async with AsyncFetcher(**fetcher_settings) as fetcher:
+            return await asyncio.gather(*(fetcher.fetch(url) for url in urls))
+    return asyncio.run(run())
+
+
+def cited_by_urls(url, count):
+    return [f"{url}/scholar?cites={1000 + i}&hl=en" for i in range(count)]
+
+
+@pytest.mark.stand_in(latency=0.05, latency_jitter=0)
+def test_concurrency_cap_is_respected(scholar):
+    pages = fetch_all(cited_by_urls(scholar, 20), concurrency=3, requests_per_second=1000)
+    assert all('gs_res_ccl' in page for page in pages)
+    log = request_log(port)
+    assert len(log['requests']) == 20
+    # Pages overlap, but never more than the cap
+    assert 2 <= log['max_in_flight'] <= 3
+
+
+@pytest.mark.stand_in(latency=0.05, latency_jitter=0)
+def test_connections_are_kept_alive_and_reused(scholar):
+    fetch_all(cited_by_urls(scholar, 20), concurrency=3, requests_per_second=1000)
+    assert stats(port)['pages'] == 20
+    # One pooled session: 20 pages over no more connections than pages in flight
+    assert request_log(port)['connections'] <= 3
+
+
+@pytest.mark.stand_in()
+def test_rate_budget_is_respected(scholar, monkeypatch):
+    # Without the additive increase after each page, the configured rate is the ceiling
+    monkeypatch.setattr(scholar_fetch, 'rate_increase', 0)
+    rate = 20
+    start = time.monotonic()
+    fetch_all(cited_by_urls(scholar, 31), concurrency=8, requests_per_second=rate)
+    elapsed = time.monotonic() - start
+    times = sorted(at for at, _ in request_log(port)['requests'])
+    assert len(times) == 31
+    # 30 intervals of 1/rate, each stretched or shrunk by at most the limiter's jitter of 25%
+    assert elapsed > 30 / rate * 0.75
+    assert all(later - earlier > 10 / rate * 0.75 for earlier, later in zip(times, times[10:]))
+
+
+@pytest.mark.stand_in()
+def test_rate_budget_is_per_host(scholar, monkeypatch):
+    monkeypatch.setattr(scholar_fetch, 'rate_increase', 0)
+    # 127.0.0.1 and localhost are separate hosts to the limiter, so each gets the full budget
+    urls = [f"{scholar}/scholar?cites=1&start={i}" for i in range(0, 80, 10)]
+    urls += [url.replace('127.0.0.1', 'localhost') for url in urls]
+    start = time.monotonic()
+    fetch_all(urls, concurrency=8, requests_per_second=5)
+    # Eight pages per host at 5/s take about 1.4 s; one shared budget would take at least 2.25 s
+    assert time.monotonic() - start < 2
+    assert stats(port)['pages'] == 16
+
+
+@pytest.mark.stand_in()
+def test_error_page_raises_and_is_not_a_success(scholar, monkeypatch):
+    successes = []
+    monkeypatch.setattr(scholar_fetch.Identity, 'record_success', lambda identity, url: successes.append(url))
+    # The stand-in answers 404 for paths it does not serve
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        fetch_all([f"{scholar}/no-such-page"], requests_per_second=1000)
+    assert error.value.status == 404
+    assert successes == []
+
+
+@pytest.mark.stand_in(latency=0.05)
+def test_a_page_asked_for_twice_at_once_is_fetched_once(scholar):
+    url = f"{scholar}/scholar?q=same+paper"
+    first, second = fetch_all([url, url], concurrency=4, requests_per_second=1000)
+    assert first == second
+    assert stats(port)['pages'] == 1
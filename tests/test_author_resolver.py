@@ -0,0 +1,48 @@
+import pytest
+
+import author_resolver
+from author_resolver import AuthorCache, resolve_authors
+from conftest import stand_in_port as port
+from scholar_server import request_log
+
+
+def age(cache, name, seconds):
+    # Makes a cache entry look as if it was written some seconds earlier
+    cache.db.execute('UPDATE authors SET updated_at = updated_at - ? WHERE name = ?', (seconds, name))
+    cache.db.commit()
+
+
+def test_a_name_that_found_nobody_is_searched_again_after_the_negative_ttl(tmp_path):
+    cache = AuthorCache(str(tmp_path / 'authors.sqlite3'), negative_ttl=3600)
+    try:
+        cache.put('Nobody Example', None)
+        cache.put('Ada Example', 'https://scholar.google.com/citations?hl=en&user=AAAAAAAAAAAA')
+        assert cache.lookup('nobody  example') == (True, None)
+        age(cache, 'Nobody Example', 3601)
+        age(cache, 'Ada Example', 10 * 3600)
+        assert cache.lookup('Nobody Example') == (False, None)
+        # A found profile does not expire
+        assert cache.lookup('Ada Example') == (True, 'https://scholar.google.com/citations?hl=en&user=AAAAAAAAAAAA')
+    finally:
+        cache.close()
+
+
+def author_searches():
+    return [path for _, path in request_log(port)['requests'] if 'search_authors' in path]
+
+
+@pytest.mark.stand_in()
+def test_each_name_is_searched_once_and_then_answered_from_the_cache(scholar_host, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(author_resolver, 'requests_per_second', 1000)
+    names = ['Ada Example', 'ada  example', 'Bob Example', 'Carol Example']
+    given = [None, None, None, 'CCCCCCCCCCCC']
+    urls = resolve_authors(names, given)
+    assert urls[0] == urls[1] and urls[0].startswith(author_resolver.profile_url_prefix)
+    assert urls[2] != urls[0]
+    assert urls[3] == author_resolver.profile_url('CCCCCCCCCCCC')
+    # Two spellings of one name share a search, and a given profile needs none
+    assert len(author_searches()) == 2
+
+    assert resolve_authors(names) == urls
+    assert len(author_searches()) == 2
@@ -0,0 +1,70 @@
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+import bench_suite
+from bench_parse import SCENARIOS
+from conftest import stand_in_port as port
+from make_fixtures import cited_by_page, fixture_directory, profile_page
+from scholar_parser import parse_html
+from scholar_server import stats
+
+
+def fixture(name):
+    with open(os.path.join(fixture_directory, name), encoding='utf-8') as f:
+        return f.read()
+
+
+# The saved fixture pages, plus a profile without articles and a short last cited-by page
+PAGES = {
+    **{name: lambda name=name: fixture(name) for name in SCENARIOS},
+    'empty_profile': lambda: profile_page(article_count=0),
+    'last_cited_by': lambda: cited_by_page(180, 187),
+}
+PAGE_SCENARIOS = {'empty_profile': 'profile.html', 'last_cited_by': 'cited_by.html'}
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_lxml_gives_the_same_answer_as_beautifulsoup(page):
+    html = PAGES[page]()
+    extract = SCENARIOS[PAGE_SCENARIOS.get(page, page)]
+    assert extract(parse_html(html, 'lxml')) == extract(parse_html(html, 'html.parser'))
+
+
+def test_a_metric_past_the_tolerance_is_a_regression_in_its_own_direction():
+    baselines = {'title_search': {'pages_per_second': 100.0, 'peak_rss_mb': 100.0}}
+    rows = bench_suite.END_TO_END['title_search'][2]
+    _, failures, regressions = bench_suite.check('title_search', {'pages_per_second': 80, 'peak_rss_mb': 120,
+                                                                  'rows': rows}, baselines)
+    assert failures == [] and regressions == []
+    _, _, regressions = bench_suite.check('title_search', {'pages_per_second': 70, 'peak_rss_mb': 130,
+                                                           'rows': rows}, baselines)
+    assert [problem.split()[1] for problem in regressions] == ['pages_per_second', 'peak_rss_mb']
+    # Faster and smaller is never a regression
+    _, _, regressions = bench_suite.check('title_search', {'pages_per_second': 500, 'peak_rss_mb': 10,
+                                                           'rows': rows}, baselines)
+    assert regressions == []
+
+
+def test_a_run_that_lost_rows_or_crashed_fails_however_fast_it_was():
+    baselines = {'title_search': {'pages_per_second': 100.0}}
+    _, failures, _ = bench_suite.check('title_search', {'pages_per_second': 1000, 'rows': 3}, baselines)
+    assert failures == [f"title_search wrote 3 rows instead of {bench_suite.titles}"]
+    _, failures, _ = bench_suite.check('title_search', {'error': "RuntimeError('stage crashed')"}, baselines)
+    assert len(failures) == 1
+
+
+@pytest.mark.stand_in(rate_limit=2, burst=3, retry_after_seconds=7)
+def test_stand_in_answers_429_with_retry_after_past_its_burst(scholar):
+    statuses = []
+    for i in range(6):
+        try:
+            with urllib.request.urlopen(f"{scholar}/scholar?q=paper+{i}", timeout=5) as response:
+                statuses.append(response.status)
+        except urllib.error.HTTPError as e:
+            statuses.append((e.code, e.headers['Retry-After']))
+    assert statuses[:3] == [200, 200, 200]
+    assert (429, '7') in statuses[3:]
+    assert stats(port) == {'pages': statuses.count(200), 'throttled': 6 - statuses.count(200)}
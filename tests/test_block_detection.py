@@ -0,0 +1,33 @@
+from make_fixtures import PAGE_HEAD, PAGE_TAIL, search_page
+from scholar_fetch import block_reason, looks_like_browser_only_page
+
+SEARCH_URL = 'https://scholar.google.com/scholar?q=traffic'
+# A real paper title that contains the text the old markers looked for
+TRAFFIC_TITLE = 'Detecting unusual traffic patterns in backbone networks'
+
+
+def test_results_about_unusual_traffic_are_a_normal_page():
+    html = search_page(TRAFFIC_TITLE).replace('https://example.org/paper0', 'https://example.org/sorry/paper0.pdf')
+    assert block_reason(200, html, SEARCH_URL) is None
+    assert not looks_like_browser_only_page(html, SEARCH_URL, 'gs_res_ccl')
+
+
+def test_captcha_form_is_a_block():
+    html = (PAGE_HEAD + '<div id="gs_captcha_ccl"><form id="gs_captcha_f" method="post">'
+            '<div class="g-recaptcha" data-sitekey="x"></div></form></div>' + PAGE_TAIL)
+    assert block_reason(200, html, SEARCH_URL) == 'CAPTCHA page'
+    assert looks_like_browser_only_page(html, SEARCH_URL)
+
+
+def test_sorry_page_is_a_block():
+    html = (PAGE_HEAD + '<p>Our systems have detected unusual traffic from your computer network.</p>'
+            '<form id="captcha-form" action="index" method="post"></form>' + PAGE_TAIL)
+    assert block_reason(200, html, 'https://www.google.com/sorry/index?continue=x') == 'redirected to the sorry page'
+    assert block_reason(200, html, SEARCH_URL) == 'CAPTCHA page'
+    assert block_reason(429, '', SEARCH_URL) == 'status 429'
+
+
+def test_consent_page_and_missing_results_need_the_browser():
+    consent = PAGE_HEAD + '<form action="https://consent.google.com/save" method="POST"></form>' + PAGE_TAIL
+    assert looks_like_browser_only_page(consent, SEARCH_URL)
+    assert looks_like_browser_only_page(PAGE_HEAD + PAGE_TAIL, SEARCH_URL, 'gs_res_ccl')
@@ -0,0 +1,92 @@
+import asyncio
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import pytest
+
+import citation_crawler
+from citation_crawler import BloomFilter, CrawlFrontier
+from conftest import stand_in_port as port
+from result_sink import open_sink
+from scholar_server import request_log
+
+
+@pytest.fixture
+def crawl_directory(scholar_host, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(citation_crawler.stage4, 'requests_per_second', 1000)
+    monkeypatch.setattr(citation_crawler.stage4, 'use_title_index', False)
+    monkeypatch.setattr(citation_crawler.stage4, 'cache_directory', str(tmp_path / 'page_cache'))
+    frontier = CrawlFrontier('frontier.sqlite3')
+    frontier.add([{'cluster': '1234567', 'title': 'The seed paper', 'url': 'https://example.org/seed',
+                   'cited_url': 'https://scholar.google.com/scholar?cites=1234567&hl=en', 'depth': 0}])
+    frontier.close()
+    return tmp_path
+
+
+def run_crawl(**limits):
+    # One run of the crawler, on the frontier a previous run left on disk
+    frontier = CrawlFrontier('frontier.sqlite3')
+    sink = open_sink('crawl.csv', citation_crawler.output_columns, 'csv', 'citation_crawl')
+    try:
+        crawled = asyncio.run(citation_crawler.crawl(frontier, sink, **limits))
+        return crawled, frontier.summary()
+    finally:
+        sink.close()
+        frontier.close()
+
+
+def crawled_clusters():
+    # The cluster of every paper whose first cited-by page the stand-in was asked for
+    return [parse_qs(urlsplit(path).query)['cites'][0]
+            for _, path in request_log(port)['requests'] if 'cites=' in path and 'start=' not in path]
+
+
+@pytest.mark.stand_in(cited_by_total=30)
+def test_crawl_stops_at_the_depth_limit_and_a_later_run_goes_deeper(crawl_directory):
+    crawled, summary = run_crawl(max_depth=0, max_nodes=100)
+    assert crawled == 1
+    assert summary == [(0, 'done', 1), (1, 'pending', 30)]
+
+    # Every citing paper cites the same 30 papers, which are all queued already
+    crawled, summary = run_crawl(max_depth=1, max_nodes=100)
+    assert crawled == 30
+    assert summary == [(0, 'done', 1), (1, 'done', 30)]
+    assert sorted(crawled_clusters()) == sorted(['1234567'] + [str(5000 + i) for i in range(30)])
+
+    rows = pd.read_csv('crawl.csv', dtype=str)
+    assert len(rows) == 31 * 30
+    assert rows['Depth'].value_counts().to_dict() == {'1': 900, '0': 30}
+
+
+@pytest.mark.stand_in(cited_by_total=30)
+def test_node_budget_takes_the_most_cited_papers_first(crawl_directory):
+    crawled, summary = run_crawl(max_depth=2, max_nodes=4)
+    assert crawled == 4
+    assert summary == [(0, 'done', 1), (1, 'done', 3), (1, 'pending', 27)]
+    # The stand-in's paper i is cited 7 * i times
+    assert crawled_clusters() == ['1234567', '5029', '5028', '5027']
+
+
+@pytest.mark.stand_in(cited_by_total=30)
+def test_paper_that_keeps_failing_is_given_up(crawl_directory, monkeypatch):
+    monkeypatch.setattr(citation_crawler, 'max_attempts', 2)
+    frontier = CrawlFrontier('frontier.sqlite3')
+    # Nothing listens on the discard port, so its fetch raises
+    frontier.add([{'cluster': '999', 'title': 'Unreachable', 'cited_url': 'http://127.0.0.1:9/scholar?cites=999',
+                   'cited_by': 10 ** 6, 'depth': 0}])
+    frontier.close()
+    assert run_crawl(max_depth=0, max_nodes=100)[1] == [(0, 'done', 1), (0, 'pending', 1), (1, 'pending', 30)]
+    # Taken again on the next run, and given up after its last attempt
+    assert run_crawl(max_depth=0, max_nodes=100)[1] == [(0, 'done', 1), (0, 'failed', 1), (1, 'pending', 30)]
+    assert run_crawl(max_depth=0, max_nodes=100)[0] == 0
+
+
+def test_bloom_filter_never_forgets_a_cluster_and_rarely_invents_one():
+    visited = BloomFilter(10000, 0.01)
+    clusters = [str(1000000 + i) for i in range(10000)]
+    for cluster in clusters:
+        visited.add(cluster)
+    assert all(cluster in visited for cluster in clusters)
+    false_positives = sum(str(9000000 + i) in visited for i in range(10000))
+    assert false_positives < 300
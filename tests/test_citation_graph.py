@@ -0,0 +1,90 @@
+import importlib
+
+import numpy as np
+import pytest
+
+from citation_graph import CitationGraph
+from result_sink import CsvSink
+
+stage4 = importlib.import_module('4_cited_articles_request')
+
+# (citing, cited): B, C and D cite A; B and C cite E; D cites B; F has no cluster and cites A
+CITATIONS = [('2', '1'), ('3', '1'), ('4', '1'), ('2', '5'), ('3', '5'), ('4', '2'), ('Paper F', '1')]
+
+
+def citation_row(citing, cited):
+    # A stage 4 row: cited is the original paper, citing one of the articles listed under "Cited by"
+    row = {'Original Paper Title': f"Paper {cited}", 'Original Cluster ID': cited,
+           'Original Cited Page URL': f"https://scholar.google.com/scholar?cites={cited}&hl=en"}
+    if citing.isdigit():
+        row.update({'Cited Article Title': f"Paper {citing}", 'Cited Article Cluster ID': citing,
+                    'Next Cited Articles URL': f"https://scholar.google.com/scholar?cites={citing}&hl=en"})
+    else:
+        row['Cited Article Title'] = citing
+    return row
+
+
+def write_citations(path, citations):
+    sink = CsvSink(path, stage4.output_columns)
+    sink.write_rows([citation_row(citing, cited) for citing, cited in citations])
+    sink.close()
+
+
+@pytest.fixture
+def graph(tmp_path):
+    path = str(tmp_path / 'cited.csv')
+    # Recorded twice, as a re-scraped page would be, to be counted once
+    write_citations(path, CITATIONS + [('2', '1')])
+    graph = CitationGraph(str(tmp_path / 'graph'))
+    graph.update(sources=[(path, 'csv')])
+    yield graph, path
+    graph.close()
+
+
+def clusters(graph, nodes):
+    return sorted(key for key, _ in graph.describe(nodes))
+
+
+def test_neighbour_queries_match_the_edge_list(graph):
+    graph, _ = graph
+    a, b, e = graph.find('1'), graph.find('2'), graph.find('5')
+    assert graph.edge_count == len(CITATIONS)
+    assert clusters(graph, graph.citing(a)) == ['cites:2', 'cites:3', 'cites:4', 'paper f']
+    assert clusters(graph, graph.cited(b)) == ['cites:1', 'cites:5']
+    assert list(graph.citing(a)) == sorted(graph.citing(a))
+    assert graph.in_degree(a) == 4 and graph.in_degree(e) == 2
+    assert list(graph.most_cited(2)) == [a, e]
+    # The paper without a cluster is keyed, and found, by any spelling of its title
+    f = graph.find(title='Paper F')
+    assert f in graph.citing(a) and graph.find(title='  PAPER f ') == f
+
+
+def test_walks_and_co_citation(graph):
+    graph, _ = graph
+    a, b, d, e = (graph.find(cluster) for cluster in '1245')
+    # D cites A and B, and B cites A and E
+    assert [clusters(graph, layer) for layer in graph.k_hop(d, 2, 'out')] == [['cites:1', 'cites:2'], ['cites:5']]
+    # D, the only paper citing B, already cites A, so the walk ends after one hop
+    assert [clusters(graph, layer) for layer in graph.k_hop(a, 2, 'in')] == [['cites:2', 'cites:3', 'cites:4', 'paper f']]
+    assert graph.co_citation(a, e) == 2
+    papers, counts = graph.co_cited_with(a)
+    assert [key for key, _ in graph.describe(papers)] == ['cites:5', 'cites:2'] and list(counts) == [2, 1]
+    assert graph.co_citation(a, b) == 1
+
+
+def test_update_reads_only_new_rows_and_keeps_node_numbers(graph, tmp_path):
+    graph, path = graph
+    a = graph.find('1')
+    write_citations(path, [('6', '1'), ('2', '1')])
+    assert graph.update(sources=[(path, 'csv')]) == 2
+    assert graph.find('1') == a
+    assert graph.edge_count == len(CITATIONS) + 1
+    assert graph.update(sources=[(path, 'csv')]) == 0
+
+    # A new handle maps the arrays from disk and answers the same
+    reopened = CitationGraph(str(tmp_path / 'graph'))
+    try:
+        assert np.array_equal(reopened.citing(a), graph.citing(a))
+        assert reopened.in_degree(a) == 5
+    finally:
+        reopened.close()
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from citation_metrics import compute_metrics, load_articles
+
+
+def articles(*citations):
+    return str([{'Title': f"Paper {i}", 'URL': None, 'Article ID': None, 'Cluster ID': str(1000 + i),
+                 'Citations': count} for i, count in enumerate(citations)])
+
+
+def write_profiles(path, rows, columns=('name', 'Researcher ID', 'Total Citations', 'h-index', 'i10-index')):
+    pd.DataFrame([row[:len(columns)] + (row[-1],) for row in rows], columns=list(columns) + ['Articles']).to_csv(
+        path, index=False)
+    return str(path)
+
+
+def test_indices_follow_their_definitions():
+    groups = np.array([0, 0, 0, 0, 0, 1, 1])
+    citations = np.array([10, 8, 5, 4, 3, 0, 0], dtype=float)
+    no_years = np.zeros(0, dtype=np.int64)
+    metrics, _, _ = compute_metrics(2, groups, citations, no_years, no_years, no_years, windows=[])
+    assert metrics['citations'].tolist() == [30, 0]
+    assert metrics['h-index'].tolist() == [4, 0]
+    assert metrics['i10-index'].tolist() == [1, 0]
+    # The top 5 have 30 >= 25 citations between them
+    assert metrics['g-index'].tolist() == [5, 0]
+
+
+def test_window_counts_only_its_years():
+    groups = np.array([0, 0])
+    citations = np.array([40, 40], dtype=float)
+    annual_article = np.array([0, 0, 1])
+    annual_year = np.array([2015, 2023, 2024])
+    annual_count = np.array([30, 12, 2])
+    metrics, years, totals = compute_metrics(1, groups, citations, annual_article, annual_year, annual_count,
+                                             windows=[5], last_year=2024)
+    assert metrics['citations (5y)'].tolist() == [14]
+    assert metrics['h-index (5y)'].tolist() == [2]
+    assert metrics['i10-index (5y)'].tolist() == [1]
+    assert years[0] == 2015 and totals.sum() == 44
+
+
+def test_researchers_are_grouped_by_profile_id(tmp_path):
+    path = write_profiles(tmp_path / 'profiles.csv', [
+        ('A Smith', 'AAAAAAAAAAAA', 30, 2, 1, articles(20, 10)),
+        ('A Smith', 'BBBBBBBBBBBB', 5, 1, 0, articles(5)),
+        # The second profile again, saved under another spelling of the name
+        ('Ann Smith', 'BBBBBBBBBBBB', 5, 1, 0, articles(5)),
+    ])
+    researchers, groups, keys, citations = load_articles(path, 'csv')
+    assert researchers['Researcher ID'].tolist() == ['AAAAAAAAAAAA', 'BBBBBBBBBBBB']
+    assert groups.tolist() == [0, 0, 1]
+    assert citations.tolist() == [20, 10, 5]
+
+
+def test_outputs_without_the_id_column_group_by_name(tmp_path):
+    path = write_profiles(tmp_path / 'profiles.csv', [
+        ('A Smith', 30, 2, 1, articles(20, 10)),
+        ('B Jones', 5, 1, 0, articles(5)),
+    ], columns=('name', 'Total Citations', 'h-index', 'i10-index'))
+    researchers, groups, _, _ = load_articles(path, 'csv')
+    assert researchers['name'].tolist() == ['A Smith', 'B Jones']
+    assert researchers['Researcher ID'].isna().all()
+    assert groups.tolist() == [0, 0, 1]
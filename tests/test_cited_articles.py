@@ -0,0 +1,65 @@
+import asyncio
+import importlib
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from checkpoint_store import CheckpointStore
+from conftest import stand_in_port as port
+from scholar_fetch import AsyncFetcher
+from scholar_server import request_log
+
+stage4 = importlib.import_module('4_cited_articles_request')
+
+
+def paper(title, cited_url):
+    return {'Original Title': title, 'URL': 'https://example.org/paper', 'Cited Articles URL': cited_url,
+            'Cited By Count': None, 'Paper Key': cited_url}
+
+
+def cited_by_offsets():
+    # The start= of every cited-by page the stand-in was asked for, in order
+    return [int(parse_qs(urlsplit(path).query).get('start', ['0'])[0])
+            for _, path in request_log(port)['requests'] if 'cites=' in path]
+
+
+def scrape(row):
+    async def run():
+        async with AsyncFetcher(requests_per_second=1000) as fetcher:
+            return await stage4.scrape_cited_articles(fetcher, row)
+    return asyncio.run(run())
+
+
+@pytest.mark.stand_in(cited_by_total=187)
+def test_pagination_collects_every_page_once(scholar, monkeypatch):
+    monkeypatch.setattr(stage4, 'use_title_index', False)
+    articles = scrape(paper('A paper', f"{scholar}/scholar?cites=1234567&hl=en"))
+    assert len(articles) == 187
+    assert len({article['Cited Article URL'] for article in articles}) == 187
+    assert sorted(cited_by_offsets()) == list(range(0, 187, stage4.results_per_page))
+
+
+@pytest.mark.stand_in(cited_by_total=1500)
+def test_pagination_stops_where_scholar_stops_listing(scholar, monkeypatch):
+    monkeypatch.setattr(stage4, 'use_title_index', False)
+    monkeypatch.setattr(stage4, 'max_results', 100)
+    articles = scrape(paper('A paper', f"{scholar}/scholar?cites=1234567&hl=en"))
+    assert len(articles) == 100
+    assert sorted(cited_by_offsets()) == [0, 20, 40, 60, 80]
+
+
+@pytest.mark.stand_in(cited_by_total=0)
+def test_a_paper_nobody_cites_is_done_and_one_that_errors_is_failed(scholar, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(stage4, 'requests_per_second', 1000)
+    monkeypatch.setattr(stage4, 'use_title_index', False)
+    uncited = paper('Uncited', f"{scholar}/scholar?cites=1&hl=en")
+    # Nothing listens on the discard port, so the fetch raises
+    unreachable = paper('Unreachable', 'http://127.0.0.1:9/scholar?cites=2&hl=en')
+    checkpoint = CheckpointStore('cited_articles')
+    try:
+        asyncio.run(stage4.scrape_all_cited_articles([uncited, unreachable], 'cited.csv', checkpoint))
+        assert checkpoint.lookup(uncited['Paper Key'])[0] == 'done'
+        assert checkpoint.lookup(unreachable['Paper Key'])[0] == 'retry'
+    finally:
+        checkpoint.close()
@@ -0,0 +1,119 @@
+import pytest
+from selenium.common.exceptions import NoSuchElementException
+
+from make_fixtures import PAGE_HEAD, PAGE_TAIL, search_page
+from page_cache import PageCache
+from scholar_fetch import HttpFirstFetcher
+
+CONSENT_PAGE = PAGE_HEAD + '<form action="https://consent.google.com/save" method="POST"></form>' + PAGE_TAIL
+
+
+class FakeDriver:
+    # Stands in for Chrome: serves one fixed page, which has or lacks the results container
+    def __init__(self, page, loaded=True):
+        self.page_source = page
+        self.loaded = loaded
+        self.current_url = None
+        self.visits = 0
+
+    def get(self, url):
+        self.current_url = url
+        self.visits += 1
+
+    def execute_script(self, script):
+        return 'complete' if self.loaded else 'loading'
+
+    def find_element(self, by, value):
+        if 'gs_res_ccl' not in self.page_source:
+            raise NoSuchElementException(value)
+        return object()
+
+    def get_cookies(self):
+        return []
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = PageCache(str(tmp_path / 'page_cache'))
+    yield cache
+    cache.close()
+
+
+def browser_only_url(scholar):
+    # The stand-in answers 404 here, so the fetch goes on to the browser
+    return f"{scholar}/scholar?hl=en"
+
+
+def fetcher_with(driver, cache):
+    return HttpFirstFetcher(driver_factory=lambda **options: driver, requests_per_second=1000, cache=cache,
+                            browser_timeout=0.3)
+
+
+@pytest.mark.stand_in()
+def test_page_the_browser_timed_out_on_is_not_cached(scholar, cache):
+    url = browser_only_url(scholar)
+    page = search_page('A paper')
+    driver = FakeDriver(page, loaded=False)
+    fetcher = fetcher_with(driver, cache)
+    try:
+        # The caller still gets what was there, but it is not kept
+        assert fetcher.get_html(url, expected_marker='gs_res_ccl') == page
+        assert cache.get(url) is None
+        # The next request tries again instead of replaying a half-loaded page
+        fetcher.get_html(url, expected_marker='gs_res_ccl')
+        assert driver.visits == 2
+    finally:
+        fetcher.close()
+
+
+@pytest.mark.stand_in()
+def test_consent_page_is_not_cached_even_if_loaded(scholar, cache):
+    url = browser_only_url(scholar)
+    fetcher = fetcher_with(FakeDriver(CONSENT_PAGE), cache)
+    try:
+        assert fetcher.get_html(url, expected_marker='gs_res_ccl') == CONSENT_PAGE
+        assert cache.get(url) is None
+    finally:
+        fetcher.close()
+
+
+@pytest.mark.stand_in()
+def test_complete_page_is_cached_and_replayed(scholar, cache):
+    url = f"{scholar}/scholar?q=paper"
+    page = search_page('A paper')
+    driver = FakeDriver(page)
+    fetcher = fetcher_with(driver, cache)
+    try:
+        # The stand-in's own page already has the container, so plain HTTP is enough here
+        assert 'gs_res_ccl' in fetcher.get_html(url, expected_marker='gs_res_ccl')
+        assert cache.get(url) is not None
+        assert 'gs_res_ccl' in fetcher.get_html(url, expected_marker='gs_res_ccl')
+        assert driver.visits == 0
+    finally:
+        fetcher.close()
+
+
+@pytest.mark.stand_in()
+def test_unusable_cached_copy_is_fetched_again(scholar, cache):
+    url = browser_only_url(scholar)
+    cache.put(url, CONSENT_PAGE)
+    fetcher = fetcher_with(FakeDriver(search_page('A paper')), cache)
+    try:
+        html = fetcher.get_html(url, expected_marker='gs_res_ccl')
+        assert 'gs_res_ccl' in html
+        assert 'gs_res_ccl' in cache.get(url)
+    finally:
+        fetcher.close()
+
+
+@pytest.mark.stand_in()
+def test_closing_the_fetcher_leaves_the_callers_cache_open(scholar, cache):
+    url = f"{scholar}/scholar?q=paper"
+    fetcher = fetcher_with(FakeDriver(search_page('A paper')), cache)
+    fetcher.get_html(url, expected_marker='gs_res_ccl')
+    fetcher.close()
+    # Other fetchers sharing the cache keep reading it
+    assert 'gs_res_ccl' in cache.get(url)
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import scholar_fetch
+from scholar_fetch import AsyncFetcher, Identity, IdentityPool
+
+# Forwards straight to the stand-in, whatever proxy the test environment sets
+direct = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+
+class StandInProxy(ThreadingHTTPServer):
+    # A forward proxy that counts what it sends, and answers 429 itself while blocking is set
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ProxyHandler)
+        self.sent = []
+        self.blocking = False
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        proxy = self.server
+        if proxy.blocking:
+            self.reply(429, b'<html><body>Too many requests</body></html>', {'Retry-After': '1'})
+            return
+        with proxy.lock:
+            proxy.sent.append(time.monotonic())
+        # A proxied request names the whole URL
+        with direct.open(self.path, timeout=10) as response:
+            self.reply(response.status, response.read(), {})
+
+    def reply(self, status, body, headers):
+        self.send_response(status)
+        for name, value in dict(headers, **{'Content-Type': 'text/html', 'Content-Length': str(len(body))}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def proxies():
+    servers = [StandInProxy(), StandInProxy()]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def steady_rates(monkeypatch):
+    # Budgets stay at their configured rate, and a block pauses for the proxy's Retry-After
+    monkeypatch.setattr(scholar_fetch, 'rate_increase', 0)
+    monkeypatch.setattr(scholar_fetch, 'backoff_seconds', 0.05)
+
+
+def pool(proxies, *rates):
+    return IdentityPool([Identity(f"identity-{number}", proxy.url, requests_per_second=rate)
+                         for number, (proxy, rate) in enumerate(zip(proxies, rates))])
+
+
+def fetch_all(identities, urls, concurrency=8):
+    async def run():
+        async with AsyncFetcher(concurrency=concurrency, identities=identities) as fetcher:
+            return await asyncio.gather(*(fetcher.fetch(url) for url in urls))
+    return asyncio.run(run())
+
+
+def test_each_identity_keeps_to_its_own_budget(scholar, proxies):
+    fast, slow = proxies
+    pages = fetch_all(pool(proxies, 20, 5), [f"{scholar}/scholar?q=paper+{i}" for i in range(30)])
+    assert all('gs_res_ccl' in page for page in pages)
+    assert len(fast.sent) + len(slow.sent) == 30
+    # Work follows the budgets, and no 5 intervals at a proxy are shorter than its rate allows, jitter included
+    assert len(fast.sent) > 2 * len(slow.sent) > 0
+    for proxy, rate in [(fast, 20), (slow, 5)]:
+        sent = sorted(proxy.sent)
+        assert all(later - earlier > 5 * 0.75 / rate - 0.01 for earlier, later in zip(sent, sent[5:]))
+
+
+def test_blocked_identity_loses_health_and_work_moves_to_the_other(scholar, proxies, monkeypatch):
+    monkeypatch.setattr(scholar_fetch, 'max_retries', 10)
+    healthy, blocked = proxies
+    blocked.blocking = True
+    identities = pool(proxies, 10, 10)
+    pages = fetch_all(identities, [f"{scholar}/scholar?q=paper+{i}" for i in range(12)])
+    assert all('gs_res_ccl' in page for page in pages)
+    assert len(healthy.sent) == 12 and not blocked.sent
+    first, second = identities.identities
+    assert first.health == 1.0
+    assert second.health < 1.0
+    assert second.rate_limiter.next_delay(f"{scholar}/scholar?q=x") > 0.5
+
+
+def test_request_goes_to_the_identity_that_can_send_soonest():
+    identities = IdentityPool([Identity('a', requests_per_second=1), Identity('b', requests_per_second=1)])
+    url = 'https://scholar.google.com/scholar?q=x'
+    first, _ = identities.reserve(url)
+    second, _ = identities.reserve(url)
+    # The first identity's next token is a second away, so the second one sends now
+    assert {first.name, second.name} == {'a', 'b'}
+    # A paused identity is passed over while the other can send soonest
+    identities.identities[1].record_block(url, time.monotonic(), 'status 429', wait=60)
+    chosen, delay = identities.reserve(url)
+    assert chosen.name == 'a' and delay < 2
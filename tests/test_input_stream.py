@@ -0,0 +1,75 @@
+import importlib
+import time
+
+import pandas as pd
+import pytest
+
+from checkpoint_store import CheckpointStore
+from input_stream import iter_input_rows
+
+stage3 = importlib.import_module('3_title_google_search')
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / 'input.csv'
+    pd.DataFrame({'name': ['R'] * 5, 'Title': ['A', 'B', 'a', 'C', 'D'],
+                  'URL': [f"https://example.org/{i}" for i in range(5)], 'Cluster ID': ['0123', None, '7', '8', '9']}
+                 ).to_csv(path, index=False)
+    return str(path)
+
+
+def test_rows_hold_only_the_asked_columns_as_text(input_file):
+    rows = list(iter_input_rows(input_file, ['Title', 'URL'], optional=['Cluster ID', 'Cited By Count'], chunksize=2))
+    assert len(rows) == 5
+    assert list(rows[0]) == ['Title', 'URL', 'Cluster ID', 'Cited By Count']
+    # Ids keep their leading zeros, and an optional column the file lacks is empty
+    assert rows[0]['Cluster ID'] == '0123'
+    assert rows[1]['Cluster ID'] != rows[1]['Cluster ID']
+    assert rows[0]['Cited By Count'] != rows[0]['Cited By Count']
+
+
+def test_missing_required_column_is_an_error_before_any_row_is_read(input_file):
+    with pytest.raises(ValueError, match="'paper url'"):
+        iter_input_rows(input_file, ['title', 'paper url'])
+
+
+def test_pending_rows_drop_duplicates_and_finished_items_through_the_store(input_file, tmp_path):
+    checkpoint = CheckpointStore('test', str(tmp_path / 'checkpoints.sqlite3'))
+    checkpoint.mark_done(['D'])
+    rows = checkpoint.pending_rows(iter_input_rows(input_file, ['Title', 'URL']), 'Title')
+    # 'a' is the same key as 'A', and 'D' is already done
+    assert [row['Title'] for row in rows] == ['A', 'B', 'C']
+
+    # On the next pass, items still pending come back once, a failed one waits for its retry time
+    checkpoint.mark_done(['A'])
+    checkpoint.mark_failed('B')
+    rows = checkpoint.pending_rows(iter_input_rows(input_file, ['Title', 'URL']), 'Title')
+    assert [row['Title'] for row in rows] == ['C']
+    checkpoint.db.execute("UPDATE items SET retry_after = ? WHERE key = 'b'", (time.time() - 1,))
+    rows = checkpoint.pending_rows(iter_input_rows(input_file, ['Title', 'URL']), 'Title')
+    assert [row['Title'] for row in rows] == ['B', 'C']
+    checkpoint.close()
+
+
+def test_pending_rows_record_the_keys_they_let_through_in_the_store(tmp_path):
+    checkpoint = CheckpointStore('test', str(tmp_path / 'checkpoints.sqlite3'))
+    rows = ({'title': f"Paper {i % 500}"} for i in range(2000))
+    assert sum(1 for _ in checkpoint.pending_rows(rows, 'title')) == 500
+    # Every key the pass let through is recorded in the store, which a second reader sees
+    other = CheckpointStore('test', str(tmp_path / 'checkpoints.sqlite3'))
+    assert other.db.execute('SELECT COUNT(*) FROM items').fetchone()[0] == 500
+    checkpoint.close()
+    other.close()
+
+
+def test_rows_without_a_title_are_skipped_before_they_are_keyed(tmp_path):
+    path = tmp_path / 'paper_details.csv'
+    pd.DataFrame({'title': ['A paper', None, '', 'Another paper'],
+                  'paper url': [f"https://example.org/{i}" for i in range(4)]}).to_csv(path, index=False)
+    checkpoint = CheckpointStore('title_search', str(tmp_path / 'checkpoints.sqlite3'))
+    rows = checkpoint.pending_rows(stage3.titled_rows(iter_input_rows(str(path), ['title', 'paper url'])), 'title')
+    assert [row['title'] for row in rows] == ['A paper', 'Another paper']
+    # No 'nan' key was recorded for the blank rows
+    assert checkpoint.db.execute('SELECT COUNT(*) FROM items').fetchone()[0] == 2
+    checkpoint.close()
@@ -0,0 +1,38 @@
+import importlib
+import json
+import os
+
+import pytest
+
+import instrumentation
+import parse_pool
+from make_fixtures import cited_by_page
+
+stage4 = importlib.import_module('4_cited_articles_request')
+
+
+@pytest.mark.parametrize('start_method', ['spawn', 'forkserver'])
+def test_parse_workers_export_their_numbers_once_when_the_pool_shuts_down(monkeypatch, tmp_path, start_method):
+    # Workers read the switch from the environment they inherit
+    monkeypatch.setenv('SCHOLAR_METRICS', '1')
+    monkeypatch.setattr(parse_pool, 'parse_workers', 1)
+    monkeypatch.setattr(parse_pool, 'start_method', start_method)
+    monkeypatch.chdir(tmp_path)
+    paper = {'Original Title': 'A paper', 'URL': None, 'Cited Articles URL': None}
+    try:
+        articles, _, _ = parse_pool.parse(stage4.parse_results_page, cited_by_page(0, 10), paper)
+    finally:
+        parse_pool.close_parse_pool()
+    assert len(articles) == 10
+
+    # The worker's export is well within its 10 s interval, so only the shutdown can have written it
+    with open(tmp_path / instrumentation.jsonl_path, encoding='utf-8') as file:
+        lines = [json.loads(line) for line in file]
+    worker_lines = [line for line in lines if line['pid'] != os.getpid()]
+    assert len(worker_lines) == 1
+    assert any(timer['step'] == 'extract' and timer['count'] == 1 for timer in worker_lines[0]['timers'])
+
+
+def test_prometheus_label_values_are_escaped():
+    text = instrumentation.prometheus_text({('items', (('stage', 'a\\b "c"\nd'),)): 3}, {})
+    assert 'scholar_items_total{stage="a\\\\b \\"c\\"\\nd"} 3' in text.splitlines()
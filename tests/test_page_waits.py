@@ -0,0 +1,44 @@
+import time
+
+from selenium.common.exceptions import NoSuchElementException
+
+from page_waits import wait_until_ready
+
+
+class SlowPage:
+    # Stands in for Chrome: each selector shows up in the DOM a set number of seconds after the page is opened
+    def __init__(self, appear_after):
+        self.opened_at = time.monotonic()
+        self.appear_after = appear_after
+        self.lookups = []
+
+    def execute_script(self, script):
+        return 'complete'
+
+    def find_element(self, by, value):
+        self.lookups.append(value)
+        if time.monotonic() - self.opened_at < self.appear_after.get(value, float('inf')):
+            raise NoSuchElementException(value)
+        return object()
+
+
+def test_wait_ends_as_soon_as_the_page_is_usable():
+    driver = SlowPage({'gs_res_ccl': 0.3})
+    started = time.monotonic()
+    assert wait_until_ready(driver, 'https://scholar.google.com/scholar?hl=en&q=a+paper', timeout=5)
+    assert 0.3 <= time.monotonic() - started < 1
+
+
+def test_profile_waits_for_its_rows_and_its_citation_graph():
+    rows = '#gsc_a_b .gsc_a_tr, #gsc_a_b .gsc_a_e'
+    graph = '.gsc_md_hist_b, #gsc_rsb_cit'
+    driver = SlowPage({rows: 0, graph: 0.2})
+    assert wait_until_ready(driver, 'https://scholar.google.com/citations?hl=en&user=AAAAAAAAAAAA', timeout=5)
+    assert driver.lookups[0] == rows and driver.lookups[-1] == graph
+
+
+def test_page_that_never_becomes_usable_gives_up_at_the_timeout():
+    driver = SlowPage({})
+    started = time.monotonic()
+    assert not wait_until_ready(driver, 'https://scholar.google.com/scholar?hl=en&cites=1000000', timeout=0.3)
+    assert time.monotonic() - started < 1
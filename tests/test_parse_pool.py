@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import parse_pool
+
+
+def test_full_parse_queue_does_not_block_the_event_loop(monkeypatch):
+    monkeypatch.setattr(parse_pool, 'parse_workers', 1)
+    monkeypatch.setattr(parse_pool, 'pages_per_worker', 1)
+
+    async def run():
+        # Start the worker first, so its start-up time is not counted as a stall
+        await parse_pool.parse_async(time.sleep, 0)
+        gaps = []
+
+        async def ticker(stop):
+            last = time.monotonic()
+            while not stop.is_set():
+                await asyncio.sleep(0.01)
+                gaps.append(time.monotonic() - last)
+                last = time.monotonic()
+
+        stop = asyncio.Event()
+        ticking = asyncio.ensure_future(ticker(stop))
+        # Three slow parses through a single slot: two of them wait for it
+        await asyncio.gather(*(parse_pool.parse_async(time.sleep, 0.3) for _ in range(3)))
+        stop.set()
+        await ticking
+        return gaps
+
+    try:
+        gaps = asyncio.run(run())
+    finally:
+        parse_pool.close_parse_pool()
+    assert sum(gaps) > 0.8
+    assert max(gaps) < 0.15
+
+
+def test_results_and_errors_come_back_from_the_workers(monkeypatch):
+    monkeypatch.setattr(parse_pool, 'parse_workers', 1)
+
+    async def run():
+        assert await parse_pool.parse_async(divmod, 7, 2) == (3, 1)
+        try:
+            await parse_pool.parse_async(divmod, 1, 0)
+        except ZeroDivisionError:
+            return True
+
+    try:
+        assert asyncio.run(run())
+        assert parse_pool.parse(divmod, 9, 4) == (2, 1)
+    finally:
+        parse_pool.close_parse_pool()
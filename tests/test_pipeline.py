@@ -0,0 +1,124 @@
+import asyncio
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+import author_resolver
+import pipeline
+import title_index
+from conftest import stand_in_port as port
+from scholar_fetch import load_identities
+from scholar_server import request_log
+
+NAMES = ['Ada Example', 'Bob Example']
+
+
+def checkpoint_statuses(path='checkpoints.sqlite3'):
+    # {(stage, status): items} from the checkpoint store the stages shared
+    db = sqlite3.connect(path)
+    try:
+        return {(stage, status): items for stage, status, items in
+                db.execute('SELECT stage, status, COUNT(*) FROM items GROUP BY stage, status')}
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def run_directory(tmp_path, monkeypatch):
+    # Outputs, caches and checkpoints of one run, with the budget opened up for the stand-in; the
+    # SQLite handles kept per process would otherwise point at an earlier test's directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pipeline, 'requests_per_second', 1000)
+    monkeypatch.setattr(pipeline, 'claimed_researchers', set())
+    monkeypatch.setattr(author_resolver, 'open_caches', {})
+    monkeypatch.setattr(title_index, 'open_indexes', {})
+    return tmp_path
+
+
+@pytest.mark.stand_in(profile_articles=3, cited_by_total=25)
+def test_every_stage_saves_its_rows_and_checkpoints(scholar_host, run_directory):
+    pipeline.run_pipeline(NAMES)
+
+    profiles = pd.read_csv(pipeline.stage1.output_filename)
+    assert sorted(profiles['name']) == NAMES
+    assert profiles['Researcher ID'].nunique() == 2
+    # The stand-in gives both profiles the same three papers (the same cluster ids), so each is fetched once
+    details = pd.read_csv(pipeline.stage2.output_filename)
+    assert len(details) == 3
+    searched = pd.read_csv(pipeline.stage3.output_filename)
+    assert sorted(searched['Original Title']) == sorted(details['title'])
+    # Every title's first hit is the same paper, so its cited-by list is scraped once
+    assert searched['Cited Articles URL'].str.contains('cites=5000').all()
+    cited = pd.read_csv(pipeline.stage4.output_file)
+    assert len(cited) == 25
+
+    assert checkpoint_statuses() == {
+        ('researcher_profiles', 'done'): 2,
+        ('paper_details', 'done'): 3,
+        ('title_search', 'done'): 3,
+        ('cited_articles', 'done'): 1,
+    }
+
+
+@pytest.mark.stand_in(profile_articles=1, cited_by_total=5)
+def test_a_profile_given_in_the_input_is_not_searched(scholar_host, run_directory):
+    pipeline.run_pipeline(NAMES, [None, 'GivenProf_01'])
+
+    profiles = pd.read_csv(pipeline.stage1.output_filename).set_index('name')
+    assert profiles.loc['Bob Example', 'Researcher ID'] == 'GivenProf_01'
+    searches = [path for _, path in request_log(port)['requests'] if 'search_authors' in path]
+    assert len(searches) == 1 and 'Ada' in searches[0]
+
+
+class BrokenSink:
+    # Fails on one item's rows, as a full disk or an unwritable value would
+    def __init__(self, bad_name):
+        self.bad_name = bad_name
+        self.rows = []
+
+    def write_rows(self, rows):
+        if any(row['name'] == self.bad_name for row in rows):
+            raise OSError('No space left on device')
+        self.rows.extend(rows)
+
+    def close(self):
+        pass
+
+
+def copy_item(fetcher, item):
+    return [dict(item)]
+
+
+async def copy_item_async(fetcher, item):
+    return [dict(item)]
+
+
+def run_sync_stage(stage):
+    pipeline.stage_worker(stage, load_identities(1000))
+
+
+def run_async_stage(stage):
+    asyncio.run(pipeline.run_async_stage(stage, load_identities(1000)))
+
+
+@pytest.mark.parametrize('task, run_stage', [(copy_item, run_sync_stage), (copy_item_async, run_async_stage)])
+def test_a_failed_save_is_recorded_and_the_inbox_still_drains(run_directory, monkeypatch, task, run_stage):
+    # One worker behind a one-item inbox: had the worker died on the bad item, feeding would block for good
+    monkeypatch.setattr(pipeline, 'queue_size', 1)
+    stage = pipeline.Stage('names', task, 1, 'name', 'names.csv', ['name'], 'name')
+    stage.sink = BrokenSink('c')
+    stage.add_producer()
+    names = ['a', 'b', 'c', 'd', 'e']
+    threads = [threading.Thread(target=pipeline.feed_names, args=(stage, names), daemon=True),
+               threading.Thread(target=run_stage, args=(stage,), daemon=True)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    assert not any(thread.is_alive() for thread in threads)
+    stage.close()
+
+    assert [row['name'] for row in stage.sink.rows] == ['a', 'b', 'd', 'e']
+    assert checkpoint_statuses() == {('names', 'done'): 4, ('names', 'retry'): 1}
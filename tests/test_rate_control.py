@@ -0,0 +1,148 @@
+import asyncio
+import importlib
+import multiprocessing
+import time
+from urllib.parse import quote_plus
+
+import pandas as pd
+import pytest
+
+import browser_pool
+import scholar_fetch
+from scholar_fetch import AsyncFetcher, BlockedError, HostRateLimiter, HttpFirstFetcher, shared_block_state
+from conftest import stand_in_port as port
+from scholar_server import stats
+
+stage4 = importlib.import_module('4_cited_articles_request')
+
+
+@pytest.fixture(autouse=True)
+def short_backoff(monkeypatch):
+    # The pause after a block then comes from the stand-in's Retry-After header
+    monkeypatch.setattr(scholar_fetch, 'backoff_seconds', 0.05)
+
+
+def search_url(url, query):
+    return f"{url}/scholar?q={quote_plus(query)}"
+
+
+def test_retry_after_sets_the_pause_and_the_rate_is_cut():
+    limiter = HostRateLimiter(100, jitter=0)
+    limiter.record_block('https://scholar.google.com/scholar?q=a', time.monotonic(), 'status 429', wait=2)
+    assert limiter.next_delay('https://scholar.google.com/scholar?q=b') > 1.9
+    assert limiter.hosts['scholar.google.com'].rate == 100 * scholar_fetch.rate_decrease
+    # Another host is not slowed
+    assert limiter.next_delay('https://example.org/') < 0.1
+
+
+def record_block_in_child(shared):
+    HostRateLimiter(10, jitter=0, shared=shared).record_block('https://scholar.google.com/scholar?q=a',
+                                                               time.monotonic(), 'status 429', wait=20)
+
+
+def test_a_block_in_one_process_pauses_the_others():
+    manager = multiprocessing.Manager()
+    try:
+        shared = shared_block_state(manager)
+        limiter = HostRateLimiter(10, jitter=0, shared=shared)
+        assert limiter.next_delay('https://scholar.google.com/scholar?q=b') < 0.2
+        child = multiprocessing.Process(target=record_block_in_child, args=(shared,))
+        child.start()
+        child.join()
+        assert limiter.next_delay('https://scholar.google.com/scholar?q=b') > 19
+        assert limiter.hosts['scholar.google.com'].rate == 10 * scholar_fetch.rate_decrease
+        # Other identities keep their own state
+        assert HostRateLimiter(10, label='other', shared=shared).next_delay('https://scholar.google.com/') < 0.2
+    finally:
+        manager.shutdown()
+
+
+@pytest.mark.stand_in(rate_limit=20, burst=2, retry_after_seconds=0.5)
+def test_async_fetcher_backs_off_and_still_collects_every_page(scholar, monkeypatch):
+    monkeypatch.setattr(scholar_fetch, 'max_retries', 20)
+    urls = [search_url(scholar, f"paper {i}") for i in range(30)]
+
+    async def fetch_all():
+        async with AsyncFetcher(concurrency=8, requests_per_second=200) as fetcher:
+            pages = await asyncio.gather(*(fetcher.fetch(url) for url in urls))
+            return pages, fetcher.identities.identities[0]
+
+    start = time.monotonic()
+    pages, identity = asyncio.run(fetch_all())
+    assert all('gs_res_ccl' in page for page in pages)
+    served = stats(port)
+    assert served['pages'] == len(urls)
+    assert served['throttled'] > 0
+    # The 429s slowed the host, and the pause followed Retry-After rather than the short backoff
+    assert identity.rate_limiter.hosts['127.0.0.1:%d' % port].rate < 200
+    assert time.monotonic() - start > 0.5
+    assert identity.health < 1
+
+
+@pytest.mark.stand_in()
+def test_a_paper_about_unusual_traffic_is_not_a_block(scholar):
+    async def fetch():
+        async with AsyncFetcher(requests_per_second=100) as fetcher:
+            page = await fetcher.fetch(search_url(scholar, 'Detecting unusual traffic patterns in backbone networks'))
+            return page, fetcher.identities.identities[0].rate_limiter.hosts['127.0.0.1:%d' % port]
+
+    page, state = asyncio.run(fetch())
+    assert 'unusual traffic' in page
+    assert state.blocks_in_row == 0 and state.last_block is None
+
+
+@pytest.mark.stand_in(rate_limit=1, burst=1, retry_after_seconds=1)
+def test_blocked_item_is_requeued_until_the_pause_is_over(scholar, monkeypatch):
+    monkeypatch.setattr(scholar_fetch, 'max_retries', 0)
+    fetcher = HttpFirstFetcher(driver_factory=None, requests_per_second=100)
+    attempts = []
+
+    def task(fetcher, row):
+        attempts.append(row)
+        return [fetcher.get_html(search_url(scholar, row['title']), expected_marker='gs_res_ccl')]
+
+    try:
+        # The first page spends the stand-in's only token, so the second is blocked once and then served
+        assert browser_pool.run_task(task, fetcher, {'title': 'first'})
+        assert browser_pool.run_task(task, fetcher, {'title': 'second'})
+    finally:
+        fetcher.close()
+    assert len(attempts) == 3
+    assert stats(port) == {'pages': 2, 'throttled': 1}
+
+
+@pytest.mark.stand_in(rate_limit=0.01, burst=1, retry_after_seconds=0.2)
+def test_item_still_blocked_after_the_requeue_rounds_fails(scholar, monkeypatch):
+    monkeypatch.setattr(scholar_fetch, 'max_retries', 0)
+    fetcher = HttpFirstFetcher(driver_factory=None, requests_per_second=100)
+
+    def task(fetcher, row):
+        return [fetcher.get_html(search_url(scholar, row['title']), expected_marker='gs_res_ccl')]
+
+    try:
+        assert browser_pool.run_task(task, fetcher, {'title': 'first'})
+        with pytest.raises(BlockedError):
+            task(fetcher, {'title': 'second'})
+        assert browser_pool.run_task(task, fetcher, {'title': 'third'}) is None
+    finally:
+        fetcher.close()
+    assert stats(port)['throttled'] == 2 + browser_pool.requeue_rounds
+
+
+@pytest.mark.stand_in(rate_limit=5, burst=3, retry_after_seconds=0.5, cited_by_total=45)
+def test_stage4_requeues_blocked_papers_and_writes_every_row_once(scholar, monkeypatch, tmp_path):
+    monkeypatch.setattr(scholar_fetch, 'max_retries', 0)
+    monkeypatch.setattr(stage4, 'requeue_rounds', 10)
+    monkeypatch.setattr(stage4, 'requests_per_second', 100)
+    monkeypatch.setattr(stage4, 'cache_directory', str(tmp_path / 'page_cache'))
+    monkeypatch.setattr(stage4, 'use_title_index', False)
+    rows = [{'Original Title': f"Paper {i}", 'URL': f"https://example.org/paper{i}",
+             'Cited Articles URL': f"{scholar}/scholar?cites={1000 + i}&hl=en", 'Paper Key': str(1000 + i)}
+            for i in range(4)]
+    output = str(tmp_path / 'cited.csv')
+    asyncio.run(stage4.scrape_all_cited_articles(rows, output))
+
+    written = pd.read_csv(output)
+    assert len(written) == 4 * 45
+    assert not written.duplicated(['Original Paper Title', 'Cited Article URL']).any()
+    assert stats(port)['throttled'] > 0
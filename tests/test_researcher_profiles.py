@@ -0,0 +1,63 @@
+import importlib
+
+import pandas as pd
+import pytest
+
+from checkpoint_store import CheckpointStore
+from scholar_fetch import HttpFirstFetcher
+from scholar_server import request_log
+
+from conftest import stand_in_port as port
+
+stage1 = importlib.import_module('1_researcher_profile_extraction_v2')
+
+
+def no_browser(**options):
+    raise AssertionError('the profile pages should come over HTTP')
+
+
+def profile_requests():
+    return [path for _, path in request_log(port)['requests'] if path.startswith('/citations')]
+
+
+@pytest.mark.stand_in(profile_articles=250)
+def test_profile_articles_are_read_in_direct_pages(scholar):
+    fetcher = HttpFirstFetcher(driver_factory=no_browser, requests_per_second=1000)
+    try:
+        [profile] = stage1.scrape_researcher_profile(
+            fetcher, {'name': 'Ada Example', 'researcher_url': f"{scholar}/citations?hl=en&user=AAAAAAAAAAAA"})
+    finally:
+        fetcher.close()
+    assert [article['Article ID'] for article in profile['Articles']] == [f'AAAAAAAAAAAA:{i:012d}' for i in range(250)]
+    assert profile['Researcher ID'] == 'AAAAAAAAAAAA'
+    assert [path.split('&', 2)[2] for path in profile_requests()] == [
+        'cstart=0&pagesize=100', 'cstart=100&pagesize=100', 'cstart=200&pagesize=100']
+
+
+@pytest.mark.stand_in(profile_articles=200)
+def test_a_full_last_page_with_show_more_disabled_is_the_end(scholar):
+    fetcher = HttpFirstFetcher(driver_factory=no_browser, requests_per_second=1000)
+    try:
+        pages = list(stage1.iter_profile_pages(fetcher, f"{scholar}/citations?hl=en&user=AAAAAAAAAAAA"))
+    finally:
+        fetcher.close()
+    assert [len(stage1.extract_articles(soup)) for soup in pages] == [100, 100]
+    assert len(profile_requests()) == 2
+
+
+def test_names_sharing_a_profile_are_scraped_once_and_all_done(tmp_path):
+    checkpoint = CheckpointStore('researcher_profiles', str(tmp_path / 'checkpoints.sqlite3'))
+    resolved = pd.DataFrame({
+        'name': ['Ada Example', 'A. Example', 'Bob Example', 'Nobody'],
+        'researcher_url': ['https://scholar.google.com/citations?hl=en&user=AAAAAAAAAAAA',
+                           'https://scholar.google.com/citations?hl=en&user=AAAAAAAAAAAA',
+                           'https://scholar.google.com/citations?hl=en&user=BBBBBBBBBBBB', None],
+    })
+    try:
+        kept = stage1.drop_repeated_profiles(resolved, checkpoint)
+        assert list(kept['name']) == ['Ada Example', 'Bob Example', 'Nobody']
+        # The repeat is settled now; the others wait for their own scrape
+        assert not checkpoint.should_fetch('A. Example')
+        assert checkpoint.should_fetch('Ada Example') and checkpoint.should_fetch('Nobody')
+    finally:
+        checkpoint.close()
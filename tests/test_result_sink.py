@@ -0,0 +1,86 @@
+import math
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from result_sink import CsvSink, iter_output_chunks, open_sink, output_snapshot, parquet_directory, parquet_parts
+
+
+def test_batches_are_appended_without_rewriting_what_is_on_disk(tmp_path):
+    path = str(tmp_path / 'rows.csv')
+    sink = CsvSink(path, ['title', 'year'])
+    sink.write_rows([{'title': 'First paper', 'year': 2020}])
+    sink.close()
+    first_batch = open(path, 'rb').read()
+
+    sink = CsvSink(path, ['title', 'year'])
+    sink.write_rows([{'title': 'Second paper', 'year': math.nan}, {'title': 'Third, with a comma', 'year': 2022}])
+    sink.close()
+    data = open(path, 'rb').read()
+    assert data.startswith(first_batch)
+    assert data.count(b'title,year') == 1
+    chunk = next(iter_output_chunks(path, ['title', 'year']))
+    assert list(chunk['title']) == ['First paper', 'Second paper', 'Third, with a comma']
+    # A missing value is an empty cell, as pandas writes it
+    assert math.isnan(chunk['year'][1])
+
+
+def test_reopening_under_an_older_header_keeps_its_columns(tmp_path):
+    path = str(tmp_path / 'rows.csv')
+    sink = CsvSink(path, ['title'])
+    sink.write_rows([{'title': 'First paper'}])
+    sink.close()
+
+    sink = CsvSink(path, ['title', 'Cluster ID'])
+    sink.write_rows([{'title': 'Second paper', 'Cluster ID': '1000000'}])
+    sink.close()
+    chunk = next(iter_output_chunks(path, ['title', 'Cluster ID']))
+    assert list(chunk['title']) == ['First paper', 'Second paper']
+    assert chunk['Cluster ID'].isna().all()
+
+
+def test_reading_since_a_snapshot_returns_only_the_newer_rows(tmp_path):
+    path = str(tmp_path / 'rows.csv')
+    sink = CsvSink(path, ['title'])
+    sink.write_rows([{'title': 'First paper'}])
+    seen = output_snapshot(path)
+    sink.write_rows([{'title': 'Second paper'}])
+    sink.close()
+    chunks = list(iter_output_chunks(path, ['title'], since=seen))
+    assert [title for chunk in chunks for title in chunk['title']] == ['Second paper']
+    assert list(iter_output_chunks(path, ['title'], since=output_snapshot(path))) == []
+
+
+def test_parquet_keeps_nested_fields_typed(tmp_path):
+    path = str(tmp_path / 'paper_details.csv')
+    sink = open_sink(path, ['title', 'Total Citations', 'Annual Citations'], 'both', 'paper_details')
+    sink.write_rows([{'title': 'First paper', 'Total Citations': '1,234', 'Annual Citations': {'2020': '5', '2021': 7}}])
+    sink.write_rows([{'title': 'Second paper', 'Total Citations': math.nan, 'Annual Citations': {}}])
+    sink.close()
+
+    parts = parquet_parts(parquet_directory(path))
+    assert len(parts) == 2 and not [name for name in os.listdir(parquet_directory(path)) if name.endswith('.tmp')]
+    table = pq.read_table(parquet_directory(path))
+    assert table.schema.field('Annual Citations').type.value_type == pa.struct([('year', pa.int32()), ('citations', pa.int64())])
+    assert table.column('Total Citations').to_pylist() == [1234, None]
+    assert table.column('Annual Citations').to_pylist() == [
+        [{'year': 2020, 'citations': 5}, {'year': 2021, 'citations': 7}], []]
+    # The CSV written alongside holds the same rows
+    assert list(next(iter_output_chunks(path, ['title']))['title']) == ['First paper', 'Second paper']
+
+
+def test_parquet_output_reads_back_like_the_csv(tmp_path):
+    path = str(tmp_path / 'title_search.csv')
+    sink = open_sink(path, ['Matched Title', 'Cluster ID'], 'parquet', 'title_search')
+    sink.write_rows([{'Matched Title': 'First paper', 'Cluster ID': '1000000'}])
+    seen = output_snapshot(path)
+    sink.write_rows([{'Matched Title': 'Second paper'}])
+    sink.close()
+    assert not os.path.exists(path)
+    chunks = list(iter_output_chunks(path, ['Matched Title', 'Cluster ID', 'Not in the schema'], 'parquet'))
+    rows = [row for chunk in chunks for row in chunk.to_dict('records')]
+    assert [row['Matched Title'] for row in rows] == ['First paper', 'Second paper']
+    assert rows[0]['Cluster ID'] == '1000000'
+    newer = list(iter_output_chunks(path, ['Matched Title'], 'parquet', since=seen))
+    assert [title for chunk in newer for title in chunk['Matched Title']] == ['Second paper']
@@ -0,0 +1,153 @@
+import asyncio
+import importlib
+import os
+import threading
+
+import pytest
+
+import parse_pool
+from make_fixtures import PAGE_HEAD, PAGE_TAIL
+from scholar_fetch import AsyncFetcher, HttpFirstFetcher
+from scholar_parser import parse_html
+from title_index import TitleIndex, result_entries
+
+stage3 = importlib.import_module('3_title_google_search')
+stage4 = importlib.import_module('4_cited_articles_request')
+
+
+def entry(title, cluster):
+    return {'Matched Title': title, 'URL': f"https://example.org/{cluster}", 'Abstract': None,
+            'Cited Articles URL': f"https://scholar.google.com/scholar?cites={cluster}&as_sdt=2005&sciodt=0,5&hl=en",
+            'Cited By Count': 10, 'Authors with URLs': {}}
+
+
+def make_index(tmp_path):
+    index = TitleIndex(str(tmp_path / 'titles.sqlite3'))
+    index.add([entry('Learning to segment images: Part I', '111'),
+               entry('Proceedings of the 2019 IEEE Conference on Computer Vision and Pattern Recognition', '222')])
+    return index
+
+
+def test_exact_title_is_found_whatever_its_quoting_and_case(tmp_path):
+    index = make_index(tmp_path)
+    found = index.lookup('"Learning to Segment Images:  Part I"')
+    assert found['Cited Articles URL'].startswith('https://scholar.google.com/scholar?cites=111')
+
+
+def test_similar_title_is_not_an_automatic_hit(tmp_path):
+    index = make_index(tmp_path)
+    assert index.lookup('Learning to segment images: Part II') is None
+    assert index.lookup('Proceedings of the 2018 IEEE Conference on Computer Vision and Pattern Recognition') is None
+
+
+def test_near_match_needs_the_papers_own_cluster(tmp_path):
+    index = make_index(tmp_path)
+    assert index.near_match('Learning to segment images: Part II', None) is None
+    assert index.near_match('Learning to segment images: Part II', '999') is None
+    # A typo in the query is still answered when the cluster shows it is the same paper
+    found = index.near_match('Proceedings of the 2019 IEEE Conference on Computer Vison and Pattern Recognition', '222')
+    assert found['Matched Title'].startswith('Proceedings of the 2019')
+
+
+def test_index_entries_carry_the_abstract_stage3_would_return(tmp_path):
+    # A snippet with inline tags, as Scholar marks the query words in it
+    title = 'Deep learning for citation graph analysis'
+    page = (PAGE_HEAD + '<div class="gs_r gs_or gs_scl"><div class="gs_ri"><h3 class="gs_rt">'
+            f'<a href="https://example.org/paper">{title}</a></h3><div class="gs_fma_snp"><div class="gsh_small">'
+            '<div class="gsh_csp">We study <b>citation</b> graphs, at scale.</div></div></div></div></div>' + PAGE_TAIL)
+    soup = parse_html(page)
+    indexed, = result_entries(soup)
+    assert indexed['Abstract'] == stage3.extract_search_details(soup, title)['Abstract']
+    assert indexed['Abstract'] == 'We study citation graphs, at scale.'
+
+
+@pytest.fixture
+def parse_worker(monkeypatch, tmp_path):
+    # A real spawned parse worker, which reads every setting as written in the module files
+    monkeypatch.setattr(parse_pool, 'parse_workers', 1)
+    monkeypatch.chdir(tmp_path)
+    yield
+    parse_pool.close_parse_pool()
+
+
+def indexed_titles(path):
+    index = TitleIndex(path)
+    try:
+        return [key for (key,) in index.db.execute('SELECT key FROM entries')]
+    finally:
+        index.close()
+
+
+@pytest.mark.stand_in(cited_by_total=45)
+def test_stage4_indexes_cited_titles_where_the_caller_says(scholar, parse_worker, monkeypatch, tmp_path):
+    path = str(tmp_path / 'run_index.sqlite3')
+    monkeypatch.setattr(stage4, 'title_index_path', path)
+    monkeypatch.setattr(stage4, 'cache_directory', str(tmp_path / 'page_cache'))
+    row = {'Original Title': 'A paper', 'URL': 'https://example.org/paper',
+           'Cited Articles URL': f"{scholar}/scholar?cites=1234567&hl=en", 'Cited By Count': None}
+
+    async def run():
+        async with AsyncFetcher(requests_per_second=1000) as fetcher:
+            return await stage4.scrape_cited_articles(fetcher, row)
+
+    assert len(asyncio.run(run())) == 45
+    assert len(indexed_titles(path)) > 0
+    # Nothing went to the default index the worker would have opened on its own
+    assert not os.path.exists(tmp_path / 'title_index.sqlite3')
+
+
+@pytest.mark.stand_in(cited_by_total=45)
+def test_stage4_writes_each_papers_titles_once_off_the_event_loop(scholar, parse_worker, monkeypatch, tmp_path):
+    monkeypatch.setattr(stage4, 'title_index_path', str(tmp_path / 'run_index.sqlite3'))
+    monkeypatch.setattr(stage4, 'cache_directory', str(tmp_path / 'page_cache'))
+    writes = []
+    add = TitleIndex.add
+
+    def recorded_add(index, entries):
+        writes.append((threading.get_ident(), len(entries)))
+        add(index, entries)
+
+    monkeypatch.setattr(TitleIndex, 'add', recorded_add)
+    row = {'Original Title': 'A paper', 'URL': 'https://example.org/paper',
+           'Cited Articles URL': f"{scholar}/scholar?cites=1234567&hl=en", 'Cited By Count': None}
+
+    async def run():
+        async with AsyncFetcher(requests_per_second=1000) as fetcher:
+            return await stage4.scrape_cited_articles(fetcher, row)
+
+    assert len(asyncio.run(run())) == 45
+    # Three pages, one write, and not from this thread, which ran the event loop
+    assert len(writes) == 1
+    assert writes[0][0] != threading.get_ident()
+    assert writes[0][1] > 20
+
+
+@pytest.mark.stand_in(cited_by_total=45)
+def test_stage4_leaves_the_index_alone_when_the_caller_turns_it_off(scholar, parse_worker, monkeypatch, tmp_path):
+    monkeypatch.setattr(stage4, 'use_title_index', False)
+    monkeypatch.setattr(stage4, 'cache_directory', str(tmp_path / 'page_cache'))
+    row = {'Original Title': 'A paper', 'URL': 'https://example.org/paper',
+           'Cited Articles URL': f"{scholar}/scholar?cites=1234567&hl=en", 'Cited By Count': None}
+
+    async def run():
+        async with AsyncFetcher(requests_per_second=1000) as fetcher:
+            return await stage4.scrape_cited_articles(fetcher, row)
+
+    assert len(asyncio.run(run())) == 45
+    assert not os.path.exists(tmp_path / 'title_index.sqlite3')
+
+
+@pytest.mark.stand_in()
+def test_stage3_indexes_the_results_page_in_the_calling_process(scholar, parse_worker, monkeypatch, tmp_path):
+    path = str(tmp_path / 'run_index.sqlite3')
+    monkeypatch.setattr(stage3, 'title_index_path', path)
+    monkeypatch.setattr(stage3, 'scholar_search_url', f"{scholar}/scholar?q=")
+    fetcher = HttpFirstFetcher(driver_factory=None, requests_per_second=1000)
+    try:
+        rows = stage3.search_title_row(fetcher, {'title': 'Deep learning for citation graph analysis',
+                                                 'paper url': 'https://example.org/paper'})
+    finally:
+        fetcher.close()
+    assert rows[0]['Matched Title'] == 'Deep learning for citation graph analysis'
+    assert 'deep learning for citation graph analysis' in indexed_titles(path)
+    assert not os.path.exists(tmp_path / 'title_index.sqlite3')
@@ -0,0 +1,211 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+
+from scholar_ids import cluster_id, has_value
+from scholar_parser import cited_by_count
+
+'''Index settings'''
+index_path = 'title_index.sqlite3'
+# Jaccard similarity of character 3-grams for a near-match candidate; None for exact only. A near match
+# is only used when it carries the paper's own cluster id: "Part I" and "Part II" score above 0.98
+near_match_threshold = 0.9
+
+# MinHash signature split into bands; titles sharing any band become candidates, which are then
+# checked exactly. 8 bands of 8 find 99% of pairs at 0.9 similarity and few below 0.5
+MINHASH_BANDS = 8
+MINHASH_ROWS = 8
+MINHASH_PRIME = 4294967311
+MINHASH_A, MINHASH_B = np.random.default_rng(20240601).integers(1, 2 ** 31, size=(2, MINHASH_BANDS * MINHASH_ROWS),
+                                                                  dtype=np.uint64)
+
+
+# Function to replace problematic characters with ASCII equivalents and remove surrounding quotes
+def normalize_text(text):
+    # Normalize Unicode (NFKD) and replace special characters with standard ones
+    text = unicodedata.normalize('NFKD', text)
+    text = text.replace("’", "'")  # Replace right single quote with ASCII apostrophe
+    text = text.replace("“", '"').replace("”", '"')  # Replace smart quotes with ASCII quotes
+    text = text.replace("–", "-")  # Replace en dash with hyphen
+    text = ' '.join(text.split())  # Remove extra spaces
+
+    # Remove any enclosing quotes (single or double)
+    if text.startswith('"') and text.endswith('"'):
+        text = text[1:-1]
+    elif text.startswith("'") and text.endswith("'"):
+        text = text[1:-1]
+
+    return text
+
+
+def title_key(title):
+    # The comparison stage 3 makes between a query and a result title: markers like [PDF] removed,
+    # then normalised and lower-cased
+    return normalize_text(re.sub(r'\[.*?\]', '', normalize_text(title)).lower())
+
+
+'''MinHash over character 3-grams'''
+def shingles(key):
+    grams = {key[i:i + 3] for i in range(max(len(key) - 2, 1))}
+    return {zlib.crc32(gram.encode('utf-8')) for gram in grams}
+
+
+def band_buckets(grams):
+    # One bucket per band; ints hash the same in every process, unlike strings
+    values = np.fromiter(grams, dtype=np.uint64, count=len(grams))
+    signature = ((np.outer(values, MINHASH_A) + MINHASH_B) % MINHASH_PRIME).min(axis=0)
+    return [hash(tuple(signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS].tolist()))
+            for band in range(MINHASH_BANDS)]
+
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second) if first or second else 1.0
+
+
+'''One result on a Scholar results page, in the shape stage 3 returns'''
+def extract_abstract(result):
+    # The snippet under a result, from whichever layout Scholar used for it; stage 3 reads it the same way
+    snippet = result.find('div', class_='gsh_csp')
+    if snippet:
+        return snippet.text.strip()
+    # Includes the `gs_rs gs_fma_s` form
+    snippet = result.find('div', class_='gs_rs')
+    if snippet:
+        return snippet.get_text(separator=" ").strip()
+    # Complex abstract structure in `gs_fma_snp`
+    container = result.find('div', class_='gs_fma_snp')
+    if container:
+        return ' '.join([div.text.strip() for div in container.find_all('div', class_='gsh_csp') if div.text.strip()])
+    return None
+
+
+def extract_result_entry(result):
+    title_tag = result.find('h3', class_='gs_rt')
+    if not title_tag:
+        return None
+    title = ' '.join(re.sub(r'\[.*?\]', '', normalize_text(title_tag.get_text(separator=""))).split())
+    if not title:
+        return None
+    link = title_tag.find('a')
+
+    cited_by_tag = result.find('a', text=lambda x: x and (x.startswith('Cited by') or x.startswith('被引用次数')))
+    authors_with_urls = {}
+    authors_tag = result.find('div', class_=['gs_a', 'gs_fmaa'])
+    if authors_tag:
+        for author_link in authors_tag.find_all('a'):
+            author_url = f"https://scholar.google.com{author_link['href']}" if author_link.has_attr('href') else None
+            authors_with_urls[author_link.get_text(strip=True)] = author_url
+
+    return {
+        'Matched Title': title,
+        'URL': link['href'] if link else None,
+        'Abstract': extract_abstract(result),
+        'Cited Articles URL': f"https://scholar.google.com{cited_by_tag['href']}" if cited_by_tag else None,
+        'Cited By Count': cited_by_count(cited_by_tag),
+        'Authors with URLs': authors_with_urls,
+    }
+
+
+def result_entries(soup):
+    # Every result on a parsed search or cited-by page; parse workers return these for the writer to index
+    results = soup.find_all('div', class_=['gs_r gs_or gs_scl', 'gs_r gs_or gs_scl gs_fmar'])
+    entries = []
+    for result in results:
+        try:
+            entry = extract_result_entry(result)
+        except Exception as e:
+            print(f"Error indexing a result: {e}")
+            continue
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+
+'''Persistent index of every result title seen on a results page, kept in SQLite'''
+class TitleIndex:
+    def __init__(self, path=index_path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, title TEXT, url TEXT, abstract TEXT, cited_url TEXT, cited_by INTEGER,
+            authors TEXT, updated_at REAL) WITHOUT ROWID''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS bands (
+            band INTEGER, bucket INTEGER, key TEXT, PRIMARY KEY (band, bucket, key)) WITHOUT ROWID''')
+        self.db.commit()
+
+    def add(self, entries):
+        now = time.time()
+        rows, band_rows = [], []
+        for entry in entries:
+            key = title_key(entry['Matched Title'])
+            rows.append((key, entry['Matched Title'], entry['URL'], entry['Abstract'], entry['Cited Articles URL'],
+                         entry['Cited By Count'], json.dumps(entry['Authors with URLs']), now))
+            band_rows += [(band, bucket, key) for band, bucket in enumerate(band_buckets(shingles(key)))]
+        with self.lock:
+            # Titles shared by several papers keep the most cited one, which a search would list first
+            self.db.executemany('''INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET title = excluded.title, url = excluded.url, abstract = excluded.abstract,
+                cited_url = excluded.cited_url, cited_by = excluded.cited_by, authors = excluded.authors,
+                updated_at = excluded.updated_at
+                WHERE COALESCE(excluded.cited_by, 0) >= COALESCE(entries.cited_by, 0)''', rows)
+            self.db.executemany('INSERT OR IGNORE INTO bands VALUES (?, ?, ?)', band_rows)
+            self.db.commit()
+
+    def entry(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT title, url, abstract, cited_url, cited_by, authors FROM entries WHERE key = ?',
+                                  (key,)).fetchone()
+        if row is None:
+            return None
+        title, url, abstract, cited_url, cited_by, authors = row
+        return {'Matched Title': title, 'URL': url, 'Abstract': abstract, 'Cited Articles URL': cited_url,
+                'Cited By Count': cited_by, 'Authors with URLs': json.loads(authors) if authors else {}}
+
+    def near_key(self, key, threshold):
+        # The indexed title most similar to key, if any reaches the threshold
+        grams = shingles(key)
+        query = ' UNION '.join(['SELECT key FROM bands WHERE band = ? AND bucket = ?'] * MINHASH_BANDS)
+        parameters = [value for pair in enumerate(band_buckets(grams)) for value in pair]
+        with self.lock:
+            candidates = [candidate for (candidate,) in self.db.execute(query, parameters)]
+        scored = [(jaccard(grams, shingles(candidate)), candidate) for candidate in candidates]
+        scored = [pair for pair in scored if pair[0] >= threshold]
+        return max(scored)[1] if scored else None
+
+    def lookup(self, title):
+        # A stage 3 result for title from the index, or None when a search is still needed
+        return self.entry(title_key(title))
+
+    def near_match(self, title, cluster, threshold=near_match_threshold):
+        # The most similar indexed title, only if its "Cited by" link names the given cluster
+        if not threshold or not has_value(cluster):
+            return None
+        near = self.near_key(title_key(title), threshold)
+        found = self.entry(near) if near is not None else None
+        if found is None or cluster_id(found['Cited Articles URL']) != cluster:
+            return None
+        return found
+
+    def close(self):
+        self.db.close()
+
+
+# One handle per process and index file, shared by that process's threads
+open_indexes = {}
+open_indexes_lock = threading.Lock()
+
+
+def open_title_index(path=index_path):
+    with open_indexes_lock:
+        handle = open_indexes.get((os.getpid(), path))
+        if handle is None:
+            handle = open_indexes[(os.getpid(), path)] = TitleIndex(path)
+        return handle